@@ -9,10 +9,11 @@ from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .authentication import BearerTokenAuthentication
+from audio_transcribe.tracing import TracedViewMixin
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class LoginView(APIView):
+class LoginView(TracedViewMixin, APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
@@ -53,7 +54,7 @@ class LoginView(APIView):
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class LogoutView(APIView):
+class LogoutView(TracedViewMixin, APIView):
     authentication_classes = [BearerTokenAuthentication]
     permission_classes = [IsAuthenticated]
     
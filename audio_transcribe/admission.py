@@ -0,0 +1,354 @@
+import os
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Transcription, SchedulerLock
+from .circuit_breaker import CircuitOpenError
+from .probe import suggested_poll_interval
+from . import assemblyai, direct_upload, tracing
+from .throttling import refund_job_audio, settle_audio_charge
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_LOCK = 'upstream_admission'
+ANONYMOUS_USERNAME = 'anonymous_user'
+LOCAL_ID_PREFIX = 'local_'
+SPOOL_DIR = 'spool'
+
+# Job waiting for an upstream slot, and job holding a slot while it is being submitted
+PENDING_SUBMIT = 'pending_submit'
+SUBMITTING = 'submitting'
+
+# Statuses that occupy one of the MAX_UPSTREAM_JOBS slots
+ACTIVE_STATUSES = (SUBMITTING, 'queued', 'processing')
+
+# Scheduling cost assumed for audio whose duration could not be probed
+DEFAULT_JOB_SECONDS = 60
+
+# Backend of the jobs admitted here (see backends.py)
+UPSTREAM_BACKEND = 'assemblyai'
+
+# Threads submitting jobs this process accepted, started on first use
+_submitter = None
+_submitter_lock = threading.Lock()
+
+
+@contextmanager
+def admission_lock():
+    """Serialize admission decisions across workers and dynos with a row lock"""
+    with transaction.atomic():
+        # An UPDATE takes the row (or, on SQLite, database) write lock until commit
+        locked = SchedulerLock.objects.filter(name=ADMISSION_LOCK).update(acquired_at=timezone.now())
+        if not locked:
+            try:
+                with transaction.atomic():
+                    SchedulerLock.objects.create(name=ADMISSION_LOCK, acquired_at=timezone.now())
+            except IntegrityError:
+                SchedulerLock.objects.filter(name=ADMISSION_LOCK).update(acquired_at=timezone.now())
+        yield
+
+
+def active_upstream_jobs():
+    """Number of jobs currently holding an upstream slot"""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPSTREAM_SLOT_TTL)
+    return Transcription.objects.filter(
+        status__in=ACTIVE_STATUSES, submitted_at__gte=cutoff, backend=UPSTREAM_BACKEND
+    ).count()
+
+
+def user_weight(user):
+    """Share of upstream capacity a user's jobs are scheduled with"""
+    if user.username == ANONYMOUS_USERNAME:
+        return settings.ADMISSION_ANONYMOUS_WEIGHT
+    return settings.ADMISSION_AUTHENTICATED_WEIGHT
+
+
+def local_transcript_id():
+    return f"{LOCAL_ID_PREFIX}{uuid.uuid4().hex}"
+
+
+def reserve_slot(user, audio_duration, language_code, auto_detect, audio_url=''):
+    """Claim an upstream slot for immediate submission, or return None if the job has to queue"""
+    with admission_lock():
+        # Nobody skips ahead of jobs that are already waiting
+        if Transcription.objects.filter(status=PENDING_SUBMIT).exists():
+            return None
+        if active_upstream_jobs() >= settings.MAX_UPSTREAM_JOBS:
+            return None
+
+        return Transcription.objects.create(
+            transcript_id=local_transcript_id(),
+            user=user,
+            status=SUBMITTING,
+            audio_url=audio_url,
+            language_code=language_code,
+            auto_detect=auto_detect,
+            audio_duration=audio_duration,
+            submitted_at=timezone.now(),
+            trace_parent=tracing.current_traceparent()
+        )
+
+
+def _queue_key(user, audio_duration):
+    """Virtual finish time of a new job for user, called with the admission lock held"""
+    lock = SchedulerLock.objects.get(name=ADMISSION_LOCK)
+    last_user_key = Transcription.objects.filter(
+        status=PENDING_SUBMIT, user=user
+    ).aggregate(Max('queue_key'))['queue_key__max']
+
+    # Weighted fair queuing: a job finishes (in virtual time) one cost after the
+    # later of "now" and the user's previous queued job. Costs are scaled by the
+    # audio length, so short clips also come before long files.
+    start = max(lock.virtual_time, last_user_key or 0)
+    return start + (audio_duration or DEFAULT_JOB_SECONDS) / user_weight(user)
+
+
+def enqueue(user, file_path, filename, audio_duration, language_code, auto_detect, audio_url='', spool_name=None):
+    """
+    Spool the audio and queue the job in weighted fair order. Audio already
+    in storage is queued as spool_name, and remote audio as audio_url.
+    """
+    spooled_here = spool_name is None and file_path is not None
+    if spooled_here:
+        spool_name = spool_audio(file_path, filename)
+    try:
+        with admission_lock():
+            job = Transcription.objects.create(
+                transcript_id=local_transcript_id(),
+                user=user,
+                status=PENDING_SUBMIT,
+                audio_url=audio_url,
+                language_code=language_code,
+                auto_detect=auto_detect,
+                audio_duration=audio_duration,
+                spool_file=spool_name,
+                queue_key=_queue_key(user, audio_duration),
+                trace_parent=tracing.current_traceparent()
+            )
+    except Exception:
+        if spooled_here:
+            discard_spool(spool_name)
+        raise
+
+    logger.info(f"Queued {job.transcript_id} for user {user.username} at virtual time {job.queue_key:.2f}")
+    return job
+
+
+def requeue(job):
+    """Queue a spooled job that another backend could not finish for submission upstream"""
+    with admission_lock():
+        job.backend = UPSTREAM_BACKEND
+        job.set_status(PENDING_SUBMIT)
+        job.submitted_at = None
+        job.queue_key = _queue_key(job.user, job.audio_duration)
+        job.save(update_fields=['backend', 'status', 'version', 'submitted_at', 'queue_key'])
+    logger.info(f"Queued {job.transcript_id} for submission upstream at virtual time {job.queue_key:.2f}")
+    return job
+
+
+def queue_position(job):
+    """1-based position of a waiting job in the submission queue"""
+    if job.status != PENDING_SUBMIT:
+        return 0
+    return Transcription.objects.filter(status=PENDING_SUBMIT, queue_key__lt=job.queue_key).count() + 1
+
+
+def pending_result(job):
+    """Status response for a job that has not reached AssemblyAI yet"""
+    if job.status == PENDING_SUBMIT:
+        position = queue_position(job)
+        message = f'Your audio is waiting for a transcription slot (position {position} in queue)'
+    else:
+        position = 0
+        message = 'Your audio is being submitted for transcription'
+
+    return {
+        'status': job.status,
+        'progress': 0,
+        'queue_position': position,
+        'audio_duration': job.audio_duration,
+        'message': message
+    }
+
+
+def dispatch_pending(limit=None):
+    """Submit queued jobs upstream while slots are free and return how many were submitted"""
+    dispatched = 0
+    while limit is None or dispatched < limit:
+        # Leave jobs queued rather than failing them while AssemblyAI is down
+        if assemblyai.breaker.is_open():
+            break
+
+        with admission_lock():
+            if active_upstream_jobs() >= settings.MAX_UPSTREAM_JOBS:
+                break
+            job = Transcription.objects.filter(status=PENDING_SUBMIT).order_by('queue_key', 'created_at').first()
+            if job is None:
+                break
+            job.set_status(SUBMITTING)
+            job.submitted_at = timezone.now()
+            job.save(update_fields=['status', 'version', 'submitted_at'])
+            SchedulerLock.objects.filter(name=ADMISSION_LOCK).update(virtual_time=job.queue_key)
+
+        try:
+            with tracing.job_span(job, 'admission.submit', queue_key=job.queue_key):
+                submit_job(job)
+        except CircuitOpenError:
+            logger.warning(f"AssemblyAI unavailable, returning {job.transcript_id} to the queue")
+            job.set_status(PENDING_SUBMIT)
+            job.submitted_at = None
+            job.save(update_fields=['status', 'version', 'submitted_at'])
+            break
+        except Exception as e:
+            logger.error(f"Failed to submit queued job {job.transcript_id}: {str(e)}")
+            job.set_status('error')
+            job.error = str(e)
+            job.save(update_fields=['status', 'version', 'error'])
+            discard_spool(job.spool_file)
+            refund_job_audio(job)
+        dispatched += 1
+
+    return dispatched
+
+
+def sweep_submitting():
+    """
+    Requeue jobs left SUBMITTING for SUBMIT_LEASE_SECONDS by a process that
+    died or was killed mid-submission, and return how many were swept. Jobs
+    whose audio only existed in that process, such as uploads submitted
+    straight from the request, are failed instead, as are jobs interrupted
+    JOB_MAX_ATTEMPTS times.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.SUBMIT_LEASE_SECONDS)
+    swept = 0
+    for job in Transcription.objects.filter(status=SUBMITTING, submitted_at__lt=cutoff):
+        with admission_lock():
+            # Its submission may have finished, or another worker swept it, since it was read
+            if not Transcription.objects.filter(pk=job.pk, status=SUBMITTING, submitted_at=job.submitted_at).exists():
+                continue
+            job.attempts += 1
+            if (job.spool_file or job.audio_url) and job.attempts < settings.JOB_MAX_ATTEMPTS:
+                logger.warning(f"Submission of {job.transcript_id} was interrupted, queueing it again")
+                job.save(update_fields=['attempts'])
+                requeue(job)
+            else:
+                logger.error(f"Submission of {job.transcript_id} was interrupted and cannot be retried")
+                job.set_status('error')
+                job.error = 'Submission to the transcription service was interrupted, please upload the audio again'
+                job.save(update_fields=['attempts', 'status', 'version', 'error'])
+                discard_spool(job.spool_file)
+                refund_job_audio(job)
+        swept += 1
+    return swept
+
+
+def submit_soon():
+    """
+    Dispatch the next queued job from a background thread, so a job accepted
+    by this process goes upstream without waiting for the job workers' next
+    pass. The job submitted is whichever is next in fair order, which need
+    not be the one just accepted.
+    """
+    global _submitter
+    with _submitter_lock:
+        if _submitter is None:
+            _submitter = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_SUBMISSION_THREADS, thread_name_prefix='submit'
+            )
+    _submitter.submit(_dispatch_one)
+
+
+def _dispatch_one():
+    try:
+        dispatch_pending(limit=1)
+    except Exception as e:
+        logger.error(f"Background submission failed: {str(e)}")
+    finally:
+        # This thread is not a request, so nothing else closes its connection
+        connection.close()
+
+
+def submit_job(job, file_path=None, use_upstream_id=False):
+    """Upload the audio and create the upstream transcript for a job holding a slot"""
+    stored_url = None
+    if file_path is None and job.spool_file:
+        stored_url = direct_upload.fetchable_url(job.spool_file)
+
+    if file_path is None and job.spool_file is None:
+        # Remote audio is fetched by AssemblyAI itself
+        upload_url = job.audio_url
+    elif stored_url:
+        # As is audio in an object store, which is kept until the transcript is done
+        upload_url = stored_url
+    else:
+        if file_path is None:
+            file_path = spool_to_tempfile(job.spool_file)
+        # upload_file removes file_path once it has been sent
+        upload_url = assemblyai.upload_file(file_path)
+    language_code = None if job.language_code == 'auto' else job.language_code
+    response = assemblyai.create_transcript(upload_url, language_code, job.auto_detect)
+    settle_audio_charge(job)
+
+    spool_name = None if stored_url else job.spool_file
+    job.upstream_id = response['id']
+    if use_upstream_id:
+        # The client has not seen our local id yet, so expose AssemblyAI's directly
+        job.transcript_id = response['id']
+    job.audio_url = upload_url
+    job.set_status('queued')
+    if not stored_url:
+        job.spool_file = None
+    # Job workers first poll it once AssemblyAI could have made progress
+    job.next_poll_at = timezone.now() + timedelta(seconds=suggested_poll_interval(job.audio_duration))
+    job.save()
+    discard_spool(spool_name)
+
+    logger.info(f"Submitted {job.transcript_id} upstream as {job.upstream_id}")
+    return job
+
+
+def snapshot():
+    """Admission state for the metrics endpoint"""
+    return {
+        'active_upstream_jobs': active_upstream_jobs(),
+        'max_upstream_jobs': settings.MAX_UPSTREAM_JOBS,
+        'pending_submit': Transcription.objects.filter(status=PENDING_SUBMIT).count(),
+    }
+
+
+def spool_audio(file_path, filename):
+    """Copy audio into storage until it can be submitted"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    with open(file_path, 'rb') as f:
+        return default_storage.save(f"{SPOOL_DIR}/{uuid.uuid4().hex}{ext}", File(f))
+
+
+def spool_to_tempfile(spool_name):
+    """Copy spooled audio to a local temp file for upload"""
+    temp_file = NamedTemporaryFile(delete=False)
+    with default_storage.open(spool_name, 'rb') as f:
+        for chunk in f.chunks():
+            temp_file.write(chunk)
+    temp_file.close()
+    return temp_file.name
+
+
+def discard_spool(spool_name):
+    if not spool_name:
+        return
+    try:
+        default_storage.delete(spool_name)
+    except Exception as e:
+        logger.warning(f"Failed to remove spooled audio {spool_name}: {str(e)}")
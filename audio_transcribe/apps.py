@@ -1,6 +1,33 @@
+import logging
+import os
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class AudioTranscribeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'audio_transcribe'
+
+    def ready(self):
+        from django.db.models.signals import post_delete
+        from .models import Transcription
+        from . import usage
+
+        # Deletes cascading from a user or run on a queryset don't go through Transcription.delete
+        post_delete.connect(usage.record_delete, sender=Transcription, dispatch_uid='usage_record_delete')
+
+        self.warn_about_per_process_cache()
+
+    def warn_about_per_process_cache(self):
+        """Rate limits, quotas and the circuit breaker only hold across workers that share a cache"""
+        from django.conf import settings
+
+        backend = settings.CACHES['default']['BACKEND']
+        workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+        if backend.endswith('LocMemCache') and workers > 1:
+            logger.warning(
+                f"REDIS_URL is not set, so each of the {workers} web workers keeps its own cache: "
+                f"rate limits, audio quotas and the circuit breaker are counted per worker"
+            )
@@ -0,0 +1,92 @@
+"""
+Derived views of a transcript, rendered once when it completes.
+
+A completed transcript no longer changes, yet its list entry, subtitles and
+plain text used to be rebuilt from the stored result on every read. They
+are now rendered when the transcript completes and kept as bytes in
+TranscriptArtifact, so reads only copy them out. Each artifact records the
+version of the transcription it was rendered from; one whose transcription
+has changed since is ignored and rendered again.
+"""
+import logging
+
+from django.db import transaction
+
+from .models import TranscriptArtifact, TranscriptTimeline
+from .export import build_cues, render_srt, render_vtt
+from .fieldsets import list_entry
+from .streaming import dumps
+
+logger = logging.getLogger(__name__)
+
+LIST_ENTRY = 'list_entry'
+TEXT = 'txt'
+SRT = 'srt'
+VTT = 'vtt'
+
+# Artifacts that can be downloaded on their own, with their content types
+DOWNLOAD_TYPES = {
+    TEXT: 'text/plain; charset=utf-8',
+    SRT: 'application/x-subrip',
+    VTT: 'text/vtt; charset=utf-8',
+}
+
+# Artifacts that need the word timings
+TIMED_KINDS = (SRT, VTT)
+
+
+def speaker_text(transcription, timeline):
+    """Plain text of a transcript, one paragraph per utterance labelled with its speaker"""
+    utterances = timeline.utterances if timeline else None
+    if not utterances:
+        return transcription.text or ''
+    return '\n\n'.join(f"Speaker {utterance.get('speaker')}: {utterance.get('text', '')}" for utterance in utterances)
+
+
+def render(transcription, timeline, kind):
+    """Content of one artifact of a completed transcript, or None if it has nothing to render it from"""
+    if kind == LIST_ENTRY:
+        return dumps(list_entry(transcription))
+    if kind == TEXT:
+        return speaker_text(transcription, timeline).encode('utf-8')
+    if timeline is None:
+        return None
+    cues = build_cues(timeline.words.words())
+    return (render_srt(cues) if kind == SRT else render_vtt(cues)).encode('utf-8')
+
+
+def store_artifacts(transcription, timeline=None):
+    """Render and keep every artifact of a transcript that has just completed"""
+    # Values as they were saved, e.g. a float audio_duration the result gave as an int,
+    # so stored list entries are the same as ones built from a read
+    transcription.refresh_from_db()
+    artifacts = []
+    for kind in (LIST_ENTRY, TEXT, *TIMED_KINDS):
+        content = render(transcription, timeline, kind)
+        if content is not None:
+            artifacts.append(TranscriptArtifact(
+                transcription=transcription, kind=kind, version=transcription.version, content=content
+            ))
+    with transaction.atomic():
+        TranscriptArtifact.objects.filter(transcription=transcription).delete()
+        TranscriptArtifact.objects.bulk_create(artifacts)
+    logger.info(f"Rendered {len(artifacts)} artifacts for {transcription.transcript_id}")
+
+
+def get_artifact(transcription, kind):
+    """Bytes of an artifact of a completed transcript, rendering it now if it was not kept or is stale"""
+    artifact = TranscriptArtifact.objects.filter(
+        transcription=transcription, kind=kind, version=transcription.version
+    ).values_list('content', flat=True).first()
+    if artifact is not None:
+        return bytes(artifact)
+
+    # Completed before artifacts were rendered, or changed since
+    timeline = TranscriptTimeline.objects.filter(transcription=transcription).first()
+    content = render(transcription, timeline, kind)
+    if content is not None:
+        TranscriptArtifact.objects.update_or_create(
+            transcription=transcription, kind=kind,
+            defaults={'version': transcription.version, 'content': content}
+        )
+    return content
@@ -0,0 +1,499 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+import requests
+import urllib3
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .deadline import DeadlineExceeded, call_timeout, remaining
+from . import tracing
+from .models import transcript_progress
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL = "https://api.assemblyai.com/v2/upload"
+TRANSCRIPT_URL = "https://api.assemblyai.com/v2/transcript"
+
+# (connect, read) timeouts in seconds; uploads send the whole file so get longer.
+# Calls made for a request are given less when its deadline is closer (see deadline.py)
+REQUEST_TIMEOUT = (5, 30)
+UPLOAD_TIMEOUT = (5, 45)
+
+# Bytes read at a time from a response body read against a deadline
+BODY_CHUNK_BYTES = 64 * 1024
+
+# Shared by every AssemblyAI endpoint, they fail together during an outage
+breaker = CircuitBreaker('assemblyai')
+
+# HTTP sessions are created on first use in each thread, so nothing is
+# connected at import time and forked workers never share a socket
+_local = threading.local()
+
+# Map of supported languages - Updated to match AssemblyAI's supported languages
+LANGUAGE_CODES = {
+    'en': 'en',      # English (Global)
+    'en_us': 'en',   # English (US)
+    'en_uk': 'en',   # English (UK)
+    'en_au': 'en',   # English (Australia)
+    'fr': 'fr',      # French
+    'de': 'de',      # German
+    'it': 'it',      # Italian
+    'pt': 'pt',      # Portuguese
+    'nl': 'nl',      # Dutch
+    'hi': 'hi',      # Hindi
+    'ja': 'ja',      # Japanese
+    'es': 'es',      # Spanish
+    'ko': 'ko',      # Korean
+    'pl': 'pl',      # Polish
+    'id': 'id',      # Indonesian
+    'ta': 'ta',      # Tamil
+    'te': 'te',      # Telugu
+    'tr': 'tr',      # Turkish
+    'ru': 'ru',      # Russian
+    'vi': 'vi',      # Vietnamese
+    'zh': 'zh',      # Chinese (Simplified)
+    'zh_tw': 'zh',   # Chinese (Traditional)
+    'da': 'da',      # Danish
+    'fil': 'fil',    # Filipino
+    'fi': 'fi',      # Finnish
+    'el': 'el',      # Greek
+    'hu': 'hu',      # Hungarian
+    'ml': 'ml',      # Malayalam
+    'no': 'no',      # Norwegian
+    'sv': 'sv',      # Swedish
+    'th': 'th',      # Thai
+    'uk': 'uk',      # Ukrainian
+    'bn': 'bn',      # Bengali
+    'ro': 'ro',      # Romanian
+    'si': 'si',      # Sinhala
+    'mr': 'mr',      # Marathi
+    'gu': 'gu',      # Gujarati
+    'kn': 'kn',      # Kannada
+    'ar': 'ar',      # Arabic
+    'fa': 'fa',      # Persian
+    'ur': 'ur',      # Urdu
+    'hr': 'hr',      # Croatian
+    'bg': 'bg',      # Bulgarian
+    'sr': 'sr',      # Serbian
+    'sk': 'sk',      # Slovak
+    'sl': 'sl',      # Slovenian
+    'ca': 'ca',      # Catalan
+    'he': 'he',      # Hebrew
+    'lv': 'lv',      # Latvian
+    'lt': 'lt',      # Lithuanian
+    'ne': 'ne',      # Nepali
+    'et': 'et',      # Estonian
+    'ms': 'ms',      # Malay
+    'tl': 'tl',      # Tagalog
+    'pa': 'pa',      # Punjabi
+    'sw': 'sw',      # Swahili
+    'az': 'az',      # Azerbaijani
+    'hy': 'hy',      # Armenian
+    'bs': 'bs',      # Bosnian
+    'my': 'my',      # Burmese
+    'af': 'af',      # Afrikaans
+    'ka': 'ka',      # Georgian
+    'is': 'is',      # Icelandic
+    'km': 'km',      # Khmer
+    'lo': 'lo',      # Lao
+    'mk': 'mk',      # Macedonian
+    'mn': 'mn',      # Mongolian
+    'gl': 'gl',      # Galician
+    'kk': 'kk',      # Kazakh
+}
+
+
+def api_key():
+    """The configured AssemblyAI API key, checked when AssemblyAI is first called rather than on import"""
+    if not settings.ASSEMBLYAI_API_KEY:
+        raise ImproperlyConfigured("ASSEMBLYAI_API_KEY environment variable is not set")
+    return settings.ASSEMBLYAI_API_KEY
+
+
+def auth_headers():
+    return {
+        "authorization": api_key(),
+        "content-type": "application/json"
+    }
+
+
+def session():
+    """This thread's HTTP session, keeping connections to AssemblyAI open between calls"""
+    if getattr(_local, 'session', None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+
+def _request(method, url, **kwargs):
+    """Send a request to AssemblyAI through the circuit breaker, within the current request's deadline"""
+    operation = tracing.upstream_operation(method, url)
+    with tracing.span(f"assemblyai.{operation}", tracing.CLIENT, **{'http.method': method, 'http.url': url}) as span:
+        response = _send(method, url, **kwargs)
+        if span is not None:
+            span.set('http.status_code', response.status_code)
+            if response.status_code >= 400:
+                span.fail(f"HTTP {response.status_code}")
+        return response
+
+
+def _read_body(response):
+    """
+    Read a streamed response's body before the current request's deadline.
+    Each wait on the socket gets only the time that is left, so a body sent
+    a little at a time cannot keep the request past it.
+    """
+    body = []
+    try:
+        while True:
+            left = remaining()
+            if left <= 0:
+                raise DeadlineExceeded()
+            conn = response.raw.connection
+            if conn is not None and conn.sock is not None:
+                conn.sock.settimeout(left)
+            # read1 returns whatever has arrived, read would wait for a whole chunk
+            chunk = response.raw.read1(BODY_CHUNK_BYTES, decode_content=True)
+            if not chunk:
+                break
+            body.append(chunk)
+    except (DeadlineExceeded, urllib3.exceptions.ReadTimeoutError) as e:
+        response.close()
+        raise DeadlineExceeded() from e
+    except urllib3.exceptions.HTTPError as e:
+        response.close()
+        raise requests.exceptions.ConnectionError(e, response=response) from e
+    response._content = b''.join(body)
+
+
+def _send(method, url, **kwargs):
+    kwargs['timeout'], clipped = call_timeout(kwargs.get('timeout', REQUEST_TIMEOUT))
+    if 'headers' not in kwargs:
+        kwargs['headers'] = auth_headers()
+    # Within a deadline the body is read apart from the headers, against the time left
+    bounded = remaining() is not None
+    trial = breaker.before_call()
+    started = time.monotonic()
+    try:
+        response = session().request(method, url, stream=bounded, **kwargs)
+        if bounded:
+            _read_body(response)
+    except DeadlineExceeded:
+        breaker.abandon(trial)
+        raise
+    except requests.exceptions.Timeout as e:
+        if clipped:
+            # Cut short by our own deadline, which says nothing about AssemblyAI's health
+            breaker.abandon(trial)
+            raise DeadlineExceeded() from e
+        breaker.record(False, time.monotonic() - started, trial)
+        raise
+    except requests.exceptions.RequestException:
+        breaker.record(False, time.monotonic() - started, trial)
+        raise
+    # Client errors are our fault, only throttling and server errors count against AssemblyAI
+    healthy = response.status_code < 500 and response.status_code != 429
+    breaker.record(healthy, time.monotonic() - started, trial)
+    return response
+
+
+def upload_file(file_path):
+    """Upload file to AssemblyAI"""
+    try:
+        logger.info(f"Starting file upload: {file_path}")
+
+        # Verify file exists and is readable
+        if not os.path.exists(file_path):
+            raise Exception(f"File not found: {file_path}")
+
+        # Get file size
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            raise Exception("File is empty")
+
+        logger.info(f"File size: {file_size} bytes")
+
+        # Read file content
+        with open(file_path, 'rb') as f:
+            file_data = f.read()
+
+        # Upload file directly
+        logger.info("Uploading file to AssemblyAI")
+        upload_response = _request(
+            'POST',
+            UPLOAD_URL,
+            headers={"authorization": api_key()},
+            data=file_data,
+            timeout=UPLOAD_TIMEOUT
+        )
+
+        logger.info(f"Upload response status: {upload_response.status_code}")
+        logger.info(f"Upload response: {upload_response.text}")
+
+        if upload_response.status_code != 200:
+            logger.error(f"Upload failed. Status: {upload_response.status_code}")
+            logger.error(f"Response: {upload_response.text}")
+            raise Exception(f"Upload failed: {upload_response.text}")
+
+        return upload_response.json()["upload_url"]
+
+    except (CircuitOpenError, DeadlineExceeded):
+        raise
+    except requests.exceptions.SSLError as e:
+        logger.error(f"SSL Error during upload: {str(e)}")
+        raise Exception(f"SSL Error during upload: {str(e)}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request failed: {str(e)}")
+        if hasattr(e, 'response') and e.response is not None:
+            logger.error(f"Response status: {e.response.status_code}")
+            logger.error(f"Response text: {e.response.text}")
+        raise Exception(f"Upload request failed: {str(e)}")
+    except Exception as e:
+        logger.error(f"Upload failed: {str(e)}")
+        raise Exception(f"File upload failed: {str(e)}")
+    finally:
+        # Clean up temp file if it exists
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"Cleaned up temporary file: {file_path}")
+        except Exception as e:
+            logger.warning(f"Failed to clean up temp file: {str(e)}")
+
+
+def cleanup_stuck_transcripts():
+    """Clean up stuck transcripts"""
+    try:
+        # Get list of transcripts
+        response = _request(
+            'GET',
+            "https://api.assemblyai.com/v2/transcript",
+            params={"limit": 10}
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        # Find stuck transcripts (processing for more than 10 minutes)
+        for transcript in data.get('transcripts', []):
+            if transcript['status'] == 'processing':
+                created_time = datetime.fromisoformat(transcript['created'].replace('Z', '+00:00'))
+                if (datetime.now(timezone.utc) - created_time).total_seconds() > 600:  # 10 minutes
+                    # Delete stuck transcript
+                    logger.info(f"Deleting stuck transcript {transcript['id']}")
+                    _request(
+                        'DELETE',
+                        f"https://api.assemblyai.com/v2/transcript/{transcript['id']}"
+                    )
+    except Exception as e:
+        logger.error(f"Error cleaning up transcripts: {str(e)}")
+
+
+def create_transcript(audio_url, language_code=None, auto_detect=False):
+    """Create transcription request with optional language detection"""
+    try:
+        # Clean up stuck transcripts first
+        cleanup_stuck_transcripts()
+
+        # Basic request with required fields
+        transcript_request = {
+            "audio_url": audio_url,
+        }
+
+        # Handle language detection and language code
+        if auto_detect:
+            logger.info("Using automatic language detection")
+            transcript_request["language_detection"] = True
+        elif language_code:
+            # Convert to lowercase and remove any region specifier
+            base_lang = language_code.lower().split('_')[0]
+            # Get the simplified language code
+            normalized_lang = LANGUAGE_CODES.get(base_lang) or LANGUAGE_CODES.get(language_code.lower())
+            if not normalized_lang:
+                logger.warning(f"Unsupported language code: {language_code}, defaulting to English")
+                normalized_lang = 'en'
+            logger.info(f"Using language code: {normalized_lang}")
+            transcript_request["language_code"] = normalized_lang
+        else:
+            # Default to automatic language detection if no language specified
+            logger.info("No language specified, using automatic language detection")
+            transcript_request["language_detection"] = True
+
+        # Optional parameters based on language support
+        if not language_code or language_code.startswith('en'):
+            # Full features for English or auto-detected language
+            transcript_request.update({
+                "punctuate": True,
+                "format_text": True,
+                "auto_highlights": True,
+                "speaker_labels": True,
+                "auto_chapters": True,
+                "entity_detection": True,
+                "iab_categories": True
+            })
+        else:
+            # Basic features for non-English
+            transcript_request.update({
+                "punctuate": True,
+                "format_text": True
+            })
+
+        logger.info(f"Creating transcript request for URL: {audio_url}")
+        logger.info(f"Request payload: {transcript_request}")
+
+        # Create transcription request without verifying SSL for AssemblyAI CDN
+        transcript_response = _request(
+            'POST',
+            TRANSCRIPT_URL,
+            json=transcript_request,
+            verify=False  # Disable SSL verification for AssemblyAI CDN
+        )
+
+        # Log response details
+        logger.info(f"Transcript request response status: {transcript_response.status_code}")
+        logger.info(f"Transcript request content: {transcript_response.text}")
+
+        if transcript_response.status_code != 200:
+            error_detail = transcript_response.json() if transcript_response.text else "No error details provided"
+            logger.error(f"AssemblyAI API error: {error_detail}")
+            raise Exception(f"AssemblyAI API error: {error_detail}")
+
+        response_data = transcript_response.json()
+
+        if 'id' in response_data:
+            logger.info(f"Transcript request created. ID: {response_data['id']}")
+            return response_data
+        else:
+            logger.error(f"Transcript ID not found in response: {response_data}")
+            raise Exception("No transcript ID in response")
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request failed: {str(e)}")
+        if hasattr(e, 'response') and e.response is not None:
+            logger.error(f"Response status: {e.response.status_code}")
+            logger.error(f"Response text: {e.response.text}")
+            try:
+                error_json = e.response.json()
+                logger.error(f"Error details: {error_json}")
+                raise Exception(f"AssemblyAI API error: {error_json}")
+            except ValueError:
+                logger.error(f"Raw error text: {e.response.text}")
+                raise Exception(f"AssemblyAI API error: {e.response.text}")
+        raise Exception(f"Request failed: {str(e)}")
+    except Exception as e:
+        logger.error(f"Transcription request failed: {str(e)}")
+        raise
+
+
+def status_response(result):
+    """Status response for a transcript in AssemblyAI's result format, as every backend returns it"""
+    status = result.get('status')
+    progress = transcript_progress(status, result.get('percentage'))
+    response = {
+        'status': status,
+        'progress': progress,
+        'text': result.get('text'),  
+        'error': result.get('error'),
+        'language_code': result.get('language_code'),
+        'audio_duration': result.get('audio_duration'),
+        'punctuate': result.get('punctuate', True),
+        'format_text': result.get('format_text', True),
+        'confidence': result.get('confidence'),
+        'words': result.get('words'),
+        'utterances': result.get('utterances'),
+        'chapters': result.get('chapters'),
+        'highlights': result.get('auto_highlights_result')
+    }
+
+    # Add status message for clarity
+    if status == 'queued':
+        response['message'] = 'Your audio is queued for processing'
+    elif status == 'processing':
+        response['message'] = f'Processing your audio: {progress}% complete'
+    elif status == 'completed':
+        if not response['text']:
+            response['message'] = 'Warning: Transcription completed but no text was generated'
+            logger.warning(f"Completed transcription {result.get('id')} has no text")
+        else:
+            response['message'] = 'Transcription completed successfully'
+    elif status == 'error':
+        response['message'] = f'Error during transcription: {result.get("error")}'
+
+    # Remove None values
+    response = {k: v for k, v in response.items() if v is not None}
+
+    return response
+
+
+def fetch_transcript(transcript_id):
+    """Poll a transcript once, raising on failure rather than reporting it as an error result"""
+    response = _request('GET', f"https://api.assemblyai.com/v2/transcript/{transcript_id}")
+    response.raise_for_status()
+    return status_response(response.json())
+
+
+def get_transcript_result(transcript_id):
+    """Get transcription result with progress updates, raising RequestException when AssemblyAI cannot be reached"""
+    polling_endpoint = f"https://api.assemblyai.com/v2/transcript/{transcript_id}"
+    max_retries = 600  # Increased to 15 minutes total (1.5s * 600)
+    retry_count = 0
+    last_status = None
+    last_progress = None
+
+    while retry_count < max_retries:
+        try:
+            polling_response = _request(
+                'GET',
+                polling_endpoint
+            )
+            polling_response.raise_for_status()
+            result = polling_response.json()
+
+            logger.info(f"Polling response for {transcript_id}: {result}")
+
+            current_status = result.get('status')
+            current_progress = result.get('percentage', 0)
+
+            # Return any status change immediately
+            if current_status != last_status or current_progress != last_progress:
+                logger.info(f"Transcript {transcript_id} - Status: {current_status}, Progress: {current_progress}%")
+                last_status = current_status
+                last_progress = current_progress
+
+                return status_response(result)
+
+            if current_status == 'completed':
+                break
+
+            time.sleep(1.5)
+            retry_count += 1
+
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error polling transcript {transcript_id}: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                logger.error(f"API Response: {e.response.text}")
+            # Not reaching AssemblyAI says nothing about the transcript, so this is
+            # left to the caller rather than reported as a failed transcription
+            raise
+
+    logger.error(f"Transcription timed out after {max_retries} attempts")
+    return {
+        'status': 'error',
+        'error': 'Transcription timed out',
+        'progress': last_progress or 0,
+        'message': 'Transcription timed out after 15 minutes'
+    }
+
+
+def list_transcripts(params=None):
+    """List recent transcripts on the AssemblyAI account"""
+    response = _request(
+        'GET',
+        TRANSCRIPT_URL,
+        params=params
+    )
+    response.raise_for_status()
+    return response.json().get('transcripts', [])
@@ -0,0 +1,239 @@
+import os
+import shutil
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Transcription
+from .circuit_breaker import CLOSED
+from .deadline import remaining
+from .timeline import save_result
+from .throttling import settle_audio_charge
+from . import assemblyai, admission, local_engine, tracing
+
+logger = logging.getLogger(__name__)
+
+ASSEMBLYAI = admission.UPSTREAM_BACKEND
+LOCAL = 'local'
+
+# A request with less time than this left queues its job rather than submitting it
+MIN_SUBMIT_SECONDS = 10
+
+
+class TranscriptionBackend:
+    """
+    Where a job is transcribed. Every backend answers in AssemblyAI's
+    response format, so clients cannot tell which one served them.
+    """
+    name = None
+
+    def start(self, user, file_path, filename, audio_duration, language_code, auto_detect):
+        """Create a job for the audio at file_path and start transcribing it"""
+        raise NotImplementedError
+
+    def result(self, job):
+        """Status response for one of this backend's jobs"""
+        raise NotImplementedError
+
+
+class AssemblyAIBackend(TranscriptionBackend):
+    """
+    AssemblyAI behind upstream admission: jobs are submitted while a slot is
+    free and queued otherwise, or always queued and submitted in the
+    background with ASYNC_SUBMISSION. Audio is a local file, an audio_url
+    that AssemblyAI fetches itself, or a spool_name already in storage.
+    """
+    name = ASSEMBLYAI
+
+    def start(self, user, file_path, filename, audio_duration, language_code, auto_detect, audio_url='',
+              spool_name=None):
+        # Accept now and submit in the background, so the upload does not wait on AssemblyAI at all
+        if settings.ASYNC_SUBMISSION:
+            job = admission.enqueue(
+                user, file_path, filename, audio_duration, language_code, auto_detect,
+                audio_url=audio_url, spool_name=spool_name
+            )
+            admission.submit_soon()
+            return job
+
+        # While AssemblyAI is failing, or the request has too little time left
+        # to submit in, queue instead of holding the request open
+        left = remaining()
+        job = None
+        if assemblyai.breaker.state() == CLOSED and (left is None or left >= MIN_SUBMIT_SECONDS):
+            job = admission.reserve_slot(user, audio_duration, language_code, auto_detect, audio_url=audio_url)
+        if job is None:
+            return admission.enqueue(
+                user, file_path, filename, audio_duration, language_code, auto_detect,
+                audio_url=audio_url, spool_name=spool_name
+            )
+
+        try:
+            job.spool_file = spool_name
+            admission.submit_job(job, file_path, use_upstream_id=True)
+        except Exception:
+            job.delete()
+            raise
+        return job
+
+    def result(self, job):
+        return assemblyai.get_transcript_result(job.upstream_transcript_id)
+
+
+class LocalBackend(TranscriptionBackend):
+    """
+    Offline CPU transcription in a pool of worker processes, each holding
+    its own copy of the model. The pool is started on the first local job,
+    so importing this module (and gunicorn's preload) stays cheap. Jobs that
+    fail or do not finish here are handed to AssemblyAI instead.
+    """
+    name = LOCAL
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+
+    def enabled(self):
+        return settings.LOCAL_TRANSCRIPTION_MAX_SECONDS > 0 and local_engine.available()
+
+    def accepts(self, audio_duration):
+        """Whether a clip is short enough to transcribe here, with room in the pool to start it soon"""
+        return (
+            audio_duration is not None
+            and audio_duration <= settings.LOCAL_TRANSCRIPTION_MAX_SECONDS
+            and self._in_flight < settings.LOCAL_TRANSCRIPTION_WORKERS * 2
+            and self.enabled()
+        )
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked, since the web worker has threads and open connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.LOCAL_TRANSCRIPTION_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=local_engine.load_model,
+                    initargs=(settings.LOCAL_TRANSCRIPTION_MODEL, settings.LOCAL_TRANSCRIPTION_COMPUTE_TYPE),
+                )
+            return self._executor
+
+    def start(self, user, file_path, filename, audio_duration, language_code, auto_detect):
+        # Spooled like a queued job, so the audio can still go upstream if it is not finished here
+        spool_name = admission.spool_audio(file_path, filename)
+        try:
+            job = Transcription.objects.create(
+                transcript_id=admission.local_transcript_id(),
+                user=user,
+                status='processing',
+                audio_url='',
+                language_code=language_code,
+                auto_detect=auto_detect,
+                audio_duration=audio_duration,
+                spool_file=spool_name,
+                submitted_at=timezone.now(),
+                backend=LOCAL,
+                trace_parent=tracing.current_traceparent()
+            )
+        except Exception:
+            admission.discard_spool(spool_name)
+            raise
+
+        # The pool process removes its copy of the audio when it is done
+        work_file = NamedTemporaryFile(delete=False)
+        work_file.close()
+        shutil.copyfile(file_path, work_file.name)
+        language = None if auto_detect or language_code == 'auto' else language_code.lower().split('_')[0]
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self.executor().submit(local_engine.transcribe_file, work_file.name, language)
+        except Exception as e:
+            logger.error(f"Local transcription unavailable, sending {job.transcript_id} upstream: {str(e)}")
+            self._discard_pool()
+            with self._lock:
+                self._in_flight -= 1
+            os.remove(work_file.name)
+            return admission.requeue(job)
+
+        future.add_done_callback(lambda done: self._finish(job.pk, done))
+        logger.info(f"Transcribing {job.transcript_id} locally ({audio_duration}s)")
+        return job
+
+    def _finish(self, job_pk, future):
+        """Store a local result, or hand the job upstream if it failed. Runs in the pool's result thread."""
+        with self._lock:
+            self._in_flight -= 1
+        try:
+            job = Transcription.objects.get(pk=job_pk)
+            # The job may have been sent upstream while it ran here
+            if job.backend != LOCAL or job.status != 'processing':
+                return
+            with tracing.job_span(job, 'local.finish') as span:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Local transcription of {job.transcript_id} failed, sending it upstream: {str(e)}")
+                    if span is not None:
+                        span.fail(e)
+                    if isinstance(e, BrokenProcessPool):
+                        self._discard_pool()
+                    admission.requeue(job)
+                    return
+
+                spool_name = job.spool_file
+                job.spool_file = None
+                save_result(job, assemblyai.status_response(result))
+                admission.discard_spool(spool_name)
+                settle_audio_charge(job)
+                logger.info(f"Transcribed {job.transcript_id} locally")
+        except Exception as e:
+            logger.error(f"Failed to store local transcription {job_pk}: {str(e)}")
+        finally:
+            # This thread is not a request, so nothing else closes its connection
+            connection.close()
+
+    def _discard_pool(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def result(self, job):
+        # Nothing is known about a running job but that it is running
+        return assemblyai.status_response({'status': job.status, 'audio_duration': job.audio_duration})
+
+    def recover_stalled(self):
+        """Send local jobs that did not finish in time upstream, e.g. after their web worker was recycled"""
+        cutoff = timezone.now() - timedelta(seconds=settings.LOCAL_TRANSCRIPTION_TIMEOUT)
+        stalled = Transcription.objects.filter(backend=LOCAL, status='processing', submitted_at__lt=cutoff)
+        for job in stalled:
+            logger.warning(f"Local transcription of {job.transcript_id} stalled, sending it upstream")
+            admission.requeue(job)
+        return len(stalled)
+
+
+assemblyai_backend = AssemblyAIBackend()
+local_backend = LocalBackend()
+
+BACKENDS = {backend.name: backend for backend in (assemblyai_backend, local_backend)}
+
+
+def for_job(job):
+    return BACKENDS.get(job.backend, assemblyai_backend)
+
+
+def route(audio_duration):
+    """Backend for new audio: short clips go to the local engine while it has room, everything else upstream"""
+    if local_backend.accepts(audio_duration):
+        return local_backend
+    return assemblyai_backend
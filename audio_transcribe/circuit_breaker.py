@@ -0,0 +1,155 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream service whose circuit is open"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable, retry in {retry_after}s")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with its state kept in the shared cache, so every
+    worker and dyno trips and recovers together:
+    - closed: calls go through, errors and slow calls are counted per window
+    - open: calls fail immediately until reset_timeout has passed
+    - half open: a single trial call decides whether to close or re-open
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.window = settings.CIRCUIT_BREAKER_WINDOW
+        self.min_calls = settings.CIRCUIT_BREAKER_MIN_CALLS
+        self.failure_ratio = settings.CIRCUIT_BREAKER_FAILURE_RATIO
+        self.slow_call_seconds = settings.CIRCUIT_BREAKER_SLOW_CALL_SECONDS
+        self.reset_timeout = settings.CIRCUIT_BREAKER_RESET_TIMEOUT
+
+    def _key(self, suffix):
+        return f"circuit:{self.name}:{suffix}"
+
+    def _bucket(self, offset=0):
+        return int(time.time() // self.window) - offset
+
+    def _incr(self, key):
+        try:
+            cache.add(key, 0, timeout=self.window * 3)
+            return cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} could not update {key}: {str(e)}")
+            return 0
+
+    def _window_counts(self):
+        """Calls, failures and slow calls over the current and previous window"""
+        keys = []
+        for offset in (0, 1):
+            bucket = self._bucket(offset)
+            keys += [self._key(f"{bucket}:calls"), self._key(f"{bucket}:failures"), self._key(f"{bucket}:slow")]
+        values = cache.get_many(keys)
+        counts = [values.get(key, 0) for key in keys]
+        return counts[0] + counts[3], counts[1] + counts[4], counts[2] + counts[5]
+
+    def state(self):
+        try:
+            opened_at = cache.get(self._key('opened_at'))
+        except Exception as e:
+            # Without the shared store we cannot coordinate, so let calls through
+            logger.warning(f"Circuit breaker {self.name} state unavailable: {str(e)}")
+            return CLOSED
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_call(self):
+        """Return whether this call is the half-open trial, or raise CircuitOpenError"""
+        state = self.state()
+        if state == CLOSED:
+            return False
+
+        if state == HALF_OPEN and cache.add(self._key('trial'), 1, timeout=self.reset_timeout):
+            logger.info(f"Circuit breaker {self.name} half open, sending trial request")
+            return True
+
+        opened_at = cache.get(self._key('opened_at')) or time.time()
+        retry_after = max(1, int(self.reset_timeout - (time.time() - opened_at)))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, success, duration, trial=False):
+        """Record the outcome of a call and trip or reset the circuit"""
+        try:
+            bucket = self._bucket()
+            self._incr(self._key(f"{bucket}:calls"))
+            if not success:
+                self._incr(self._key(f"{bucket}:failures"))
+            if duration >= self.slow_call_seconds:
+                self._incr(self._key(f"{bucket}:slow"))
+            cache.set(self._key('last_latency'), round(duration, 3), timeout=None)
+
+            if trial:
+                cache.delete(self._key('trial'))
+                if success and duration < self.slow_call_seconds:
+                    self.close()
+                else:
+                    self.open()
+                return
+
+            calls, failures, slow = self._window_counts()
+            if calls >= self.min_calls and self.state() == CLOSED:
+                if failures / calls >= self.failure_ratio or slow / calls >= self.failure_ratio:
+                    logger.error(
+                        f"Circuit breaker {self.name} tripped: {failures} failures and "
+                        f"{slow} slow calls out of {calls}"
+                    )
+                    self.open()
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} could not record call: {str(e)}")
+
+    def abandon(self, trial=False):
+        """Forget a call that was given up for reasons of our own, letting another call be the trial"""
+        if trial:
+            try:
+                cache.delete(self._key('trial'))
+            except Exception as e:
+                logger.warning(f"Circuit breaker {self.name} could not release trial: {str(e)}")
+
+    def open(self):
+        cache.set(self._key('opened_at'), time.time(), timeout=None)
+        cache.add(self._key('times_opened'), 0, timeout=None)
+        cache.incr(self._key('times_opened'))
+
+    def close(self):
+        logger.info(f"Circuit breaker {self.name} closed")
+        cache.delete_many([self._key('opened_at'), self._key('trial')])
+        for offset in (0, 1):
+            bucket = self._bucket(offset)
+            cache.delete_many([self._key(f"{bucket}:calls"), self._key(f"{bucket}:failures"), self._key(f"{bucket}:slow")])
+
+    def is_open(self):
+        return self.state() == OPEN
+
+    def snapshot(self):
+        """Breaker state for the metrics endpoint"""
+        calls, failures, slow = self._window_counts()
+        return {
+            'state': self.state(),
+            'calls': calls,
+            'failures': failures,
+            'slow_calls': slow,
+            'window_seconds': self.window * 2,
+            'last_latency': cache.get(self._key('last_latency')),
+            'times_opened': cache.get(self._key('times_opened'), 0),
+        }
@@ -0,0 +1,41 @@
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def if_none_match(request, etag):
+    """Whether the client already holds the representation tagged etag"""
+    header = request.headers.get('If-None-Match')
+    if not header or not etag:
+        return False
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses weak comparison, and compressed responses carry weak tags
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+
+def with_etag(response, etag):
+    """Tag a response and ask clients to revalidate before reusing it"""
+    if etag:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(etag):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+def list_etag(transcriptions, *parts):
+    """
+    ETag over a set of transcriptions, changing when a row is added or
+    removed, or its version is bumped by a new result or status (see
+    Transcription.set_status)
+    """
+    state = transcriptions.order_by().aggregate(count=Count('id'), last_id=Max('id'), versions=Sum('version'))
+    parts = [*parts, state['count'], state['last_id'], state['versions']]
+    return '"' + hashlib.sha1(':'.join(map(str, parts)).encode('utf-8')).hexdigest() + '"'
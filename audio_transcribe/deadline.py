@@ -0,0 +1,84 @@
+"""
+Time budgets for the calls a request makes to AssemblyAI.
+
+gunicorn kills a worker whose request runs past its --timeout, and every
+call to AssemblyAI had a fixed timeout of its own, so a request making a
+few calls could be killed halfway through with nothing sent back. Each
+request now gets a deadline of REQUEST_DEADLINE_SECONDS when it starts
+(see DeadlineMiddleware), kept below gunicorn's timeout. Every call made
+for it takes its timeouts from the time that is left, and raises
+DeadlineExceeded instead of starting when too little is left. Views
+answer that with a 504 or stored data while the worker is still alive.
+A read timeout only bounds each wait for more data, so the body of a
+response is read against the deadline too (see assemblyai._read_body),
+and a slowly trickling answer cannot hold the request past it.
+
+Budgets nest, so part of a request can be given less time than the rest
+of it. Code running outside a request, such as job workers and background
+submission, has no deadline and keeps the fixed timeouts.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Monotonic time by which the current request must be done with upstream calls
+_deadline = ContextVar('deadline', default=None)
+
+# A call is not started with less time than this left, it could not get an answer
+MIN_CALL_SECONDS = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of making, or waiting on, an upstream call the request has no time left for"""
+
+    def __init__(self, message='The request ran out of time waiting for the transcription service'):
+        super().__init__(message)
+
+
+@contextmanager
+def budget(seconds):
+    """Give the block at most seconds, or what is left of an enclosing budget if that is less"""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left for the current request, or None outside a budget"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(timeout):
+    """
+    A requests timeout, seconds or (connect, read), cut down to the time
+    left, and whether it was cut. Connecting and reading share what is
+    left, so the two together cannot outlast it. Raises DeadlineExceeded
+    if there is not enough time left to make the call at all.
+    """
+    left = remaining()
+    if left is None:
+        return timeout, False
+    if left < MIN_CALL_SECONDS:
+        raise DeadlineExceeded()
+    # requests applies a single number to connecting and to reading alike
+    parts = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    connect = min(parts[0], left / 2)
+    clipped = (connect, min(parts[1], left - connect))
+    return clipped, clipped != parts
+
+
+def wait_timeout(seconds):
+    """How long to wait for something that may take seconds, without outliving the current request"""
+    left = remaining()
+    if left is None:
+        return seconds
+    return max(0, min(seconds, left))
@@ -0,0 +1,114 @@
+"""
+Uploads that go straight from the client to storage.
+
+The client asks for an upload target, sends the audio to it, and then
+completes the upload with the token it was given; the stored audio is
+then queued like any other. With an S3 bucket configured
+(AWS_STORAGE_BUCKET_NAME, optionally with AWS_S3_ENDPOINT_URL for an
+S3-compatible store) the target is a presigned POST to the bucket, and
+AssemblyAI later fetches the audio from the bucket with a presigned GET,
+so the audio never passes through this service. With the default local
+filesystem storage the target is a signed PUT to this service instead,
+which lets the same flow run in development and tests.
+
+Tokens are signed with SECRET_KEY and name the object and who may
+complete it, so nothing is stored until the upload is completed.
+"""
+import os
+import uuid
+import logging
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'uploads'
+SALT = 'audio_transcribe.direct_upload'
+
+# Bytes read at a time when the upload is sent to this service
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def is_remote():
+    """Whether audio is kept in an object store that clients and AssemblyAI can reach directly"""
+    return hasattr(default_storage, 'bucket_name')
+
+
+def new_token(filename, content_type, owner):
+    """Signed token for one upload of filename, completable only by owner"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    name = f"{UPLOAD_DIR}/{uuid.uuid4().hex}{ext}"
+    return signing.dumps({'name': name, 'content_type': content_type, 'owner': owner}, salt=SALT)
+
+
+def read_token(token):
+    """The upload a token was issued for, raising signing.BadSignature if it is forged or expired"""
+    return signing.loads(token, salt=SALT, max_age=settings.DIRECT_UPLOAD_EXPIRES)
+
+
+def upload_target(request, token):
+    """Where and how the client sends the audio for token"""
+    upload = read_token(token)
+    if is_remote():
+        client = default_storage.connection.meta.client
+        # The policy makes the bucket itself reject other content types and oversized files
+        post = client.generate_presigned_post(
+            Bucket=default_storage.bucket_name,
+            Key=default_storage._normalize_name(upload['name']),
+            Fields={'Content-Type': upload['content_type']},
+            Conditions=[
+                {'Content-Type': upload['content_type']},
+                ['content-length-range', 1, settings.DIRECT_UPLOAD_MAX_BYTES],
+            ],
+            ExpiresIn=settings.DIRECT_UPLOAD_EXPIRES,
+        )
+        return {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+
+    url = request.build_absolute_uri(reverse('transcribe-direct-upload-put'))
+    return {
+        'method': 'PUT',
+        'url': f"{url}?token={token}",
+        'headers': {'Content-Type': upload['content_type']},
+    }
+
+
+def save_local(name, stream):
+    """Store an upload sent to this service, for storage that clients cannot reach directly"""
+    size = 0
+    with File(SpooledTemporaryFile(max_size=CHUNK_SIZE * 16), name=os.path.basename(name)) as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > settings.DIRECT_UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(f"Uploads are limited to {settings.DIRECT_UPLOAD_MAX_BYTES} bytes")
+            f.write(chunk)
+        f.seek(0)
+        # Replaces an earlier attempt at the same upload
+        default_storage.delete(name)
+        saved = default_storage.save(name, f)
+    return saved, size
+
+
+def stored_size(name):
+    """Size of an uploaded object, or None if nothing was uploaded"""
+    if not default_storage.exists(name):
+        return None
+    return default_storage.size(name)
+
+
+def fetchable_url(name):
+    """Presigned URL AssemblyAI can fetch stored audio from, or None when storage is local"""
+    if not is_remote():
+        return None
+    return default_storage.url(name)
@@ -0,0 +1,168 @@
+import io
+import json
+import time
+import zipfile
+
+from .streaming import buffered
+
+EXPORT_FORMATS = ('ndjson', 'srt', 'vtt')
+
+# Rows fetched per database round trip; subtitle rows also carry their packed words
+EXPORT_CHUNK_SIZE = 500
+SUBTITLE_CHUNK_SIZE = 50
+
+# Cue limits, following common subtitle guidelines
+MAX_CUE_MS = 6000
+MAX_CUE_GAP_MS = 1000
+MAX_LINE_CHARS = 42
+MAX_CUE_CHARS = MAX_LINE_CHARS * 2
+
+
+def export_record(transcription):
+    """One transcription as it appears in an NDJSON export"""
+    return {
+        'id': transcription.transcript_id,
+        'status': transcription.status,
+        'text': transcription.text,
+        'audio_url': transcription.audio_url,
+        'language_code': transcription.language_code,
+        'audio_duration': transcription.audio_duration,
+        'created_at': transcription.created_at.isoformat() if transcription.created_at else None,
+        'completed_at': transcription.completed_at.isoformat() if transcription.completed_at else None,
+        'error': transcription.error,
+    }
+
+
+def ndjson_lines(transcriptions):
+    for transcription in transcriptions.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield (json.dumps(export_record(transcription)) + '\n').encode('utf-8')
+
+
+def build_cues(words):
+    """Group words into (start, end, text) cues, breaking on speaker changes, pauses and length"""
+    cues = []
+    cue_words = []
+    for word in words:
+        if cue_words:
+            first, last = cue_words[0], cue_words[-1]
+            length = sum(len(w['text']) + 1 for w in cue_words) + len(word['text'])
+            if (word['speaker'] != first['speaker']
+                    or word['start'] - last['end'] > MAX_CUE_GAP_MS
+                    or word['end'] - first['start'] > MAX_CUE_MS
+                    or length > MAX_CUE_CHARS):
+                cues.append(_cue(cue_words))
+                cue_words = []
+        cue_words.append(word)
+    if cue_words:
+        cues.append(_cue(cue_words))
+    return cues
+
+
+def _cue(words):
+    text = ' '.join(word['text'] for word in words)
+    if len(text) > MAX_LINE_CHARS:
+        # Break into two lines at the space closest to the middle
+        middle = len(text) // 2
+        spaces = [i for i, char in enumerate(text) if char == ' ']
+        if spaces:
+            split = min(spaces, key=lambda i: abs(i - middle))
+            text = text[:split] + '\n' + text[split + 1:]
+    return words[0]['start'], max(word['end'] for word in words), text
+
+
+def format_timestamp(ms, decimal_separator):
+    hours, ms = divmod(max(0, int(ms)), 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_separator}{ms:03d}"
+
+
+def render_srt(cues):
+    return ''.join(
+        f"{index}\n{format_timestamp(start, ',')} --> {format_timestamp(end, ',')}\n{text}\n\n"
+        for index, (start, end, text) in enumerate(cues, 1)
+    )
+
+
+def render_vtt(cues):
+    return 'WEBVTT\n\n' + ''.join(
+        f"{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n{text}\n\n"
+        for start, end, text in cues
+    )
+
+
+def subtitle_files(transcriptions, export_format):
+    """(filename, content) for each completed transcription that has word timings"""
+    render = render_srt if export_format == 'srt' else render_vtt
+    # Subtitles rendered when a transcript completed are read as they are,
+    # only older ones are built from their words here
+    # The timeline is joined in rather than fetched per row; only its packed words are read
+    rows = transcriptions.filter(status='completed', timeline__isnull=False).with_artifact(export_format)
+    rows = rows.select_related('timeline').defer(
+        'timeline__result', 'timeline__utterances', 'timeline__utterance_starts', 'timeline__utterance_max_ends'
+    )
+    for transcription in rows.iterator(chunk_size=SUBTITLE_CHUNK_SIZE):
+        if transcription.artifact is not None:
+            content = bytes(transcription.artifact)
+        else:
+            content = render(build_cues(transcription.timeline.words.words())).encode('utf-8')
+        yield f"{transcription.transcript_id}.{export_format}", content
+
+
+class _ZipOutput(io.RawIOBase):
+    """Write-only sink that hands zip output back to the streaming generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_entry(name):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def zip_ndjson(transcriptions):
+    output = _ZipOutput()
+    # The output isn't seekable, so zipfile writes sizes after each entry
+    with zipfile.ZipFile(output, 'w') as archive:
+        with archive.open(_zip_entry('transcriptions.ndjson'), 'w', force_zip64=True) as entry:
+            for line in ndjson_lines(transcriptions):
+                entry.write(line)
+                data = output.drain()
+                if data:
+                    yield data
+    yield output.drain()
+
+
+def zip_subtitles(transcriptions, export_format):
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for name, content in subtitle_files(transcriptions, export_format):
+            archive.writestr(_zip_entry(name), content)
+            yield output.drain()
+    yield output.drain()
+
+
+def export_stream(transcriptions, export_format, zipped=False):
+    """Byte chunks, content type and filename for a streamed export of a queryset"""
+    if export_format == 'ndjson' and not zipped:
+        return buffered(ndjson_lines(transcriptions)), 'application/x-ndjson', 'transcriptions.ndjson'
+    # One subtitle file per transcript, so subtitles always come as an archive
+    if export_format == 'ndjson':
+        stream = buffered(zip_ndjson(transcriptions))
+    else:
+        stream = buffered(zip_subtitles(transcriptions, export_format))
+    return stream, 'application/zip', f"transcriptions-{export_format}.zip"
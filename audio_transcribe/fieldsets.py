@@ -0,0 +1,80 @@
+# Sparse fieldsets: ?fields=status,progress returns only those fields,
+# ?exclude=words,utterances returns everything else
+
+# Every field a status response can carry
+RETRIEVE_FIELDS = (
+    'status', 'progress', 'text', 'error', 'language_code', 'audio_duration', 'punctuate', 'format_text',
+    'confidence', 'words', 'utterances', 'chapters', 'highlights', 'message', 'poll_interval',
+    'queue_position', 'stale',
+)
+
+# Fields of a finished transcript that are kept on its row, so they can be
+# answered without fetching the full result from AssemblyAI
+STORED_RESULT_FIELDS = frozenset(('status', 'progress', 'text', 'error', 'audio_duration'))
+
+# Fields of a list entry, and the model field each one is read from
+LIST_FIELDS = {
+    'id': 'transcript_id',
+    'text': 'text',
+    'audio_url': 'audio_url',
+    'language_code': 'language_code',
+    'created_at': 'created_at',
+    'completed_at': 'completed_at',
+    'error': 'error',
+    'status': 'status',
+    'audio_duration': 'audio_duration',
+}
+
+
+def _split(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def requested_fields(request, available):
+    """The set of fields a request asked for, or None for all of them"""
+    fields = request.query_params.get('fields')
+    exclude = request.query_params.get('exclude')
+    if fields is None and exclude is None:
+        return None
+
+    selected = _split(fields) if fields is not None else set(available)
+    excluded = _split(exclude) if exclude is not None else set()
+    unknown = (selected | excluded) - set(available)
+    if unknown:
+        raise ValueError(
+            f"Unknown fields: {', '.join(sorted(unknown))}. Available fields: {', '.join(available)}"
+        )
+    return frozenset(selected - excluded)
+
+
+def project(data, fields):
+    """Keep only the requested fields of a response dict"""
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
+def fieldset_key(fields):
+    """Stable name for a fieldset, so each one gets its own ETag"""
+    return '' if fields is None else ','.join(sorted(fields))
+
+
+def list_model_fields(fields):
+    """Model fields to load for list entries, always including those used for grouping"""
+    if fields is None:
+        return None
+    return {'transcript_id', 'status', 'created_at'} | {LIST_FIELDS[name] for name in fields}
+
+
+def list_entry(transcription, fields=None):
+    """A transcription as it appears in the list, with only the requested fields"""
+    entry = {}
+    for name, model_field in LIST_FIELDS.items():
+        # Fields that were not requested were not loaded from the database either
+        if fields is not None and name not in fields:
+            continue
+        value = getattr(transcription, model_field)
+        if name in ('created_at', 'completed_at'):
+            value = value.isoformat() if value else None
+        entry[name] = value
+    return entry
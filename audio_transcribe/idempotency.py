@@ -0,0 +1,162 @@
+"""
+Idempotency-Key support for endpoints that start work.
+
+A client that times out and retries a request with the same Idempotency-Key
+gets the original response back instead of starting the work again. Keys
+are scoped to the client and kept in the shared cache, so a retry is
+recognised by whichever worker it reaches:
+
+- the first request with a key claims it and runs; its response is stored
+  for IDEMPOTENCY_KEY_TTL seconds and replayed to later requests
+- a retry while the first request is still running waits up to
+  IDEMPOTENCY_WAIT_SECONDS (or what is left of its own deadline) for its
+  response, and gets 409 if it is not ready by then
+- reusing a key for a different request (other file or parameters) is
+  rejected with 422
+
+Only successful responses are stored. A request that failed, for example
+with 429 or because the upload was not there yet, can be retried with the
+same key and is then handled afresh.
+"""
+import json
+import time
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .throttling import client_ident
+from .deadline import wait_timeout
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# How long a claimed key blocks retries if its request dies without answering
+IN_PROGRESS_TIMEOUT = 120
+
+# How often a waiting retry checks for the original response
+POLL_INTERVAL = 0.1
+
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+
+# Response headers replayed along with the stored body
+REPLAYED_HEADERS = ('Retry-After', 'Location')
+
+
+def request_fingerprint(request):
+    """Digest of what a request asks for, to tell a retry from a different request reusing a key"""
+    digest = hashlib.sha256(f"{request.method} {request.path}".encode('utf-8'))
+    data = request.data
+    for name in sorted(data.keys()):
+        # Form fields can repeat, and every value counts
+        values = data.getlist(name) if hasattr(data, 'getlist') else [data[name]]
+        digest.update(name.encode('utf-8') + b'\0')
+        for value in values:
+            if hasattr(value, 'chunks'):
+                for chunk in value.chunks():
+                    digest.update(chunk)
+                value.seek(0)
+            else:
+                digest.update(json.dumps(value, sort_keys=True, default=str).encode('utf-8'))
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _cache_key(request, key):
+    return f"idempotency:{client_ident(request)}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+
+def _error(message, code, headers=None):
+    return Response({'error': message}, status=code, headers=headers)
+
+
+def _replay(entry):
+    response = Response(entry['data'], status=entry['status'], headers=entry['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(cache_key, fingerprint):
+    """Claim the key for this request, or return the entry of the request that holds it"""
+    while True:
+        if cache.add(cache_key, {'state': IN_PROGRESS, 'fingerprint': fingerprint}, timeout=IN_PROGRESS_TIMEOUT):
+            return None
+        entry = cache.get(cache_key)
+        # The holder finished without a response to keep between the two calls
+        if entry is not None:
+            return entry
+
+
+def _wait(cache_key, fingerprint):
+    """Wait for the request holding the key to answer, returning its entry or None once the key is free"""
+    deadline = time.monotonic() + wait_timeout(settings.IDEMPOTENCY_WAIT_SECONDS)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(cache_key)
+        if entry is None or entry['state'] == DONE:
+            return entry
+    return cache.get(cache_key)
+
+
+def idempotent(request, handler):
+    """Respond to request with handler(), at most once per Idempotency-Key"""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return handler()
+    if not key.strip() or len(key) > MAX_KEY_LENGTH:
+        return _error(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters", status.HTTP_400_BAD_REQUEST)
+
+    cache_key = _cache_key(request, key)
+    fingerprint = request_fingerprint(request)
+    try:
+        entry = _claim(cache_key, fingerprint)
+        while entry is not None:
+            if entry['fingerprint'] != fingerprint:
+                return _error(
+                    f"{HEADER} was already used for a different request", status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if entry['state'] == DONE:
+                return _replay(entry)
+            entry = _wait(cache_key, fingerprint)
+            if entry is not None and entry['state'] == IN_PROGRESS:
+                return _error(
+                    'A request with this Idempotency-Key is still in progress', status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': '1'}
+                )
+            # The original request failed and gave the key up, so this one takes over
+            if entry is None:
+                entry = _claim(cache_key, fingerprint)
+    except Exception as e:
+        # Without the shared store retries cannot be recognised, so handle the request as if it had no key
+        logger.warning(f"Idempotency keys unavailable: {str(e)}")
+        return handler()
+
+    response = None
+    try:
+        response = handler()
+    finally:
+        _store(cache_key, fingerprint, response)
+    return response
+
+
+def _store(cache_key, fingerprint, response):
+    """Keep a successful response for replay, or free the key for another try"""
+    try:
+        if response is None or not hasattr(response, 'data') or response.status_code >= 400:
+            cache.delete(cache_key)
+            return
+        cache.set(cache_key, {
+            'state': DONE,
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'data': response.data,
+            'headers': {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        }, timeout=settings.IDEMPOTENCY_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Could not store idempotent response: {str(e)}")
@@ -0,0 +1,200 @@
+"""
+Upstream jobs as a small state machine advanced by worker processes.
+
+A job at AssemblyAI is due when its next_poll_at has passed. Workers claim
+due jobs by setting a lease on them (lease_owner, lease_expires), poll
+AssemblyAI for each, and release the lease with the time of the next poll.
+A claimed job is invisible to other workers until its lease is released or
+expires, so any number of workers on any number of nodes can run without
+polling the same job twice, and a worker that dies only delays its jobs by
+JOB_LEASE_SECONDS.
+
+On PostgreSQL and MySQL due rows are claimed with SELECT ... FOR UPDATE SKIP
+LOCKED, so concurrent workers take disjoint batches without waiting on each
+other. SQLite has no row locks, so there each row is claimed with a
+conditional UPDATE that only one worker can win.
+
+Workers are the process_submissions command, deployed as the worker
+process. Where none is deployed (JOB_WORKERS=False), each web process runs
+the same loop in a background thread instead, so queued jobs still go
+upstream and running ones still finish.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import timedelta
+
+import requests
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Transcription, TERMINAL_STATUSES
+from .circuit_breaker import CircuitOpenError
+from .timeline import save_result
+from . import assemblyai, admission, backends, tracing
+
+logger = logging.getLogger(__name__)
+
+# Statuses of jobs that AssemblyAI is still working on
+POLLED_STATUSES = ('queued', 'processing')
+
+# Delay before retrying a job whose poll failed, doubled on each further failure
+RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 300
+
+# Seconds between passes of the loop web processes run without job workers
+IN_PROCESS_INTERVAL = 5
+
+# Job loop of this process when no job workers are deployed, started on first use
+_in_process = None
+_in_process_lock = threading.Lock()
+
+
+def worker_id():
+    """Lease owner name of this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def due(now):
+    """Upstream jobs whose next poll has come and that no worker holds"""
+    return Transcription.objects.filter(
+        status__in=POLLED_STATUSES, backend=admission.UPSTREAM_BACKEND, upstream_id__isnull=False
+    ).filter(
+        Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now),
+        Q(lease_expires__isnull=True) | Q(lease_expires__lt=now),
+    )
+
+
+def claim(owner, limit):
+    """Lease up to limit due jobs to owner, longest overdue first, and return them"""
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    candidates = due(now).order_by(F('next_poll_at').asc(nulls_first=True), 'pk').values_list('pk', flat=True)
+
+    if connection.features.has_select_for_update_skip_locked:
+        # Rows locked by another worker's claim are skipped rather than waited on
+        with transaction.atomic():
+            claimed = list(candidates.select_for_update(skip_locked=True)[:limit])
+            Transcription.objects.filter(pk__in=claimed).update(lease_owner=owner, lease_expires=expires)
+    else:
+        # The UPDATE repeats the due conditions, so a row taken (or already polled)
+        # by another worker since it was selected is left alone
+        claimed = [
+            pk for pk in list(candidates[:limit])
+            if due(now).filter(pk=pk).update(lease_owner=owner, lease_expires=expires)
+        ]
+
+    return list(Transcription.objects.filter(pk__in=claimed, lease_owner=owner).order_by('pk'))
+
+
+def release(job, owner, next_poll_at, attempts=0):
+    """Give up a lease, scheduling the job's next poll. A lease that has passed to another worker is left alone."""
+    released = Transcription.objects.filter(pk=job.pk, lease_owner=owner).update(
+        lease_owner=None, lease_expires=None, next_poll_at=next_poll_at, attempts=attempts
+    )
+    return bool(released)
+
+
+def is_permanent(error):
+    """Whether a failed poll would fail the same way if retried"""
+    response = getattr(error, 'response', None)
+    return (
+        isinstance(error, requests.exceptions.HTTPError) and response is not None
+        and 400 <= response.status_code < 500 and response.status_code != 429
+    )
+
+
+def retry_delay(attempts):
+    return min(MAX_RETRY_SECONDS, RETRY_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def advance(job, owner):
+    """Poll AssemblyAI once for a leased job and move it to its next state"""
+    now = timezone.now()
+    try:
+        result = assemblyai.fetch_transcript(job.upstream_transcript_id)
+    except CircuitOpenError as e:
+        # AssemblyAI is down, not this job, so the attempt is not counted against it
+        release(job, owner, now + timedelta(seconds=e.retry_after), job.attempts)
+        return
+    except Exception as e:
+        attempts = job.attempts + 1
+        if attempts >= settings.JOB_MAX_ATTEMPTS or is_permanent(e):
+            logger.error(f"Giving up on {job.transcript_id} after {attempts} failed polls: {str(e)}")
+            save_result(job, {'status': 'error', 'error': f"Could not get the transcript from AssemblyAI: {str(e)}"})
+            release(job, owner, None, attempts)
+            return
+        delay = retry_delay(attempts)
+        logger.warning(f"Polling {job.transcript_id} failed (attempt {attempts}), retrying in {delay}s: {str(e)}")
+        release(job, owner, now + timedelta(seconds=delay), attempts)
+        return
+
+    # save_result schedules the next poll of a job that is still running
+    save_result(job, result)
+    release(job, owner, None if job.status in TERMINAL_STATUSES else job.next_poll_at)
+
+
+def advance_due(owner, limit):
+    """Claim a batch of due jobs and advance each, returning how many were claimed"""
+    jobs = claim(owner, limit)
+    for job in jobs:
+        # The batch may have outlived the lease of its last jobs, which are then another worker's
+        if job.lease_expires <= timezone.now():
+            continue
+        try:
+            with tracing.job_span(job, 'job.advance', worker=owner, attempts=job.attempts):
+                advance(job, owner)
+        except Exception as e:
+            logger.error(f"Failed to advance {job.transcript_id}: {str(e)}")
+    return len(jobs)
+
+
+def work(owner, batch):
+    """
+    One pass of a job worker: poll due jobs, requeue interrupted submissions
+    and stalled local jobs, and submit queued ones. Returns how many were claimed.
+    """
+    claimed = advance_due(owner, batch)
+    swept = admission.sweep_submitting()
+    if swept:
+        logger.info(f"Swept {swept} interrupted submissions")
+    recovered = backends.local_backend.recover_stalled()
+    if recovered:
+        logger.info(f"Sent {recovered} stalled local jobs upstream")
+    dispatched = admission.dispatch_pending()
+    if dispatched:
+        logger.info(f"Submitted {dispatched} queued jobs")
+    return claimed
+
+
+def run_in_process():
+    """Start this process's job loop, standing in for the job workers when JOB_WORKERS is off"""
+    global _in_process
+    if settings.JOB_WORKERS or _in_process is not None:
+        return
+    with _in_process_lock:
+        if _in_process is None:
+            # Started on first use, so preloading gunicorn doesn't fork a running thread
+            _in_process = threading.Thread(target=_loop, name='job-worker', daemon=True)
+            _in_process.start()
+            logger.info('No job workers deployed, advancing jobs from this web process')
+
+
+def _loop():
+    owner = worker_id()
+    while True:
+        claimed = 0
+        try:
+            claimed = work(owner, settings.JOB_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"Error advancing jobs in process: {str(e)}")
+        finally:
+            # This thread is not a request, so nothing else closes its connection
+            connection.close()
+        if claimed < settings.JOB_BATCH_SIZE:
+            time.sleep(IN_PROCESS_INTERVAL)
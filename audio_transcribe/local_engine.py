@@ -0,0 +1,63 @@
+"""
+Offline speech recognition with faster-whisper, run in worker processes of
+a ProcessPoolExecutor (see backends.LocalBackend). Each process loads the
+model once, in load_model, and keeps it for every job it runs.
+
+This module is imported by freshly spawned processes, so it must not
+import Django or anything that needs settings.
+"""
+import os
+import importlib.util
+
+_model = None
+
+
+def available():
+    """Whether faster-whisper is installed, checked without importing it"""
+    return importlib.util.find_spec('faster_whisper') is not None
+
+
+def load_model(model_name, compute_type):
+    """Pool initializer: load the model into this worker process"""
+    global _model
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(model_name, device='cpu', compute_type=compute_type)
+
+
+def transcribe_file(file_path, language_code=None):
+    """
+    Transcribe the audio at file_path, which is removed afterwards, and
+    return the result in AssemblyAI's transcript format
+    """
+    try:
+        segments, info = _model.transcribe(file_path, language=language_code, word_timestamps=True)
+        texts = []
+        words = []
+        # Segments are produced lazily as the audio is decoded
+        for segment in segments:
+            texts.append(segment.text.strip())
+            for word in segment.words or []:
+                words.append({
+                    'text': word.word.strip(),
+                    'start': int(word.start * 1000),
+                    'end': int(word.end * 1000),
+                    'confidence': round(word.probability, 3),
+                    'speaker': None,
+                })
+    finally:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    return {
+        'status': 'completed',
+        'text': ' '.join(text for text in texts if text),
+        'language_code': info.language,
+        'audio_duration': info.duration,
+        'punctuate': True,
+        'format_text': True,
+        'confidence': round(sum(word['confidence'] for word in words) / len(words), 3) if words else None,
+        'words': words,
+    }
@@ -0,0 +1,39 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audio_transcribe import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Advance transcription jobs: poll AssemblyAI for running jobs and submit queued ones as upstream '
+        'slots free up. Any number of these workers can run side by side.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep between passes')
+        parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+        parser.add_argument(
+            '--batch', type=int, default=settings.JOB_BATCH_SIZE, help='Jobs to claim at a time'
+        )
+
+    def handle(self, *args, **options):
+        owner = jobs.worker_id()
+        logger.info(f"Job worker {owner} started")
+        while True:
+            claimed = 0
+            try:
+                claimed = jobs.work(owner, options['batch'])
+            except Exception as e:
+                logger.error(f"Error processing submissions: {str(e)}")
+
+            if options['once']:
+                break
+            # A full batch means more jobs are probably due, so carry on without sleeping
+            if claimed < options['batch']:
+                time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from audio_transcribe import usage
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the usage rollups from the transcriptions, for after changes made around '
+        'Transcription.save such as queryset updates or raw SQL.'
+    )
+
+    def handle(self, *args, **options):
+        rows = usage.rebuild()
+        self.stdout.write(f"Rebuilt {rows} usage rollup rows")
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcription',
+            name='audio_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:57
+
+from django.db import migrations, models
+
+
+def create_admission_lock(apps, schema_editor):
+    SchedulerLock = apps.get_model('audio_transcribe', 'SchedulerLock')
+    SchedulerLock.objects.get_or_create(name='upstream_admission')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0002_transcription_audio_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerLock',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('acquired_at', models.DateTimeField(blank=True, null=True)),
+                ('virtual_time', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='auto_detect',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='queue_key',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='spool_file',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='submitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='upstream_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(create_admission_lock, migrations.RunPython.noop),
+    ]
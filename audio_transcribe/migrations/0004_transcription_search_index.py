@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# The search index lives outside the Django model: PostgreSQL keeps a generated
+# tsvector column with a GIN index, SQLite keeps an FTS5 table in sync with triggers.
+# Both index the owner alongside the text because every search is scoped to one user.
+
+POSTGRES_FORWARD = [
+    # btree_gin lets user_id share the GIN index, so per-user searches don't
+    # have to filter every matching row in the table
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    """
+    ALTER TABLE audio_transcribe_transcription
+    ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED
+    """,
+    """
+    CREATE INDEX audio_transcribe_transcription_search_idx
+    ON audio_transcribe_transcription USING GIN (user_id, search_vector)
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS audio_transcribe_transcription_search_idx",
+    "ALTER TABLE audio_transcribe_transcription DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    # The owner column holds a "u<user_id>" token so per-user searches intersect
+    # posting lists inside FTS5 instead of filtering every match afterwards
+    """
+    CREATE VIEW audio_transcribe_transcription_fts_content AS
+    SELECT id, text, 'u' || user_id AS owner FROM audio_transcribe_transcription
+    """,
+    """
+    CREATE VIRTUAL TABLE audio_transcribe_transcription_fts USING fts5(
+        text,
+        owner,
+        content='audio_transcribe_transcription_fts_content',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER audio_transcribe_transcription_fts_insert
+    AFTER INSERT ON audio_transcribe_transcription BEGIN
+        INSERT INTO audio_transcribe_transcription_fts(rowid, text, owner)
+        VALUES (new.id, new.text, 'u' || new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER audio_transcribe_transcription_fts_delete
+    AFTER DELETE ON audio_transcribe_transcription BEGIN
+        INSERT INTO audio_transcribe_transcription_fts(audio_transcribe_transcription_fts, rowid, text, owner)
+        VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER audio_transcribe_transcription_fts_update
+    AFTER UPDATE OF text, user_id ON audio_transcribe_transcription
+    WHEN old.text IS NOT new.text OR old.user_id IS NOT new.user_id BEGIN
+        INSERT INTO audio_transcribe_transcription_fts(audio_transcribe_transcription_fts, rowid, text, owner)
+        VALUES ('delete', old.id, old.text, 'u' || old.user_id);
+        INSERT INTO audio_transcribe_transcription_fts(rowid, text, owner)
+        VALUES (new.id, new.text, 'u' || new.user_id);
+    END
+    """,
+    "INSERT INTO audio_transcribe_transcription_fts(audio_transcribe_transcription_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS audio_transcribe_transcription_fts_insert",
+    "DROP TRIGGER IF EXISTS audio_transcribe_transcription_fts_delete",
+    "DROP TRIGGER IF EXISTS audio_transcribe_transcription_fts_update",
+    "DROP TABLE IF EXISTS audio_transcribe_transcription_fts",
+    "DROP VIEW IF EXISTS audio_transcribe_transcription_fts_content",
+]
+
+
+def run_for_vendor(postgres_sql, sqlite_sql):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == 'postgresql':
+            statements = postgres_sql
+        elif vendor == 'sqlite':
+            statements = sqlite_sql
+        else:
+            # Other databases fall back to an unindexed scan in search.py
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0003_upstream_admission'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(POSTGRES_FORWARD, SQLITE_FORWARD),
+            run_for_vendor(POSTGRES_REVERSE, SQLITE_REVERSE),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0004_transcription_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptTimeline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('words', models.JSONField(default=list)),
+                ('word_starts', models.JSONField(default=list)),
+                ('word_max_ends', models.JSONField(default=list)),
+                ('utterances', models.JSONField(default=list)),
+                ('utterance_starts', models.JSONField(default=list)),
+                ('utterance_max_ends', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('transcription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='audio_transcribe.transcription')),
+            ],
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:09
+
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+from django.db import migrations, models
+
+
+# The packed word format as it was when this migration was written (version 1
+# in packing.py), kept here so the migration does not change with the app
+
+
+def pack_words(words):
+    words = sorted((word for word in words or [] if word.get('start') is not None), key=lambda word: word['start'])
+
+    def column_bytes(typecode, values):
+        column = array(typecode, values)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column.tobytes()
+
+    tokens = {}
+    speakers = {None: 0}
+    start_deltas, durations, token_ids, speaker_ids, confidences = [], [], [], [], []
+    previous_start = 0
+    for word in words:
+        start = int(word['start'])
+        end = int(word.get('end') or start)
+        start_deltas.append(start - previous_start)
+        durations.append(end - start)
+        previous_start = start
+        token_ids.append(tokens.setdefault((word.get('text') or '').replace('\x00', ''), len(tokens)))
+        speaker_ids.append(speakers.setdefault(word.get('speaker'), len(speakers)))
+        confidence = word.get('confidence')
+        confidences.append(math.nan if confidence is None else confidence)
+
+    token_table = '\x00'.join(tokens).encode('utf-8')
+    speaker_table = '\x00'.join(str(speaker) for speaker in list(speakers)[1:]).encode('utf-8')
+
+    payload = b''.join([
+        struct.pack('<4sBIII', b'TXWD', 1, len(words), len(token_table), len(speaker_table)),
+        column_bytes('I', start_deltas),
+        column_bytes('i', durations),
+        column_bytes('I', token_ids),
+        column_bytes('H', speaker_ids),
+        struct.pack(f'<{len(confidences)}e', *confidences),
+        token_table,
+        speaker_table,
+    ])
+    return zlib.compress(payload, 6)
+
+
+def pack_existing_words(apps, schema_editor):
+    TranscriptTimeline = apps.get_model('audio_transcribe', 'TranscriptTimeline')
+    for timeline in TranscriptTimeline.objects.only('id', 'words').iterator():
+        timeline.packed_words = pack_words(timeline.words)
+        timeline.save(update_fields=['packed_words'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0005_transcripttimeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcripttimeline',
+            name='packed_words',
+            field=models.BinaryField(default=bytes),
+        ),
+        # Timelines stored as JSON are packed, the JSON columns are not restored on reverse
+        migrations.RunPython(pack_existing_words, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='transcripttimeline',
+            name='word_max_ends',
+        ),
+        migrations.RemoveField(
+            model_name='transcripttimeline',
+            name='word_starts',
+        ),
+        migrations.RemoveField(
+            model_name='transcripttimeline',
+            name='words',
+        ),
+    ]
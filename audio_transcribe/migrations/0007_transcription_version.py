@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:15
+
+from django.db import migrations, models
+
+from ._search_index import around_table_rebuild
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0006_packed_words'),
+    ]
+
+    # SQLite rebuilds the table for this change, see _search_index
+    operations = around_table_rebuild(
+        migrations.AddField(
+            model_name='transcription',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0007_transcription_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcripttimeline',
+            name='result',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:40
+
+from django.db import migrations, models
+
+from ._search_index import around_table_rebuild
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0009_transcription_backend'),
+    ]
+
+    # SQLite rebuilds the table for this change, see _search_index
+    operations = around_table_rebuild(
+        migrations.AddField(
+            model_name='transcription',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcription',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    )
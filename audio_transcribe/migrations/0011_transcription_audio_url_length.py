@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:20
+
+from django.db import migrations, models
+
+from ._search_index import around_table_rebuild
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0010_transcription_job_lease'),
+    ]
+
+    # SQLite rebuilds the table for this change, see _search_index
+    operations = around_table_rebuild(
+        migrations.AlterField(
+            model_name='transcription',
+            name='audio_url',
+            field=models.URLField(max_length=2048),
+        ),
+    )
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0011_transcription_audio_url_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('version', models.PositiveIntegerField()),
+                ('content', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('transcription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artifacts', to='audio_transcribe.transcription')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transcriptartifact',
+            constraint=models.UniqueConstraint(fields=('transcription', 'kind'), name='unique_transcript_artifact'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audio_transcribe', '0012_transcriptartifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcription',
+            name='trace_parent',
+            field=models.CharField(blank=True, max_length=55, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def roll_up_existing_transcriptions(apps, schema_editor):
+    # A frozen copy of usage.rebuild as it was when this migration was written
+    Transcription = apps.get_model('audio_transcribe', 'Transcription')
+    UsageRollup = apps.get_model('audio_transcribe', 'UsageRollup')
+    rows = (
+        Transcription.objects.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('user_id', 'day', 'language_code', 'status')
+        .annotate(jobs=Count('id'), audio_seconds=Sum('audio_duration'))
+    )
+    rollups = {}
+    for row in rows.iterator():
+        key = (row['user_id'], row['day'], (row['language_code'] or 'auto')[:10], row['status'])
+        jobs, seconds = rollups.get(key, (0, 0))
+        rollups[key] = (jobs + row['jobs'], seconds + (row['audio_seconds'] or 0))
+    UsageRollup.objects.bulk_create([
+        UsageRollup(user_id=user_id, day=day, language=language, status=status, jobs=jobs, audio_seconds=seconds)
+        for (user_id, day, language, status), (jobs, seconds) in rollups.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('audio_transcribe', '0013_transcription_trace_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('language', models.CharField(max_length=10)),
+                ('status', models.CharField(max_length=50)),
+                ('jobs', models.IntegerField(default=0)),
+                ('audio_seconds', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'day'], name='usage_rollup_user_day')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usagerollup',
+            constraint=models.UniqueConstraint(fields=('day', 'user', 'language', 'status'), name='unique_usage_rollup'),
+        ),
+        migrations.RunPython(roll_up_existing_transcriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+"""
+Keeps the SQLite search index from 0004 alive across table rebuilds.
+
+SQLite applies most changes to audio_transcribe_transcription by copying it into
+a new table, which fails while the index's content view refers to the table and
+drops the triggers that keep the index in sync. Migrations that alter the table
+wrap their operations in around_table_rebuild, which drops the index first and
+recreates (and refills) it afterwards. PostgreSQL alters the table in place, so
+the generated search column is left alone there.
+
+The leading underscore keeps Django's migration loader from treating this
+module as a migration.
+"""
+from importlib import import_module
+
+from django.db import migrations
+
+search_index = import_module('audio_transcribe.migrations.0004_transcription_search_index')
+drop_search_index = search_index.run_for_vendor([], search_index.SQLITE_REVERSE)
+create_search_index = search_index.run_for_vendor([], search_index.SQLITE_FORWARD)
+
+
+def around_table_rebuild(*operations):
+    """Return operations with the search index dropped before them and recreated after"""
+    return [
+        migrations.RunPython(drop_search_index, create_search_index),
+        *operations,
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,23 +1,239 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .packing import PackedWords
 
 User = get_user_model()
 
+# Statuses after which a transcript no longer changes upstream
+TERMINAL_STATUSES = ('completed', 'error')
+
+
+def transcript_progress(status, percentage=None):
+    """Progress of a transcript in percent, the same whichever response reports it"""
+    if status == 'completed':
+        return 100
+    return percentage or 0
+
+
+# Fields that decide which usage rollup row a transcription is counted under
+USAGE_FIELDS = frozenset(('user', 'user_id', 'created_at', 'language_code', 'status', 'audio_duration'))
+# The same fields as stored, by their attribute names
+USAGE_COLUMNS = ('user_id', 'created_at', 'language_code', 'status', 'audio_duration')
+
 # Create your models here.
 
+class TranscriptionQuerySet(models.QuerySet):
+    def with_artifact(self, kind):
+        """Annotate rows with their pre-rendered artifact of kind as `artifact`, None where it is missing or stale"""
+        return self.annotate(artifact=Subquery(
+            TranscriptArtifact.objects.filter(
+                transcription=OuterRef('pk'), kind=kind, version=OuterRef('version')
+            ).values('content')[:1]
+        ))
+
+
 class Transcription(models.Model):
     transcript_id = models.CharField(max_length=255, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     status = models.CharField(max_length=50)
     text = models.TextField(null=True, blank=True)
-    audio_url = models.URLField()
+    audio_url = models.URLField(max_length=2048)
     language_code = models.CharField(max_length=10, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     error = models.TextField(null=True, blank=True)
+    audio_duration = models.FloatField(null=True, blank=True)  # seconds
+    upstream_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    auto_detect = models.BooleanField(default=True)
+    spool_file = models.CharField(max_length=255, null=True, blank=True)
+    queue_key = models.FloatField(null=True, blank=True, db_index=True)
+    # When the job took its upstream slot, which is when its submission started while it is SUBMITTING
+    submitted_at = models.DateTimeField(null=True, blank=True)
+    # Bumped whenever the stored result changes, for ETags
+    version = models.PositiveIntegerField(default=0)
+    # Which transcription backend the job was routed to (see backends.py)
+    backend = models.CharField(max_length=20, default='assemblyai')
+    # Polling state of upstream jobs, advanced by whichever worker holds the lease (see jobs.py)
+    attempts = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    lease_owner = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    # W3C traceparent of the request that created the job, continued by the workers (see tracing.py)
+    trace_parent = models.CharField(max_length=55, null=True, blank=True)
+
+    objects = TranscriptionQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
 
     def __str__(self):
         return f"Transcription {self.transcript_id} ({self.status})"
+
+    # Usage fields as loaded from the database, None for new or partly loaded records
+    _usage_loaded = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._usage_loaded = instance._usage_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # Usage fields that were not reloaded may have been changed since they were
+        reloaded = fields is None or set(USAGE_COLUMNS) <= {self._meta.get_field(f).attname for f in fields}
+        self._usage_loaded = self._usage_values() if reloaded else None
+
+    def _usage_values(self):
+        """The usage fields as they are on this instance, None if any of them is deferred"""
+        if not all(column in self.__dict__ for column in USAGE_COLUMNS):
+            return None
+        return {column: self.__dict__[column] for column in USAGE_COLUMNS}
+
+    def save(self, *args, **kwargs):
+        """Save, moving the job between usage rollup rows when its status, language or duration changes"""
+        from . import usage
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not USAGE_FIELDS.intersection(update_fields):
+            return super().save(*args, **kwargs)
+        # Most saves, such as poll bookkeeping, leave the usage fields as they were loaded
+        if self._usage_loaded is not None and self._usage_values() == self._usage_loaded:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            before = usage.stored_values(self)
+            super().save(*args, **kwargs)
+            usage.record_change(before, self)
+        self._usage_loaded = self._usage_values()
+
+    @property
+    def upstream_transcript_id(self):
+        """The AssemblyAI transcript id, which differs from ours for jobs that were queued locally"""
+        return self.upstream_id or self.transcript_id
+
+    def set_status(self, status):
+        """Move the job to status, bumping version so cached responses see the change; save 'version' with it"""
+        if status != self.status:
+            self.status = status
+            self.version += 1
+
+    def update_from_result(self, result):
+        """Copy an AssemblyAI status result onto this record"""
+        before = (self.status, self.text, self.error, self.audio_duration)
+        self.status = result.get('status', 'unknown')
+        self.text = result.get('text')
+        if result.get('audio_duration'):
+            self.audio_duration = result.get('audio_duration')
+        if result.get('status') == 'completed' and not self.completed_at:
+            self.completed_at = timezone.now()
+        if result.get('error'):
+            self.error = result.get('error')
+        if (self.status, self.text, self.error, self.audio_duration) != before:
+            self.version += 1
+
+    def etag(self, progress=None, variant=''):
+        """Strong ETag for this transcript's status response, variant naming the fieldset"""
+        parts = [self.transcript_id, self.status, self.version, variant]
+        # Progress of a running job is not stored, so it is part of the tag
+        if self.status not in TERMINAL_STATUSES:
+            parts.append(progress)
+        return '"' + hashlib.sha1(':'.join(map(str, parts)).encode('utf-8')).hexdigest() + '"'
+
+    def stored_result(self):
+        """Status response fields kept on this record"""
+        result = {
+            'status': self.status,
+            'progress': transcript_progress(self.status),
+            'text': self.text,
+            'error': self.error,
+            'audio_duration': self.audio_duration,
+        }
+        return {k: v for k, v in result.items() if v is not None}
+
+    def local_result(self):
+        """Status response built from stored data, for when AssemblyAI cannot be reached"""
+        result = {
+            **self.stored_result(),
+            'language_code': self.language_code,
+            'stale': True,
+            'message': 'Transcription service is temporarily unavailable, showing the last known status'
+        }
+        return {k: v for k, v in result.items() if v is not None}
+
+
+class SchedulerLock(models.Model):
+    """A named row used as a cluster-wide mutex for scheduling decisions"""
+    name = models.CharField(max_length=50, primary_key=True)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+    virtual_time = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"SchedulerLock {self.name}"
+
+
+class TranscriptTimeline(models.Model):
+    """Word and utterance timings of a completed transcript, indexed for time-range queries"""
+    transcription = models.OneToOneField(Transcription, on_delete=models.CASCADE, related_name='timeline')
+    # Words are packed into compressed columns (see packing.py). Utterances are
+    # sorted by start (milliseconds), with their starts and the running maximum
+    # of their ends kept alongside for binary search
+    packed_words = models.BinaryField(default=bytes)
+    utterances = models.JSONField(default=list)
+    utterance_starts = models.JSONField(default=list)
+    utterance_max_ends = models.JSONField(default=list)
+    # The rest of the completed AssemblyAI result, apart from text kept on the transcription
+    result = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"TranscriptTimeline {self.transcription_id}"
+
+    @cached_property
+    def words(self):
+        """Packed words, decoded lazily as they are used"""
+        return PackedWords(self.packed_words)
+
+
+class TranscriptArtifact(models.Model):
+    """A derived view of a completed transcript, rendered once when it completes (see artifacts.py)"""
+    transcription = models.ForeignKey(Transcription, on_delete=models.CASCADE, related_name='artifacts')
+    kind = models.CharField(max_length=20)
+    # The transcription version it was rendered from, so a changed result is never served stale
+    version = models.PositiveIntegerField()
+    content = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['transcription', 'kind'], name='unique_transcript_artifact'),
+        ]
+
+    def __str__(self):
+        return f"TranscriptArtifact {self.transcription_id} {self.kind}"
+
+
+class UsageRollup(models.Model):
+    """Jobs and audio seconds per user, day, language and status, kept up to date as jobs change (see usage.py)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    language = models.CharField(max_length=10)
+    status = models.CharField(max_length=50)
+    jobs = models.IntegerField(default=0)
+    audio_seconds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'user', 'language', 'status'], name='unique_usage_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'day'], name='usage_rollup_user_day'),
+        ]
+
+    def __str__(self):
+        return f"UsageRollup {self.user_id} {self.day} {self.language} {self.status}: {self.jobs}"
@@ -0,0 +1,323 @@
+import sys
+import zlib
+import math
+import struct
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+# Packed word timings: a header, the speaker table, and the words in blocks
+# of up to BLOCK_WORDS, each compressed on its own so a time range only
+# decompresses the blocks it falls in. The header and an index of each
+# block's first start and compressed size are not compressed. A block holds
+# its number of tokens and token table bytes, then one column per field
+#   starts        uint32 milliseconds from the start of the audio
+#   durations     int32 milliseconds from start to end
+#   token_ids     uint32 index into the block's token table
+#   speaker_ids   uint16 index into the speaker table, 0 meaning no speaker
+#   confidences   float16, NaN meaning no confidence
+# then its token table. Tables are NUL-separated UTF-8 and columns are
+# little-endian. Tables are stored with their number of entries, as an
+# empty table and a table holding one empty string are the same bytes, and
+# the header keeps the longest duration, so a time range is found by
+# bisecting the starts without reading the rest of the columns.
+MAGIC = b'TXWD'
+VERSION = 3
+PREFIX = struct.Struct('<4sB')  # magic, version
+# words, longest duration, words per block, blocks, speakers, speaker table bytes
+HEADER = struct.Struct('<4sBIiIIII')
+BLOCK_HEADER = struct.Struct('<II')  # tokens, token table bytes
+BLOCK_WORDS = 512
+COMPRESSION_LEVEL = 6
+SEPARATOR = '\x00'
+
+COLUMNS = (
+    ('starts', 'I'),
+    ('durations', 'i'),
+    ('token_ids', 'I'),
+    ('speaker_ids', 'H'),
+    ('confidences', 'H'),  # float16 bit patterns
+)
+
+# Versions 1 and 2 compressed everything as one, the header followed by the
+# columns of every word and then the token and speaker tables. Version 1
+# kept the start of each word as the delta from the previous one, and
+# neither the table sizes nor the longest duration. Both are still read,
+# as a single block, with what version 1 lacks worked out on first use
+V2_VERSION = 2
+V2_HEADER = struct.Struct('<4sBIiIIII')  # magic, version, words, longest duration, then as the tables
+LEGACY_VERSION = 1
+LEGACY_HEADER = struct.Struct('<4sBIII')  # magic, version, words, token table bytes, speaker table bytes
+LEGACY_COLUMNS = (('start_deltas', 'I'),) + COLUMNS[1:]
+
+NEEDS_BYTESWAP = sys.byteorder == 'big'
+
+_confidence_values = None
+
+
+def confidence_values():
+    """Confidence for every float16 bit pattern, rounded to the three digits float16 keeps"""
+    global _confidence_values
+    if _confidence_values is None:
+        halves = struct.unpack('<65536e', struct.pack('<65536H', *range(65536)))
+        # NaN stands for a word without a confidence
+        _confidence_values = [round(half, 3) if half == half else None for half in halves]
+    return _confidence_values
+
+
+def _column_bytes(typecode, values):
+    column = array(typecode, values)
+    if NEEDS_BYTESWAP:
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_column(typecode, data, offset, count):
+    column = array(typecode)
+    column.frombytes(data[offset:offset + count * column.itemsize])
+    if NEEDS_BYTESWAP:
+        column.byteswap()
+    return column
+
+
+def _read_table(data, start, end, size):
+    return bytes(data[start:end]).decode('utf-8').split(SEPARATOR)[:size]
+
+
+def _pack_block(words, speakers):
+    """One compressed block of words, adding any new speakers to speakers"""
+    tokens = {}
+    starts, durations, token_ids, speaker_ids, confidences = [], [], [], [], []
+    for word in words:
+        start = int(word['start'])
+        starts.append(start)
+        durations.append(int(word.get('end') or start) - start)
+        token_ids.append(tokens.setdefault((word.get('text') or '').replace(SEPARATOR, ''), len(tokens)))
+        speaker_ids.append(speakers.setdefault(word.get('speaker'), len(speakers)))
+        confidence = word.get('confidence')
+        confidences.append(math.nan if confidence is None else confidence)
+
+    token_table = SEPARATOR.join(tokens).encode('utf-8')
+    return zlib.compress(b''.join([
+        BLOCK_HEADER.pack(len(tokens), len(token_table)),
+        _column_bytes('I', starts),
+        _column_bytes('i', durations),
+        _column_bytes('I', token_ids),
+        _column_bytes('H', speaker_ids),
+        struct.pack(f'<{len(confidences)}e', *confidences),
+        token_table,
+    ]), COMPRESSION_LEVEL)
+
+
+def pack_words(words):
+    """Pack AssemblyAI word dicts, sorted by start, into blocks of compressed columns"""
+    words = sorted((word for word in words or [] if word.get('start') is not None), key=lambda word: word['start'])
+    max_duration = max((int(word.get('end') or word['start']) - int(word['start']) for word in words), default=0)
+
+    speakers = {None: 0}
+    blocks = [_pack_block(words[lo:lo + BLOCK_WORDS], speakers) for lo in range(0, len(words), BLOCK_WORDS)]
+    speaker_table = SEPARATOR.join(str(speaker) for speaker in list(speakers)[1:]).encode('utf-8')
+
+    return b''.join([
+        HEADER.pack(
+            MAGIC, VERSION, len(words), max_duration, BLOCK_WORDS, len(blocks), len(speakers) - 1, len(speaker_table)
+        ),
+        speaker_table,
+        _column_bytes('I', [int(words[lo]['start']) for lo in range(0, len(words), BLOCK_WORDS)]),
+        _column_bytes('I', [len(block) for block in blocks]),
+        *blocks,
+    ])
+
+
+class _Block:
+    """Consecutive packed words, with each column and the token table decoded on first use"""
+
+    def __init__(self, payload, count, offset, columns, token_bytes, tokens):
+        self._payload = payload
+        self.count = count
+        self._typecodes = dict(columns)
+        self._offsets = {}
+        for name, typecode in columns:
+            self._offsets[name] = offset
+            offset += count * array(typecode).itemsize
+        self.tables_offset = offset
+        self._token_bytes = token_bytes
+        # None for version 1, which did not keep it
+        self._token_count = tokens
+        self._columns = {}
+        self._tokens = None
+
+    def column(self, name):
+        if name not in self._columns:
+            if name == 'starts' and 'start_deltas' in self._typecodes:
+                column = array('q', accumulate(self.column('start_deltas')))
+            else:
+                column = _read_column(self._typecodes[name], self._payload, self._offsets[name], self.count)
+            self._columns[name] = column
+        return self._columns[name]
+
+    def tokens(self):
+        if self._tokens is None:
+            size = self._token_count
+            if size is None:
+                # Version 1 numbered the entries in order of first use, so the highest id in use is the last one
+                size = max(self.column('token_ids'), default=-1) + 1
+            self._tokens = _read_table(self._payload, self.tables_offset, self.tables_offset + self._token_bytes, size)
+        return self._tokens
+
+    def words(self, lo, hi, speakers):
+        starts = self.column('starts')[lo:hi]
+        return [
+            {'text': text, 'start': start, 'end': end, 'confidence': confidence, 'speaker': speaker}
+            for text, start, end, confidence, speaker in zip(
+                map(self.tokens().__getitem__, self.column('token_ids')[lo:hi]),
+                starts,
+                map(operator.add, starts, self.column('durations')[lo:hi]),
+                map(confidence_values().__getitem__, self.column('confidences')[lo:hi]),
+                map(speakers.__getitem__, self.column('speaker_ids')[lo:hi]),
+            )
+        ]
+
+
+class PackedWords:
+    """
+    Read-only view over packed word timings. Nothing is decompressed until
+    the words are used, and then only the blocks holding them, with only
+    the columns a lookup needs decoded; word dicts are built just for the
+    words returned.
+    """
+
+    def __init__(self, data):
+        self._data = data if isinstance(data, bytes) else bytes(data or b'')
+        self._count = None
+        self._blocks = {}
+        self._columns = {}
+        self._speakers = None
+
+    def _load(self):
+        if self._count is not None:
+            return
+        # Without an index, everything is one block
+        self._firsts = None
+        if not self._data:
+            self._count = 0
+            self._block_words = 1
+            self._max_duration = 0
+            self._speakers = [None]
+            return
+        if self._data[:len(MAGIC)] != MAGIC:
+            return self._load_single_block()
+
+        magic, version = PREFIX.unpack_from(self._data)
+        if version != VERSION:
+            raise ValueError(f"Unsupported packed word format {magic!r} v{version}")
+        _, _, count, max_duration, block_words, blocks, speakers, speaker_bytes = HEADER.unpack_from(self._data)
+        offset = HEADER.size
+        self._speakers = [None] + _read_table(self._data, offset, offset + speaker_bytes, speakers)
+        offset += speaker_bytes
+        self._firsts = _read_column('I', self._data, offset, blocks)
+        sizes = _read_column('I', self._data, offset + blocks * 4, blocks)
+        self._block_ends = list(accumulate(sizes, initial=offset + blocks * 8))
+        self._count = count
+        self._block_words = block_words
+        self._max_duration = max_duration
+
+    def _load_single_block(self):
+        """Versions 1 and 2, compressed as a whole"""
+        payload = memoryview(zlib.decompress(self._data))
+        magic, version = PREFIX.unpack_from(payload)
+        if magic == MAGIC and version == V2_VERSION:
+            _, _, count, max_duration, tokens, token_bytes, speakers, speaker_bytes = V2_HEADER.unpack_from(payload)
+            block = _Block(payload, count, V2_HEADER.size, COLUMNS, token_bytes, tokens)
+        elif magic == MAGIC and version == LEGACY_VERSION:
+            _, _, count, token_bytes, speaker_bytes = LEGACY_HEADER.unpack_from(payload)
+            block = _Block(payload, count, LEGACY_HEADER.size, LEGACY_COLUMNS, token_bytes, None)
+            max_duration = max(block.column('durations'), default=0)
+            # As for tokens, the highest speaker id in use is the last one
+            speakers = max(block.column('speaker_ids'), default=0)
+        else:
+            raise ValueError(f"Unsupported packed word format {magic!r} v{version}")
+        start = block.tables_offset + token_bytes
+        self._speakers = [None] + _read_table(payload, start, start + speaker_bytes, speakers)
+        self._blocks[0] = block
+        self._count = count
+        self._block_words = max(count, 1)
+        self._max_duration = max_duration
+
+    def _block(self, index):
+        """A block, decompressed on first use"""
+        if index not in self._blocks:
+            payload = memoryview(zlib.decompress(self._data[self._block_ends[index]:self._block_ends[index + 1]]))
+            tokens, token_bytes = BLOCK_HEADER.unpack_from(payload)
+            count = min(self._block_words, self._count - index * self._block_words)
+            self._blocks[index] = _Block(payload, count, BLOCK_HEADER.size, COLUMNS, token_bytes, tokens)
+        return self._blocks[index]
+
+    def __len__(self):
+        self._load()
+        return self._count
+
+    def column(self, name):
+        """A stored column of every word, decoding every block"""
+        if name not in self._columns:
+            self._load()
+            blocks = range(0, self._count, self._block_words)
+            if len(blocks) == 1:
+                column = self._block(0).column(name)
+            else:
+                column = array(dict(COLUMNS)[name])
+                for index in range(len(blocks)):
+                    column.extend(self._block(index).column(name))
+            self._columns[name] = column
+        return self._columns[name]
+
+    def max_duration(self):
+        """Duration of the longest word in milliseconds"""
+        self._load()
+        return self._max_duration
+
+    def words(self, lo=0, hi=None):
+        """Word dicts for positions lo to hi"""
+        self._load()
+        hi = self._count if hi is None else min(hi, self._count)
+        words = []
+        while lo < hi:
+            index, offset = divmod(lo, self._block_words)
+            block = self._block(index)
+            end = min(block.count, offset + hi - lo)
+            words.extend(block.words(offset, end, self._speakers))
+            lo += end - offset
+        return words
+
+    def chunks(self, size):
+        """Word dicts in lists of up to size words, decoded one list at a time"""
+        for lo in range(0, len(self), size):
+            yield self.words(lo, lo + size)
+
+    def _bisect(self, start, right=False):
+        """Where start falls among the word starts, decoding only the block it falls in"""
+        bisect = bisect_right if right else bisect_left
+        if not len(self):
+            return 0
+        if self._firsts is None:
+            return bisect(self._block(0).column('starts'), start)
+        # Every earlier block lies wholly before start, and every later one wholly after it
+        index = bisect(self._firsts, start) - 1
+        if index < 0:
+            return 0
+        return index * self._block_words + bisect(self._block(index).column('starts'), start)
+
+    def between(self, start, end):
+        """Positions lo to hi of the words starting within [start, end)"""
+        return self._bisect(start), self._bisect(end)
+
+    def overlapping(self, start, end):
+        """Words overlapping the window [start, end) in milliseconds"""
+        # A word overlapping the window starts less than the longest duration
+        # before it, and nothing from hi on begins before end
+        if not len(self):
+            return []
+        lo = self._bisect(start - self.max_duration(), right=True)
+        hi = self._bisect(end)
+        return [word for word in self.words(lo, hi) if word['end'] > start]
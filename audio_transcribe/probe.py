@@ -0,0 +1,236 @@
+import os
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# MPEG audio bitrate tables in kbps, indexed by [version][layer][bitrate index]
+# version: 1 = MPEG-1, 2 = MPEG-2/2.5; layer: 1, 2, 3
+MP3_BITRATES = {
+    1: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    2: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz, indexed by the 2-bit MPEG version id from the frame header
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+# How far into the file we look for the first MP3 frame sync
+MP3_SYNC_SEARCH_BYTES = 64 * 1024
+
+
+def probe_duration(path):
+    """Read the audio duration in seconds from container/frame headers only"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(12)
+            f.seek(0)
+
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                duration = _probe_wav(f)
+            elif head[:4] == b'fLaC':
+                duration = _probe_flac(f)
+            elif head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide'):
+                duration = _probe_mp4(f)
+            else:
+                duration = _probe_mp3(f, os.path.getsize(path))
+
+        if duration is not None and duration > 0:
+            logger.info(f"Probed audio duration for {path}: {duration:.2f}s")
+            return round(duration, 3)
+
+        logger.info(f"Could not determine audio duration for {path}")
+        return None
+
+    except Exception as e:
+        logger.warning(f"Audio duration probe failed for {path}: {str(e)}")
+        return None
+
+
+def suggested_poll_interval(audio_duration):
+    """Suggest how long a client should wait between status polls"""
+    if not audio_duration:
+        return 5
+    # AssemblyAI typically turns audio around in roughly a third of its length,
+    # so aim for about ten polls over that window
+    expected_turnaround = max(15.0, audio_duration * 0.3)
+    return int(min(30, max(2, expected_turnaround / 10)))
+
+
+def _probe_wav(f):
+    """Duration from the RIFF fmt and data chunk headers"""
+    f.seek(12)
+    byte_rate = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+        if chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 16))
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+            f.seek(chunk_size - len(fmt) + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            return chunk_size / byte_rate
+        else:
+            # Chunks are word aligned
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def _probe_flac(f):
+    """Duration from the FLAC STREAMINFO metadata block"""
+    f.seek(4)
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    streaminfo = f.read(34)
+    if len(streaminfo) < 18:
+        return None
+    # Bytes 10-17: sample rate (20 bits), channels (3), bits per sample (5), total samples (36)
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+
+def _probe_mp4(f):
+    """Duration from the mvhd atom inside moov, skipping over mdat without reading it"""
+    end = f.seek(0, os.SEEK_END)
+    moov = _find_atom(f, 0, end, b'moov')
+    if moov is None:
+        return None
+    mvhd = _find_atom(f, moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        return None
+
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, os.SEEK_CUR)
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(8, os.SEEK_CUR)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    if not timescale:
+        return None
+    return duration / timescale
+
+
+def _find_atom(f, start, end, name):
+    """Return the (payload start, payload end) of the first atom called name"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, atom_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return None
+        if atom_type == name:
+            return offset + header_size, offset + size
+        offset += size
+    return None
+
+
+def _probe_mp3(f, file_size):
+    """Duration from the first MPEG frame header and its Xing/Info/VBRI header"""
+    audio_start = 0
+    header = f.read(10)
+    if header[:3] == b'ID3':
+        # ID3v2 tag size is a 28-bit syncsafe integer
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        audio_start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+
+    f.seek(audio_start)
+    buf = f.read(MP3_SYNC_SEARCH_BYTES)
+    frame = None
+    for i in range(len(buf) - 4):
+        if buf[i] == 0xFF and buf[i + 1] & 0xE0 == 0xE0:
+            frame = _parse_mp3_header(buf[i:i + 4])
+            # 0xFFE turns up by chance in ID3 art and other binary data, so a sync only
+            # counts when the next frame header sits where this one says it ends
+            if frame and _continues_mp3_stream(buf, i, frame):
+                audio_start += i
+                buf = buf[i:]
+                break
+            frame = None
+    if not frame:
+        return None
+
+    version_id, layer, bitrate, sample_rate, mono, _ = frame
+    samples_per_frame = 384 if layer == 1 else (1152 if version_id == 3 or layer == 2 else 576)
+
+    # Xing/Info header sits after the side information of the first frame
+    if version_id == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing_offset = 4 + side_info
+    tag = buf[xing_offset:xing_offset + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', buf[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 0x1:
+            frames = struct.unpack('>I', buf[xing_offset + 8:xing_offset + 12])[0]
+            return frames * samples_per_frame / sample_rate
+
+    # VBRI header is always 32 bytes after the frame header
+    if buf[36:40] == b'VBRI':
+        frames = struct.unpack('>I', buf[50:54])[0]
+        return frames * samples_per_frame / sample_rate
+
+    # Constant bitrate: estimate from the audio payload size
+    audio_bytes = file_size - audio_start
+    f.seek(-128, os.SEEK_END)
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    return audio_bytes * 8 / (bitrate * 1000)
+
+
+def _parse_mp3_header(header):
+    """Parse a 4-byte MPEG audio frame header, returning None if it is not valid"""
+    version_id = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    if version_id == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[1 if version_id == 3 else 2][layer][bitrate_index]
+    sample_rate = MP3_SAMPLE_RATES[version_id][sample_rate_index]
+    mono = (header[3] >> 6) == 3
+    padding = (header[2] >> 1) & 0x1
+    if layer == 1:
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        slots = 144 if version_id == 3 or layer == 2 else 72
+        length = slots * bitrate * 1000 // sample_rate + padding
+    return version_id, layer, bitrate, sample_rate, mono, length
+
+
+def _continues_mp3_stream(buf, offset, frame):
+    """Whether a frame header matching frame's version, layer and sample rate follows it"""
+    following = offset + frame[5]
+    if following + 4 > len(buf) or buf[following] != 0xFF:
+        return False
+    next_frame = _parse_mp3_header(buf[following:following + 4])
+    return bool(next_frame) and next_frame[:2] == frame[:2] and next_frame[3] == frame[3]
@@ -0,0 +1,316 @@
+"""
+Sampled profiles of requests, for finding out where a slow request spends its time.
+
+A request is profiled when it is picked by PROFILE_SAMPLE_RATE, when an
+admin sends the X-Profile header, or, with PROFILE_SLOW_MS set, once it
+has run for that long. A single thread per process samples the call
+stacks of the requests being profiled every PROFILE_INTERVAL_MS, so a
+profiled request runs at full speed, and a request that finishes before
+PROFILE_SLOW_MS is never sampled at all. Each profile is written to
+PROFILE_DIR as collapsed stacks (the input of flamegraph.pl and
+speedscope) next to a summary of the request and its SQL queries, and
+the metrics user can fetch it as an SVG flame graph from the profiles
+endpoint. Responses and SQL run while a streamed body is being sent come
+after the profile has ended and are not part of it.
+"""
+import os
+import re
+import sys
+import html
+import json
+import time
+import uuid
+import zlib
+import random
+import logging
+import threading
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from api_auth.authentication import BearerTokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+
+SAMPLED = 'sampled'
+REQUESTED = 'requested'
+SLOW = 'slow'
+
+# Frames kept from the top of each sampled stack
+MAX_DEPTH = 128
+
+# Slowest queries kept in a profile's summary
+SLOWEST_QUERIES = 10
+
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+
+class Capture:
+    """Stacks and SQL timings collected for one request"""
+
+    def __init__(self, trigger, start_after):
+        self.trigger = trigger
+        self.thread_id = threading.get_ident()
+        self.started = time.monotonic()
+        # When the sampler starts taking this request's stacks
+        self.start_after = start_after
+        self.stacks = Counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slowest = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.query_seconds += duration
+            self.slowest.append((duration, context['connection'].alias, sql))
+            if len(self.slowest) > SLOWEST_QUERIES * 4:
+                self.slowest = sorted(self.slowest, reverse=True)[:SLOWEST_QUERIES]
+
+
+class Sampler:
+    """Background thread that samples the stacks of the request threads being profiled"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._captures = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, capture):
+        with self._lock:
+            self._captures[capture.thread_id] = capture
+            if self._thread is None:
+                # Started on first use, so preloading gunicorn doesn't fork a running thread
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, capture):
+        with self._lock:
+            self._captures.pop(capture.thread_id, None)
+
+    def _run(self):
+        interval = settings.PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                captures = list(self._captures.values())
+            if not captures:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            now = time.monotonic()
+            due = [capture for capture in captures if capture.start_after <= now]
+            if due:
+                # Under the lock, so a request that has finished is not sampled while it saves its profile
+                with self._lock:
+                    frames = sys._current_frames()
+                    for capture in due:
+                        frame = frames.get(capture.thread_id)
+                        if frame is not None and self._captures.get(capture.thread_id) is capture:
+                            capture.stacks[_stack(frame)] += 1
+                    del frames, frame
+                time.sleep(interval)
+            else:
+                # Nothing to sample until the oldest request gets slow, or another one is profiled
+                self._wake.wait(max(interval, min(capture.start_after for capture in captures) - now))
+                self._wake.clear()
+
+
+_sampler = Sampler()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    name = f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+    return name.replace(';', ':').replace(' ', '_')
+
+
+def _stack(frame):
+    """Collapsed stack of a frame, outermost call first"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _is_admin(request):
+    """Whether the request carries an admin's API token"""
+    try:
+        authenticated = BearerTokenAuthentication().authenticate(request)
+    except Exception:
+        return False
+    return bool(authenticated and authenticated[0].is_staff)
+
+
+def trigger(request):
+    """Why this request is profiled from its start, or None"""
+    if request.headers.get(HEADER) and _is_admin(request):
+        return REQUESTED
+    if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return SAMPLED
+    return None
+
+
+def profile_request(request, get_response):
+    """get_response(request), profiled when it is picked, asked for or slow"""
+    reason = trigger(request)
+    slow_seconds = settings.PROFILE_SLOW_MS / 1000
+    if reason is None and not slow_seconds:
+        return get_response(request)
+
+    now = time.monotonic()
+    capture = Capture(reason or SLOW, now if reason else now + slow_seconds)
+    _sampler.add(capture)
+    response = None
+    try:
+        # Every database the request may use, the primary and any replicas its reads are routed to
+        with ExitStack() as wrappers:
+            for connection in connections.all(initialized_only=False):
+                wrappers.enter_context(connection.execute_wrapper(capture.record_query))
+            response = get_response(request)
+    finally:
+        _sampler.remove(capture)
+        duration = time.monotonic() - capture.started
+        if reason or (duration >= slow_seconds and capture.stacks):
+            profile_id = _save(capture, request, response, duration)
+            if profile_id and reason == REQUESTED and response is not None:
+                response['X-Profile-Id'] = profile_id
+    return response
+
+
+def _save(capture, request, response, duration):
+    """Write a profile and its summary to PROFILE_DIR, returning its id"""
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    slowest = sorted(capture.slowest, reverse=True)[:SLOWEST_QUERIES]
+    summary = {
+        'id': profile_id,
+        'trigger': capture.trigger,
+        'method': request.method,
+        'path': request.path,
+        'status': getattr(response, 'status_code', None),
+        'duration_ms': round(duration * 1000, 1),
+        'samples': sum(capture.stacks.values()),
+        'interval_ms': settings.PROFILE_INTERVAL_MS,
+        'queries': capture.queries,
+        'query_ms': round(capture.query_seconds * 1000, 1),
+        'slowest_queries': [
+            {'ms': round(seconds * 1000, 2), 'db': alias, 'sql': sql[:500]} for seconds, alias, sql in slowest
+        ],
+    }
+    logger.info(
+        f"Profiled {request.method} {request.path} ({capture.trigger}): {summary['duration_ms']}ms, "
+        f"{summary['samples']} samples, {capture.queries} queries in {summary['query_ms']}ms, id {profile_id}"
+    )
+    try:
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(settings.PROFILE_DIR, f"{profile_id}.collapsed"), 'w') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in capture.stacks.most_common())
+        with open(os.path.join(settings.PROFILE_DIR, f"{profile_id}.json"), 'w') as f:
+            json.dump(summary, f)
+        _prune()
+    except OSError as e:
+        logger.warning(f"Could not save profile {profile_id}: {str(e)}")
+        return None
+    return profile_id
+
+
+def _prune():
+    """Keep only the newest PROFILE_KEEP profiles"""
+    summaries = sorted(name for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.json'))
+    for name in summaries[:max(0, len(summaries) - settings.PROFILE_KEEP)]:
+        for ext in ('.json', '.collapsed'):
+            try:
+                os.remove(os.path.join(settings.PROFILE_DIR, name[:-len('.json')] + ext))
+            except OSError:
+                pass
+
+
+def list_profiles(limit=50):
+    """Summaries of the newest profiles, newest first"""
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    names = sorted((name for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.json')), reverse=True)
+    summaries = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(settings.PROFILE_DIR, name)) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return summaries
+
+
+def load_profile(profile_id):
+    """(summary, collapsed stacks) of a saved profile, or None if there is no such profile"""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, profile_id)
+    try:
+        with open(path + '.json') as f:
+            summary = json.load(f)
+        with open(path + '.collapsed') as f:
+            collapsed = f.read()
+    except (OSError, ValueError):
+        return None
+    return summary, collapsed
+
+
+def flame_svg(collapsed, title, width=1200, row_height=16):
+    """Render collapsed stacks as a flame graph, widest call at the bottom"""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if not stack or not count.isdigit():
+            continue
+        node = root
+        node['value'] += int(count)
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'name': name, 'value': 0, 'children': {}})
+            node['value'] += int(count)
+
+    total = root['value'] or 1
+    boxes = []
+
+    def layout(node, x, depth):
+        box_width = node['value'] / total * width
+        # Calls too narrow to see are left out with everything they called
+        if box_width < 0.5:
+            return
+        boxes.append((x, depth, box_width, node))
+        for child in sorted(node['children'].values(), key=lambda child: child['name']):
+            layout(child, x, depth + 1)
+            x += child['value'] / total * width
+
+    layout(root, 0, 0)
+    depth = max(box_depth for _, box_depth, _, _ in boxes) + 1
+    height = depth * row_height + 24
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="14">{html.escape(title)}</text>',
+    ]
+    for x, box_depth, box_width, node in boxes:
+        y = height - (box_depth + 1) * row_height
+        # Stable colours per function, in the usual warm flame graph range
+        hue = zlib.crc32(node['name'].encode('utf-8')) % 60
+        label = node['name'][:int(box_width / 7)] if box_width > 21 else ''
+        parts.append(
+            f'<g><title>{html.escape(node["name"])} ({node["value"]} samples, '
+            f'{node["value"] * 100 / total:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{box_width:.1f}" height="{row_height - 1}" '
+            f'fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{html.escape(label)}</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
@@ -0,0 +1,159 @@
+"""
+Read replicas for the API's read-heavy endpoints.
+
+With DATABASE_REPLICA_URLS set, the reads of read-only API actions
+(listing, status, search, downloads, exports and usage) go to one of the
+replicas, picked per request, and everything else stays on the primary:
+
+- every write, and every read in a request after it has written, so a
+  request always sees its own changes
+- reads inside a transaction, and reads in primary() blocks, which code
+  that reads a row in order to change it uses
+- every read outside a request, such as job workers and background
+  submission, which write what they read
+- API token lookups, and anything else read while the request is
+  authenticated. A client's first request with a new token can follow
+  the token's creation more closely than a replica does, and the
+  creation was made under the client's address, not the new token.
+- every read for a client that wrote in the last REPLICA_STICKY_SECONDS,
+  so replication lag never hides a client's own upload or change from
+  it. Clients are told apart by their API token, or their address when
+  anonymous, and the window is kept in the shared cache so it holds
+  whichever worker the next request reaches.
+
+Anything written by someone else, such as a job worker finishing a
+transcript, can show up on a replica a little later than on the primary.
+"""
+import random
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.throttling import BaseThrottle
+
+# Statements that leave the data as it is. Anything else the primary runs in a
+# request counts as a write
+READ_STATEMENTS = ('SELECT', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'EXPLAIN', 'SHOW', 'SET')
+
+# Apps whose rows are read to authenticate requests, always read from the primary
+PRIMARY_APPS = ('authtoken',)
+
+# Routing state of the current request, None outside requests
+_state = ContextVar('replica_state', default=None)
+
+
+class RoutingState:
+    """Where the current request's reads may go"""
+
+    __slots__ = ('replica', 'allowed', 'sticky', 'wrote', 'pinned')
+
+    def __init__(self, sticky):
+        self.replica = random.choice(settings.DATABASE_REPLICAS)
+        # Set by the view for actions that only read
+        self.allowed = False
+        self.sticky = sticky
+        self.wrote = False
+        self.pinned = 0
+
+    def read_alias(self):
+        if not self.allowed or self.sticky or self.wrote or self.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.replica
+
+    def watch_writes(self, execute, sql, params, many, context):
+        """Primary execute wrapper noting when the request writes"""
+        if not self.wrote and not sql.lstrip('( \n').upper().startswith(READ_STATEMENTS):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+class ReplicaRouter:
+    """Database router sending reads to a replica where the current request allows it"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return state.read_alias()
+
+    def db_for_write(self, model, **hints):
+        # Also asked when nothing is written, such as when a related object is
+        # assigned, so writes are noted from the statements run (watch_writes)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+@contextmanager
+def primary():
+    """Read from the primary in the block, for reads of rows that are about to be changed"""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    state.pinned += 1
+    try:
+        yield
+    finally:
+        state.pinned -= 1
+
+
+def allow_reads():
+    """Let the current request read from a replica, until it writes"""
+    state = _state.get()
+    if state is not None:
+        state.allowed = True
+
+
+def _sticky_key(request):
+    """Cache key of a client's stay on the primary: its API token, or its address"""
+    client = request.META.get('HTTP_AUTHORIZATION') or f"anon_{BaseThrottle().get_ident(request)}"
+    return f"replica_sticky:{hashlib.sha1(client.encode('utf-8')).hexdigest()}"
+
+
+def _streamed(state, content):
+    """A streamed body read with the routing of the request that returned it"""
+    _state.set(state)
+    try:
+        yield from content
+    finally:
+        _state.set(None)
+
+
+def route_request(request, get_response):
+    """get_response(request), with its reads routed to a replica where that is safe"""
+    if not settings.DATABASE_REPLICAS:
+        return get_response(request)
+    key = _sticky_key(request)
+    state = RoutingState(sticky=bool(cache.get(key)))
+    token = _state.set(state)
+    try:
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(state.watch_writes):
+            response = get_response(request)
+    finally:
+        _state.reset(token)
+    if state.wrote:
+        cache.set(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+    # Rows of a streamed response are read while it is sent, after this returns
+    if response.streaming:
+        response.streaming_content = _streamed(state, response.streaming_content)
+    return response
+
+
+class ReplicaReadsMixin:
+    """Lets the view actions named in replica_actions read from a replica"""
+
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        # Authenticated on the primary first, see the module docstring
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            allow_reads()
@@ -0,0 +1,91 @@
+import re
+import logging
+
+from django.db import connection
+
+from .models import Transcription
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_START = '<mark>'
+SNIPPET_STOP = '</mark>'
+
+# Characters kept from a search query for the FTS5 backend
+FTS_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+POSTGRES_SEARCH = f"""
+    SELECT ranked.id, ranked.rank,
+           ts_headline('simple', coalesce(ranked.text, ''), ranked.query,
+                       'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxFragments=2, MaxWords=20, MinWords=5')
+    FROM (
+        SELECT t.id, t.text, q.query, ts_rank_cd(t.search_vector, q.query) AS rank
+        FROM audio_transcribe_transcription t,
+             websearch_to_tsquery('simple', %s) AS q(query)
+        WHERE t.search_vector @@ q.query AND t.user_id = %s
+        ORDER BY rank DESC, t.created_at DESC
+        LIMIT %s OFFSET %s
+    ) ranked
+    ORDER BY ranked.rank DESC
+"""
+
+SQLITE_SEARCH = f"""
+    SELECT t.id, -bm25(audio_transcribe_transcription_fts, 1.0, 0.0) AS rank,
+           snippet(audio_transcribe_transcription_fts, 0, '{SNIPPET_START}', '{SNIPPET_STOP}', '...', 20)
+    FROM audio_transcribe_transcription_fts
+    JOIN audio_transcribe_transcription t ON t.id = audio_transcribe_transcription_fts.rowid
+    WHERE audio_transcribe_transcription_fts MATCH %s
+    ORDER BY bm25(audio_transcribe_transcription_fts, 1.0, 0.0), t.created_at DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def fts5_query(query, user):
+    """Scope to the user's rows and quote each word so input can't use FTS5 query syntax"""
+    tokens = ' '.join(f'"{token}"' for token in FTS_TOKEN.findall(query))
+    if not tokens:
+        return None
+    return f'owner:"u{user.pk}" AND text:({tokens})'
+
+
+def search_transcriptions(user, query, limit=10, offset=0):
+    """Ranked full-text matches for a user's transcripts as (transcription, rank, snippet)"""
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        rows = _run(POSTGRES_SEARCH, [query, user.pk, limit, offset])
+    elif vendor == 'sqlite':
+        match = fts5_query(query, user)
+        if not match:
+            return []
+        rows = _run(SQLITE_SEARCH, [match, limit, offset])
+    else:
+        logger.warning(f"No full-text index for {vendor}, falling back to a table scan")
+        return [
+            (transcription, 0.0, _plain_snippet(transcription.text, query))
+            for transcription in Transcription.objects.filter(
+                user=user, text__icontains=query
+            ).order_by('-created_at')[offset:offset + limit]
+        ]
+
+    transcriptions = Transcription.objects.in_bulk([row[0] for row in rows])
+    return [
+        (transcriptions[pk], rank, snippet)
+        for pk, rank, snippet in rows
+        if pk in transcriptions
+    ]
+
+
+def _run(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _plain_snippet(text, query, context=80):
+    index = (text or '').lower().find(query.lower())
+    if index < 0:
+        return (text or '')[:context * 2]
+    start = max(0, index - context)
+    end = index + len(query)
+    return (
+        text[start:index] + SNIPPET_START + text[index:end] + SNIPPET_STOP + text[end:end + context]
+    )
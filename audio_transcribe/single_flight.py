@@ -0,0 +1,140 @@
+import time
+import uuid
+import logging
+import threading
+
+from django.core.cache import cache
+
+from .deadline import DeadlineExceeded, remaining, wait_timeout
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting worker checks the shared cache for the leader's result
+POLL_INTERVAL = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into a single execution.
+    Threads in this process wait on the in-flight call directly, other
+    workers wait for the leader's result to appear in the shared cache.
+    Results are reused for freshness seconds after they are produced.
+    """
+
+    def __init__(self, name, freshness=2.0, lock_timeout=35):
+        self.name = name
+        self.freshness = freshness
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _key(self, key, suffix):
+        return f"singleflight:{self.name}:{key}:{suffix}"
+
+    def do(self, key, fn):
+        """Return fn() for key, sharing an in-flight or fresh result when there is one"""
+        cached = self._get_cached(key)
+        if cached is not None:
+            self._count('coalesced')
+            return cached
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.event.wait(wait_timeout(self.lock_timeout)):
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded()
+                # The in-flight call is stuck, don't wait on it any longer
+                return fn()
+            self._count('coalesced')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    def _do_shared(self, key, fn):
+        """Run fn once across workers, or wait for the worker already running it"""
+        lock_key = self._key(key, 'lock')
+        token = uuid.uuid4().hex
+        try:
+            acquired = cache.add(lock_key, token, timeout=self.lock_timeout)
+        except Exception as e:
+            logger.warning(f"Single flight {self.name} lock unavailable: {str(e)}")
+            acquired = None
+
+        if acquired is False:
+            # fn() below finds out if the request's own deadline ran out while waiting
+            deadline = time.monotonic() + wait_timeout(self.lock_timeout)
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                cached = self._get_cached(key)
+                if cached is not None:
+                    self._count('coalesced')
+                    return cached
+                # The leader gave up without a result, fetch it ourselves
+                if cache.get(lock_key) is None:
+                    break
+
+        try:
+            self._count('executed')
+            result = fn()
+            try:
+                cache.set(self._key(key, 'result'), result, timeout=self.freshness)
+            except Exception as e:
+                logger.warning(f"Single flight {self.name} could not share result: {str(e)}")
+            return result
+        finally:
+            if acquired:
+                try:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+                except Exception:
+                    pass
+
+    def _get_cached(self, key):
+        try:
+            return cache.get(self._key(key, 'result'))
+        except Exception:
+            return None
+
+    def _count(self, counter):
+        key = f"singleflight:{self.name}:stats:{counter}"
+        try:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+        except Exception:
+            pass
+
+    def snapshot(self):
+        """Executed vs coalesced call counts for the metrics endpoint"""
+        values = cache.get_many([
+            f"singleflight:{self.name}:stats:executed",
+            f"singleflight:{self.name}:stats:coalesced",
+        ])
+        return {
+            'executed': values.get(f"singleflight:{self.name}:stats:executed", 0),
+            'coalesced': values.get(f"singleflight:{self.name}:stats:coalesced", 0),
+            'freshness_seconds': self.freshness,
+        }
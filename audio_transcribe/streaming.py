@@ -0,0 +1,97 @@
+import json
+
+from django.http import StreamingHttpResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library's C encoder is used instead
+    orjson = None
+
+# Bytes gathered before handing a chunk to the server
+STREAM_BUFFER_BYTES = 64 * 1024
+
+# Array elements encoded per call while streaming
+STREAM_CHUNK_ITEMS = 1000
+
+if orjson is not None:
+    dumps = orjson.dumps
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(value):
+        return _encoder.encode(value).encode('utf-8')
+
+
+def buffered(chunks, size=STREAM_BUFFER_BYTES):
+    """Join small chunks so the server isn't asked to send one line at a time"""
+    buffer = []
+    buffered_bytes = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_bytes += len(chunk)
+        if buffered_bytes >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered_bytes = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+class LazyArray:
+    """A JSON array whose elements are produced in chunks while the response is sent"""
+
+    def __init__(self, chunks):
+        # Callable returning an iterable of lists of elements
+        self.chunks = chunks
+
+
+class RawJSON:
+    """A value that is already encoded as JSON, sent as it is"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def iter_json(data):
+    """Encode a dict as JSON piece by piece, streaming any LazyArray values and copying RawJSON ones"""
+    yield b'{'
+    separator = b''
+    for key, value in data.items():
+        yield separator + dumps(key) + b':'
+        yield from _iter_value(value)
+        separator = b','
+    yield b'}'
+
+
+def _iter_value(value):
+    if isinstance(value, RawJSON):
+        yield value.data
+    elif isinstance(value, LazyArray):
+        yield b'['
+        item_separator = b''
+        for items in value.chunks():
+            if items:
+                # One encoder call per chunk, without its enclosing brackets
+                yield item_separator + dumps(items)[1:-1]
+                item_separator = b','
+        yield b']'
+    elif isinstance(value, dict):
+        yield from iter_json(value)
+    elif isinstance(value, list) and any(isinstance(item, RawJSON) for item in value):
+        yield b'['
+        item_separator = b''
+        for item in value:
+            yield item_separator
+            yield from _iter_value(item)
+            item_separator = b','
+        yield b']'
+    else:
+        yield dumps(value)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """JSON response that is encoded while it is sent instead of all at once"""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(buffered(iter_json(data)), **kwargs)
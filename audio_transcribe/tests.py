@@ -1,3 +1,1519 @@
-from django.test import TestCase
+import io
+import os
+import json
+import importlib
+import shutil
+import time
+import struct
+import subprocess
+import sys
+import threading
+import tempfile
+import zipfile
+import zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlsplit
+
+import requests
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api_auth.authentication import BearerTokenAuthentication
+
+from . import admission, artifacts, assemblyai, backends, jobs, packing, profiling, replicas, throttling, tracing, usage
+from .export import build_cues, render_srt, render_vtt, subtitle_files
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from .deadline import DeadlineExceeded, budget, call_timeout
+from .models import SchedulerLock, Transcription, TranscriptArtifact, TranscriptTimeline, UsageRollup
+from .packing import PackedWords, pack_words
+from .probe import probe_duration, suggested_poll_interval
+from .search import search_transcriptions
+from .streaming import LazyArray, RawJSON, buffered, iter_json
+from .timeline import build_index, overlapping, save_result, store_timeline
+
+
+class ProbeDurationTests(TestCase):
+    """Durations read from container and frame headers"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_wav_skips_unknown_chunks(self):
+        fmt = struct.pack('<HHIIHH', 1, 1, 16000, 32000, 2, 16)
+        body = (
+            b'WAVE'
+            + b'LIST' + struct.pack('<I', 3) + b'abc\0'  # odd sized, so padded
+            + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+            + b'data' + struct.pack('<I', 64000) + b'\0' * 16
+        )
+        path = self.write('a.wav', b'RIFF' + struct.pack('<I', len(body)) + body)
+        self.assertEqual(probe_duration(path), 2.0)
+
+    def test_flac_streaminfo(self):
+        packed = (44100 << 44) | (1 << 41) | (15 << 36) | 441000
+        streaminfo = b'\0' * 10 + packed.to_bytes(8, 'big') + b'\0' * 16
+        path = self.write('a.flac', b'fLaC' + bytes([0x80, 0, 0, 34]) + streaminfo)
+        self.assertEqual(probe_duration(path), 10.0)
+
+    def test_mp4_finds_moov_after_mdat(self):
+        def atom(name, payload):
+            return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+        mvhd = atom(b'mvhd', b'\0' * 4 + b'\0' * 8 + struct.pack('>II', 1000, 12500))
+        data = atom(b'ftyp', b'M4A \0\0\0\0') + atom(b'mdat', b'\0' * 4096) + atom(b'moov', mvhd)
+        path = self.write('a.m4a', data)
+        self.assertEqual(probe_duration(path), 12.5)
+
+    def test_mp3_constant_bitrate_after_id3_tag(self):
+        # MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo
+        frame = b'\xff\xfb\x90\x00' + b'\0' * 413
+        id3 = b'ID3\x03\x00\x00' + bytes([0, 0, 0, 20]) + b'\0' * 20
+        path = self.write('a.mp3', id3 + frame * 100)
+        self.assertAlmostEqual(probe_duration(path), len(frame) * 100 * 8 / 128000, places=3)
+
+    def test_mp3_xing_frame_count(self):
+        frame = bytearray(b'\xff\xfb\x90\x00' + b'\0' * 413)
+        frame[36:48] = b'Xing' + struct.pack('>II', 1, 1000)
+        path = self.write('a.mp3', bytes(frame) * 3)
+        self.assertEqual(probe_duration(path), round(1000 * 1152 / 44100, 3))
+
+    def test_mp3_lone_sync_is_not_audio(self):
+        # A valid looking frame header with no second frame where it says the next one starts
+        data = b'\0' * 100 + b'\xff\xfb\x90\x00' + b'\0' * 5000
+        self.assertIsNone(probe_duration(self.write('a.mp3', data)))
+
+    def test_unrecognised_audio(self):
+        self.assertIsNone(probe_duration(self.write('a.bin', b'not audio' * 10)))
+        self.assertIsNone(probe_duration(os.path.join(self.dir, 'missing.mp3')))
+
+    def test_poll_interval_grows_with_duration(self):
+        self.assertEqual(suggested_poll_interval(None), 5)
+        self.assertEqual(suggested_poll_interval(10), 2)
+        self.assertEqual(suggested_poll_interval(600), 18)
+        self.assertEqual(suggested_poll_interval(36000), 30)
+
+
+@override_settings(MAX_UPSTREAM_JOBS=2, ADMISSION_AUTHENTICATED_WEIGHT=4, ADMISSION_ANONYMOUS_WEIGHT=1)
+class AdmissionTests(TestCase):
+    """Upstream slots and the weighted fair queue"""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.anonymous = User.objects.create(username=admission.ANONYMOUS_USERNAME)
+
+    def enqueue(self, user, seconds):
+        return admission.enqueue(user, None, None, seconds, 'en', False, audio_url='https://example.com/a.mp3')
+
+    def submitted(self, order):
+        """submit_job stand-in that records the order jobs are submitted in"""
+        def submit(job):
+            order.append(job.transcript_id)
+            job.status = 'queued'
+            job.save(update_fields=['status'])
+        return submit
+
+    def test_reserve_slot_until_capacity_is_taken(self):
+        first = admission.reserve_slot(self.alice, 30, 'en', False)
+        second = admission.reserve_slot(self.alice, 30, 'en', False)
+        self.assertEqual((first.status, second.status), (admission.SUBMITTING, admission.SUBMITTING))
+        self.assertIsNotNone(first.submitted_at)
+        self.assertIsNone(admission.reserve_slot(self.bob, 30, 'en', False))
+
+    def test_reserve_slot_does_not_skip_queued_jobs(self):
+        self.enqueue(self.alice, 30)
+        self.assertIsNone(admission.reserve_slot(self.bob, 30, 'en', False))
+
+    def test_expired_slots_are_not_counted(self):
+        admission.reserve_slot(self.alice, 30, 'en', False)
+        admission.reserve_slot(self.alice, 30, 'en', False)
+        with override_settings(UPSTREAM_SLOT_TTL=-1):
+            self.assertEqual(admission.active_upstream_jobs(), 0)
+
+    def test_queue_is_weighted_by_user_and_audio_length(self):
+        anonymous = self.enqueue(self.anonymous, 60)
+        alice_long = self.enqueue(self.alice, 600)
+        alice_short = self.enqueue(self.alice, 60)
+        bob = self.enqueue(self.bob, 20)
+        # Anonymous jobs cost four times as much, and a user's jobs queue behind each other
+        self.assertEqual(anonymous.queue_key, 60)
+        self.assertEqual(alice_long.queue_key, 150)
+        self.assertEqual(alice_short.queue_key, 165)
+        self.assertEqual(bob.queue_key, 5)
+        self.assertEqual(admission.queue_position(bob), 1)
+        self.assertEqual(admission.queue_position(alice_short), 4)
+
+    def test_dispatch_in_fair_order_up_to_capacity(self):
+        anonymous = self.enqueue(self.anonymous, 60)
+        alice = self.enqueue(self.alice, 60)
+        bob = self.enqueue(self.bob, 600)
+        order = []
+        with mock.patch.object(admission, 'submit_job', side_effect=self.submitted(order)):
+            self.assertEqual(admission.dispatch_pending(), 2)
+        self.assertEqual(order, [alice.transcript_id, anonymous.transcript_id])
+        bob.refresh_from_db()
+        self.assertEqual(bob.status, admission.PENDING_SUBMIT)
+        self.assertEqual(SchedulerLock.objects.get(name=admission.ADMISSION_LOCK).virtual_time, anonymous.queue_key)
+
+    def test_dispatch_leaves_jobs_queued_while_upstream_is_down(self):
+        job = self.enqueue(self.alice, 60)
+        with mock.patch.object(admission, 'submit_job', side_effect=CircuitOpenError('open', 30)):
+            self.assertEqual(admission.dispatch_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, admission.PENDING_SUBMIT)
+        self.assertIsNone(job.submitted_at)
+
+    def test_failed_submission_is_an_error(self):
+        job = self.enqueue(self.alice, 60)
+        with mock.patch.object(admission, 'submit_job', side_effect=ValueError('bad audio')):
+            self.assertEqual(admission.dispatch_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('error', 'bad audio'))
+
+
+@override_settings(SUBMIT_LEASE_SECONDS=60, JOB_MAX_ATTEMPTS=3)
+class SweepSubmittingTests(TestCase):
+    """Jobs whose submission was cut off are queued again, or failed when their audio is gone"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+
+    def submitting(self, seconds_ago, audio_url='', attempts=0):
+        return Transcription.objects.create(
+            transcript_id=admission.local_transcript_id(), user=self.user, status=admission.SUBMITTING,
+            audio_url=audio_url, audio_duration=30, attempts=attempts,
+            submitted_at=timezone.now() - timedelta(seconds=seconds_ago)
+        )
+
+    def test_interrupted_remote_audio_is_queued_again(self):
+        job = self.submitting(120, audio_url='https://example.com/a.mp3')
+        self.assertEqual(admission.sweep_submitting(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (admission.PENDING_SUBMIT, 1))
+        self.assertIsNone(job.submitted_at)
+        self.assertIsNotNone(job.queue_key)
+
+    def test_interrupted_request_upload_is_failed(self):
+        job = self.submitting(120)
+        admission.sweep_submitting()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'error')
+
+    def test_repeatedly_interrupted_job_is_failed(self):
+        job = self.submitting(120, audio_url='https://example.com/a.mp3', attempts=2)
+        admission.sweep_submitting()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('error', 3))
+
+    def test_submissions_in_progress_are_left_alone(self):
+        job = self.submitting(10, audio_url='https://example.com/a.mp3')
+        self.assertEqual(admission.sweep_submitting(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, admission.SUBMITTING)
+
+
+class InProcessWorkerTests(TestCase):
+    """Web processes stand in for job workers only when none are deployed"""
+
+    def setUp(self):
+        self.addCleanup(setattr, jobs, '_in_process', None)
+
+    def test_not_started_with_job_workers(self):
+        with override_settings(JOB_WORKERS=True), mock.patch.object(jobs.threading, 'Thread') as thread:
+            jobs.run_in_process()
+        thread.assert_not_called()
+
+    def test_started_once_without_job_workers(self):
+        with override_settings(JOB_WORKERS=False), mock.patch.object(jobs.threading, 'Thread') as thread:
+            jobs.run_in_process()
+            jobs.run_in_process()
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+
+@override_settings(
+    CIRCUIT_BREAKER_WINDOW=30, CIRCUIT_BREAKER_MIN_CALLS=4, CIRCUIT_BREAKER_FAILURE_RATIO=0.5,
+    CIRCUIT_BREAKER_SLOW_CALL_SECONDS=10, CIRCUIT_BREAKER_RESET_TIMEOUT=30
+)
+class CircuitBreakerTests(TestCase):
+    """Breaker state shared through the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test')
+
+    def record(self, outcomes, duration=0.1):
+        for success in outcomes:
+            self.breaker.record(success, duration)
+
+    def test_stays_closed_below_minimum_calls(self):
+        self.record([False, False, False])
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_trips_on_failure_ratio(self):
+        self.record([True, True, False, False])
+        self.assertEqual(self.breaker.state(), OPEN)
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before_call()
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+
+    def test_trips_on_slow_calls(self):
+        self.record([True] * 4, duration=12)
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_single_trial_once_reset_timeout_passes(self):
+        self.breaker.open()
+        cache.set(self.breaker._key('opened_at'), time.time() - 31, timeout=None)
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertTrue(self.breaker.before_call())
+        # Everyone else still waits for the trial's outcome
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_trial_outcome_closes_or_reopens(self):
+        self.breaker.open()
+        self.breaker.record(True, 0.1, trial=True)
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.breaker.record(False, 0.1, trial=True)
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertEqual(self.breaker.snapshot()['times_opened'], 2)
+
+    def test_abandoned_trial_lets_another_call_try(self):
+        self.breaker.open()
+        cache.set(self.breaker._key('opened_at'), time.time() - 31, timeout=None)
+        self.assertTrue(self.breaker.before_call())
+        self.breaker.abandon(trial=True)
+        self.assertTrue(self.breaker.before_call())
+
+
+class UpstreamFailureTests(TestCase):
+    """Failing to reach AssemblyAI is not a result"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('upstream', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.job = Transcription.objects.create(
+            transcript_id='up1', user=self.user, status='processing', audio_url='https://example.com/a.mp3'
+        )
+
+    def test_retrieve_leaves_job_alone(self):
+        with mock.patch.object(assemblyai, '_request', side_effect=requests.exceptions.ConnectionError('reset')):
+            response = self.client.get('/api/transcribe/up1/')
+        self.assertEqual(response.status_code, 502)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.version, self.job.error), ('processing', 0, None))
+        self.assertNotIn('ETag', response)
+
+    def test_failure_is_not_shared(self):
+        reply = mock.Mock(status_code=200)
+        reply.json.return_value = {'id': 'up1', 'status': 'processing', 'percentage': 40}
+        with mock.patch.object(assemblyai, '_request', side_effect=[requests.exceptions.Timeout('slow'), reply]):
+            self.assertEqual(self.client.get('/api/transcribe/up1/').status_code, 502)
+            response = self.client.get('/api/transcribe/up1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'processing')
+
+    def test_time_range_reports_bad_gateway(self):
+        Transcription.objects.filter(pk=self.job.pk).update(status='completed')
+        with mock.patch.object(assemblyai, '_request', side_effect=requests.exceptions.ConnectionError('reset')):
+            response = self.client.get('/api/transcribe/up1/range/', {'start': 0, 'end': 5})
+        self.assertEqual(response.status_code, 502)
+
+
+class SearchTests(TestCase):
+    """Full-text search over a user's transcript text"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', password='x')
+        self.other = User.objects.create_user('other', password='x')
+        self.create(self.user, 's1', 'the quarterly budget meeting ran long')
+        self.create(self.user, 's2', 'budget budget budget review')
+        self.create(self.other, 's3', 'budget of someone else')
+
+    def create(self, user, transcript_id, text):
+        return Transcription.objects.create(
+            transcript_id=transcript_id, user=user, status='completed', text=text, audio_url='https://example.com/a.mp3'
+        )
+
+    def test_ranked_matches_of_own_transcripts(self):
+        results = search_transcriptions(self.user, 'budget')
+        self.assertEqual([t.transcript_id for t, rank, snippet in results], ['s2', 's1'])
+        self.assertIn('<mark>budget</mark>', results[1][2])
+
+    def test_query_syntax_is_treated_as_words(self):
+        self.assertEqual(search_transcriptions(self.user, 'owner:* OR NEAR('), [])
+        self.assertEqual(search_transcriptions(self.user, '"'), [])
+
+    def test_index_follows_text_changes(self):
+        Transcription.objects.filter(transcript_id='s1').update(text='a planning session')
+        self.assertEqual([t.transcript_id for t, _, _ in search_transcriptions(self.user, 'planning')], ['s1'])
+        self.assertEqual([t.transcript_id for t, _, _ in search_transcriptions(self.user, 'budget')], ['s2'])
+
+
+class TimeRangeTests(TestCase):
+    """Words and utterances overlapping a window of a completed transcript"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('ranger', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.job = Transcription.objects.create(
+            transcript_id='r1', user=self.user, status='completed', text='one two three',
+            audio_url='https://example.com/a.mp3'
+        )
+
+    def test_overlapping_uses_running_max_end(self):
+        # The long first item still overlaps windows after the short ones have ended
+        items, starts, max_ends = build_index([
+            {'start': 500, 'end': 600}, {'start': 0, 'end': 5000}, {'start': 700, 'end': 800}, {'start': 900},
+        ])
+        self.assertEqual(starts, [0, 500, 700, 900])
+        self.assertEqual(max_ends, [5000, 5000, 5000, 5000])
+        self.assertEqual(overlapping(items, starts, max_ends, 650, 750), [{'start': 0, 'end': 5000}, {'start': 700, 'end': 800}])
+        self.assertEqual(overlapping(items, starts, max_ends, 5000, 6000), [])
+
+    def test_range_of_stored_timeline(self):
+        store_timeline(self.job, {
+            'status': 'completed',
+            'words': [
+                {'text': 'one', 'start': 0, 'end': 400, 'confidence': 0.9, 'speaker': 'A'},
+                {'text': 'two', 'start': 500, 'end': 900, 'confidence': 0.8, 'speaker': 'A'},
+                {'text': 'three', 'start': 1000, 'end': 1400, 'confidence': 0.7, 'speaker': 'B'},
+            ],
+            'utterances': [
+                {'text': 'one two', 'start': 0, 'end': 900, 'speaker': 'A', 'words': []},
+                {'text': 'three', 'start': 1000, 'end': 1400, 'speaker': 'B', 'words': []},
+            ],
+        })
+        response = self.client.get('/api/transcribe/r1/range/', {'start': 800, 'end': 1100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([w['text'] for w in response.data['words']], ['two', 'three'])
+        self.assertEqual([u['text'] for u in response.data['utterances']], ['one two', 'three'])
+        self.assertNotIn('words', response.data['utterances'][0])
+
+    def test_rejects_unfinished_and_unknown_transcripts(self):
+        Transcription.objects.filter(pk=self.job.pk).update(status='processing')
+        self.assertEqual(self.client.get('/api/transcribe/r1/range/', {'start': 0, 'end': 1}).status_code, 409)
+        self.assertEqual(self.client.get('/api/transcribe/nope/range/', {'start': 0, 'end': 1}).status_code, 404)
+        self.assertEqual(self.client.get('/api/transcribe/r1/range/', {'start': 2, 'end': 1}).status_code, 400)
+
+
+class PackedWordsTests(TestCase):
+    """Word timings packed into compressed columns"""
+
+    WORDS = [
+        {'text': 'hello', 'start': 0, 'end': 400, 'confidence': 0.98, 'speaker': 'A'},
+        {'text': '', 'start': 500, 'end': 600, 'confidence': None, 'speaker': None},
+        {'text': 'long', 'start': 700, 'end': 9000, 'confidence': 0.5, 'speaker': 'B'},
+        {'text': 'hello', 'start': 800, 'end': 900, 'confidence': 0.25, 'speaker': 'A'},
+    ]
+
+    def test_round_trip(self):
+        words = PackedWords(pack_words(self.WORDS))
+        self.assertEqual(len(words), 4)
+        self.assertEqual(words.words(), self.WORDS)
+        self.assertEqual(list(words.chunks(3)), [self.WORDS[:3], self.WORDS[3:]])
+
+    def test_tables_holding_only_an_empty_string(self):
+        only_empty = [{'text': '', 'start': 10, 'end': 20, 'confidence': None, 'speaker': ''}]
+        self.assertEqual(PackedWords(pack_words(only_empty)).words(), only_empty)
+        self.assertEqual(PackedWords(pack_words([])).words(), [])
+        self.assertEqual(PackedWords(b'').overlapping(0, 100), [])
+
+    def test_overlapping_reaches_back_by_the_longest_word(self):
+        words = PackedWords(pack_words(self.WORDS))
+        self.assertEqual(words.max_duration(), 8300)
+        self.assertEqual([w['start'] for w in words.overlapping(5000, 6000)], [700])
+        self.assertEqual([w['start'] for w in words.overlapping(450, 750)], [500, 700])
+        self.assertEqual(words.between(500, 800), (1, 3))
+
+    def test_reads_version_1(self):
+        legacy = importlib.import_module('audio_transcribe.migrations.0006_packed_words')
+        only_empty = [{'text': '', 'start': 10, 'end': 20, 'confidence': None, 'speaker': ''}]
+        self.assertEqual(PackedWords(legacy.pack_words(only_empty)).words(), only_empty)
+        words = PackedWords(legacy.pack_words(self.WORDS))
+        self.assertEqual(words.words(), self.WORDS)
+        self.assertEqual([w['start'] for w in words.overlapping(5000, 6000)], [700])
+
+    def test_reads_version_2(self):
+        words = PackedWords(bytes.fromhex(
+            '789c0b8908776162616060c85160606006d2dc40ccc4006183c0174606863d400105a0c004203b05aa36052acf08558f6033'
+            '325cb766a863b06030c948cdc9c9072acfcf4b7764700200ffc70bf2'
+        ))
+        self.assertEqual(words.words(), self.WORDS)
+        self.assertEqual(words.max_duration(), 8300)
+        self.assertEqual([w['start'] for w in words.overlapping(450, 750)], [500, 700])
+
+    def test_window_only_decompresses_its_blocks(self):
+        many = [
+            {'text': f"w{i % 7}", 'start': i * 100, 'end': i * 100 + 80, 'confidence': 0.5, 'speaker': 'AB'[i % 2]}
+            for i in range(packing.BLOCK_WORDS * 3 + 5)
+        ]
+        words = PackedWords(pack_words(many))
+        self.assertEqual(words.words(), many)
+        window = PackedWords(pack_words(many))
+        with mock.patch.object(packing.zlib, 'decompress', wraps=zlib.decompress) as decompress:
+            found = window.overlapping(packing.BLOCK_WORDS * 100 - 150, packing.BLOCK_WORDS * 100 + 150)
+        self.assertEqual(found, many[packing.BLOCK_WORDS - 2:packing.BLOCK_WORDS + 2])
+        self.assertEqual(decompress.call_count, 2)
+        self.assertEqual(words.between(0, len(many) * 100), (0, len(many)))
+        self.assertEqual(words.between(150, 350), (2, 4))
+
+
+class ExportTests(TestCase):
+    """Streamed NDJSON and subtitle exports"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('exporter', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def word(self, text, start, end, speaker='A'):
+        return {'text': text, 'start': start, 'end': end, 'confidence': 0.9, 'speaker': speaker}
+
+    def test_cues_break_on_speaker_pause_and_length(self):
+        cues = build_cues([
+            self.word('hi', 0, 300), self.word('there', 300, 600),
+            self.word('yes', 700, 900, speaker='B'),
+            self.word('later', 3000, 3300, speaker='B'),
+        ])
+        self.assertEqual(cues, [(0, 600, 'hi there'), (700, 900, 'yes'), (3000, 3300, 'later')])
+        long_cue = build_cues([self.word('word%02d' % i, i * 100, i * 100 + 90) for i in range(13)])
+        self.assertEqual(len(long_cue), 2)
+        self.assertIn('\n', long_cue[0][2])
+
+    def test_subtitle_formats(self):
+        cues = [(1500, 3723004, 'hello')]
+        self.assertEqual(render_srt(cues), '1\n00:00:01,500 --> 01:02:03,004\nhello\n\n')
+        self.assertEqual(render_vtt(cues), 'WEBVTT\n\n00:00:01.500 --> 01:02:03.004\nhello\n\n')
+
+    def test_ndjson_streams_own_transcripts(self):
+        other = User.objects.create_user('someone', password='x')
+        for user, transcript_id in ((self.user, 'e1'), (other, 'e2'), (self.user, 'e3')):
+            Transcription.objects.create(
+                transcript_id=transcript_id, user=user, status='completed', text=transcript_id,
+                audio_url='https://example.com/a.mp3'
+            )
+        response = self.client.get('/api/transcribe/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], ['e1', 'e3'])
+
+    def test_subtitles_of_completed_transcripts_as_zip(self):
+        job = Transcription.objects.create(
+            transcript_id='e4', user=self.user, status='completed', text='hi there',
+            audio_url='https://example.com/a.mp3'
+        )
+        store_timeline(job, {'status': 'completed', 'words': [self.word('hi', 0, 300), self.word('there', 300, 600)]})
+        Transcription.objects.create(
+            transcript_id='e5', user=self.user, status='processing', audio_url='https://example.com/a.mp3'
+        )
+        response = self.client.get('/api/transcribe/export/', {'type': 'srt'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['e4.srt'])
+        self.assertEqual(archive.read('e4.srt').decode('utf-8'), '1\n00:00:00,000 --> 00:00:00,600\nhi there\n\n')
+
+    def test_subtitles_built_from_words_in_one_query(self):
+        for transcript_id in ('e6', 'e7', 'e8'):
+            job = Transcription.objects.create(
+                transcript_id=transcript_id, user=self.user, status='completed', text='hi',
+                audio_url='https://example.com/a.mp3'
+            )
+            store_timeline(job, {'status': 'completed', 'words': [self.word('hi', 0, 300)]})
+        TranscriptArtifact.objects.all().delete()
+        with self.assertNumQueries(1):
+            files = list(subtitle_files(Transcription.objects.filter(user=self.user).order_by('pk'), 'vtt'))
+        self.assertEqual([name for name, _ in files], ['e6.vtt', 'e7.vtt', 'e8.vtt'])
+
+    def test_rejects_unknown_type(self):
+        self.assertEqual(self.client.get('/api/transcribe/export/', {'type': 'pdf'}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    """ETags and 304 responses for transcripts and listings"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('conditional', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.job = Transcription.objects.create(
+            transcript_id='c1', user=self.user, status='completed', text='done', audio_url='https://example.com/a.mp3'
+        )
+
+    def test_version_only_changes_with_the_result(self):
+        job = Transcription(transcript_id='c2', status='processing')
+        job.update_from_result({'status': 'processing', 'percentage': 10})
+        self.assertEqual(job.version, 0)
+        job.update_from_result({'status': 'completed', 'text': 'hello', 'audio_duration': 3.5})
+        self.assertEqual(job.version, 1)
+        completed_at = job.completed_at
+        job.update_from_result({'status': 'completed', 'text': 'hello', 'audio_duration': 3.5})
+        self.assertEqual((job.version, job.completed_at), (1, completed_at))
+
+    def test_finished_transcript_is_not_fetched_again(self):
+        with mock.patch.object(assemblyai, '_request', side_effect=AssertionError('AssemblyAI was called')):
+            response = self.client.get('/api/transcribe/c1/', {'fields': 'status,text'})
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            response = self.client.get('/api/transcribe/c1/', {'fields': 'status,text'}, HTTP_IF_NONE_MATCH=f"W/{etag}")
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Each fieldset has its own tag
+        self.assertNotEqual(self.job.etag(variant='status'), self.job.etag(variant='status,text'))
+
+    def test_list_tag_changes_with_rows(self):
+        with mock.patch.object(assemblyai, 'list_transcripts', return_value=[]):
+            etag = self.client.get('/api/transcribe/')['ETag']
+            self.assertEqual(self.client.get('/api/transcribe/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            Transcription.objects.filter(pk=self.job.pk).update(version=2)
+            self.assertEqual(self.client.get('/api/transcribe/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_tag_changes_when_a_queued_job_fails(self):
+        job = admission.enqueue(self.user, None, None, 60, 'en', False, audio_url='https://example.com/b.mp3')
+        with mock.patch.object(assemblyai, 'list_transcripts', return_value=[]):
+            etag = self.client.get('/api/transcribe/')['ETag']
+            with mock.patch.object(admission, 'submit_job', side_effect=RuntimeError('rejected')):
+                admission.dispatch_pending()
+            self.assertEqual(Transcription.objects.get(pk=job.pk).status, 'error')
+            response = self.client.get('/api/transcribe/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ProgressTests(TestCase):
+    """A transcript reports the same progress whichever fields are asked for"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('progress', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_status_response(self):
+        self.assertEqual(assemblyai.status_response({'status': 'completed'})['progress'], 100)
+        self.assertEqual(assemblyai.status_response({'status': 'processing', 'percentage': 40})['progress'], 40)
+        self.assertEqual(assemblyai.status_response({'status': 'queued'})['progress'], 0)
+
+    def test_completed_transcript_in_every_fieldset(self):
+        job = Transcription.objects.create(
+            transcript_id='p1', user=self.user, status='completed', text='hi', audio_url='https://example.com/a.mp3'
+        )
+        # Stored when the result did not carry a percentage
+        store_timeline(job, {'status': 'completed', 'progress': 0, 'words': [{'text': 'hi', 'start': 0, 'end': 100}]})
+        full = json.loads(b''.join(self.client.get('/api/transcribe/p1/').streaming_content))
+        stored = self.client.get('/api/transcribe/p1/', {'fields': 'status,progress'}).data
+        self.assertEqual(full['progress'], 100)
+        self.assertEqual(stored, {'status': 'completed', 'progress': 100})
+
+
+class StreamingJSONTests(TestCase):
+    """JSON encoded piece by piece while it is sent"""
+
+    def test_matches_json_encoding(self):
+        data = {
+            'status': 'completed',
+            'text': 'caf\u00e9 "quoted"',
+            'words': LazyArray(lambda: iter([[{'text': 'a', 'start': 0}], [], [{'text': 'b', 'start': 1}]])),
+            'empty': LazyArray(lambda: iter([])),
+            'nested': {'raw': RawJSON(b'{"x":1}'), 'items': [RawJSON(b'[2]'), 3]},
+        }
+        self.assertEqual(json.loads(b''.join(iter_json(data))), {
+            'status': 'completed',
+            'text': 'caf\u00e9 "quoted"',
+            'words': [{'text': 'a', 'start': 0}, {'text': 'b', 'start': 1}],
+            'empty': [],
+            'nested': {'raw': {'x': 1}, 'items': [[2], 3]},
+        })
+
+    def test_buffered_joins_small_chunks(self):
+        self.assertEqual(list(buffered([b'ab', b'cd', b'e'], size=4)), [b'abcd', b'e'])
+        self.assertEqual(list(buffered([])), [])
+
+    def test_stored_words_are_streamed_in_order(self):
+        user = User.objects.create_user('streamer', password='x')
+        job = Transcription.objects.create(
+            transcript_id='st1', user=user, status='completed', text='x', audio_url='https://example.com/a.mp3'
+        )
+        words = [{'text': f'w{i}', 'start': i * 10, 'end': i * 10 + 5, 'confidence': 0.5, 'speaker': 'A'} for i in range(2500)]
+        store_timeline(job, {
+            'status': 'completed', 'words': words,
+            'utterances': [{'text': 'all', 'start': 0, 'end': 25000, 'speaker': 'A', 'words': words}],
+        })
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/transcribe/st1/')
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body['words'], words)
+        self.assertEqual(body['utterances'][0]['words'], words)
+        self.assertEqual(list(body)[:3], ['status', 'progress', 'text'])
+
+
+@override_settings(AUDIO_MINUTES_PER_DAY=10)
+class ThrottleRefundTests(TestCase):
+    """Charges are given back to the window they were counted in"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('quota', password='x')
+        self.request = APIRequestFactory().post('/api/transcribe/')
+        self.request.user = self.user
+        self.counter, self.ident = throttling.audio_quota(self.request)
+
+    def at(self, bucket, elapsed=0.5):
+        return mock.patch.object(throttling.SlidingWindowCounter, '_position', return_value=(bucket, elapsed))
+
+    def count(self, bucket):
+        return cache.get(self.counter._key(self.ident, bucket), 0)
+
+    def test_refund_after_the_window_rolls_over(self):
+        with self.at(7, 0.99):
+            allowed, _, charge = throttling.charge_audio(self.request, 120)
+        self.assertTrue(allowed)
+        with self.at(8, 0.01):
+            throttling.charge_audio(self.request, 30)
+            throttling.refund_audio(charge)
+        self.assertEqual((self.count(7), self.count(8)), (0, 30))
+
+    def test_rejected_charge_has_nothing_to_refund(self):
+        with self.at(7):
+            allowed, retry_after, charge = throttling.charge_audio(self.request, 601)
+        self.assertEqual((allowed, charge), (False, None))
+        self.assertIsNone(retry_after)
+        throttling.refund_audio(charge)
+        self.assertEqual(self.count(7), 0)
+
+    def test_partial_refund_of_a_batch(self):
+        with self.at(7):
+            _, _, charge = throttling.charge_audio(self.request, 180)
+            throttling.refund_audio(charge, 60)
+        self.assertEqual(self.count(7), 120)
+
+    def test_failed_background_submission_is_refunded_once(self):
+        with self.at(7):
+            _, _, charge = throttling.charge_audio(self.request, 120)
+            job = admission.enqueue(self.user, None, None, 120, 'en', False, audio_url='https://example.com/a.mp3')
+            throttling.hold_audio_charge(job, charge)
+            with mock.patch.object(admission, 'submit_job', side_effect=RuntimeError('rejected')):
+                admission.dispatch_pending()
+            throttling.refund_job_audio(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'error')
+        self.assertEqual(self.count(7), 0)
+
+    def test_submitted_job_keeps_its_charge(self):
+        with self.at(7):
+            _, _, charge = throttling.charge_audio(self.request, 120)
+            job = admission.enqueue(self.user, None, None, 120, 'en', False, audio_url='https://example.com/a.mp3')
+            throttling.hold_audio_charge(job, charge)
+            with mock.patch.object(assemblyai, 'create_transcript', return_value={'id': 'upstream-1'}):
+                admission.dispatch_pending()
+            throttling.refund_job_audio(job)
+        self.assertEqual(self.count(7), 120)
+
+
+class ImportTests(TestCase):
+    """Importing the app has no side effects and needs no configuration"""
+
+    def test_app_imports_without_api_key(self):
+        env = {k: v for k, v in os.environ.items() if k != 'ASSEMBLYAI_API_KEY'}
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'speech_to_text_api.settings')
+        result = subprocess.run(
+            [sys.executable, '-c', 'import speech_to_text_api.wsgi, audio_transcribe.views'],
+            env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    @override_settings(ASSEMBLYAI_API_KEY='')
+    def test_missing_api_key_is_reported_on_first_call(self):
+        with self.assertRaises(ImproperlyConfigured):
+            assemblyai.auth_headers()
+
+    def test_one_session_per_thread(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(assemblyai.session()))
+        thread.start()
+        thread.join()
+        self.assertIs(assemblyai.session(), assemblyai.session())
+        self.assertIsNot(sessions[0], assemblyai.session())
+
+
+@override_settings(LOCAL_TRANSCRIPTION_MAX_SECONDS=30)
+class BackendTests(TestCase):
+    """Routing between the local engine and AssemblyAI"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='backend')
+        available = mock.patch.object(backends.local_engine, 'available', return_value=True)
+        available.start()
+        self.addCleanup(available.stop)
+
+    def local_job(self, **fields):
+        return Transcription.objects.create(
+            transcript_id=admission.local_transcript_id(), user=self.user, status='processing', audio_url='',
+            audio_duration=12, backend=backends.LOCAL, submitted_at=timezone.now(), **fields
+        )
+
+    def finish(self, job, future):
+        backends.local_backend._in_flight += 1
+        # The pool's result thread closes its connection, which would end the test's transaction
+        with mock.patch.object(backends, 'connection'):
+            backends.local_backend._finish(job.pk, future)
+        job.refresh_from_db()
+
+    def test_short_clips_go_local(self):
+        self.assertIs(backends.route(12), backends.local_backend)
+        self.assertIs(backends.route(31), backends.assemblyai_backend)
+        self.assertIs(backends.route(None), backends.assemblyai_backend)
+        with override_settings(LOCAL_TRANSCRIPTION_MAX_SECONDS=0):
+            self.assertIs(backends.route(12), backends.assemblyai_backend)
+
+    def test_local_result_is_stored(self):
+        job = self.local_job()
+        future = mock.Mock()
+        future.result.return_value = {'status': 'completed', 'text': 'hello', 'audio_duration': 12}
+        self.finish(job, future)
+        self.assertEqual((job.status, job.text, job.backend), ('completed', 'hello', backends.LOCAL))
+        self.assertEqual(backends.for_job(job), backends.local_backend)
+
+    def test_failed_local_job_goes_upstream(self):
+        job = self.local_job(spool_file='spool/a.wav')
+        future = mock.Mock()
+        future.result.side_effect = RuntimeError('model crashed')
+        self.finish(job, future)
+        self.assertEqual((job.status, job.backend), (admission.PENDING_SUBMIT, backends.ASSEMBLYAI))
+
+    @override_settings(LOCAL_TRANSCRIPTION_TIMEOUT=60)
+    def test_stalled_local_jobs_go_upstream(self):
+        stalled = self.local_job(spool_file='spool/a.wav')
+        Transcription.objects.filter(pk=stalled.pk).update(submitted_at=timezone.now() - timedelta(seconds=61))
+        running = self.local_job(spool_file='spool/b.wav')
+        self.assertEqual(backends.local_backend.recover_stalled(), 1)
+        stalled.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stalled.status, admission.PENDING_SUBMIT)
+        self.assertEqual(running.status, 'processing')
+
+
+@override_settings(JOB_LEASE_SECONDS=60, JOB_MAX_ATTEMPTS=3)
+class JobLeaseTests(TestCase):
+    """Upstream jobs claimed with leases and advanced by polling"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='leases')
+
+    def job(self, transcript_id, **fields):
+        fields.setdefault('status', 'processing')
+        return Transcription.objects.create(
+            transcript_id=transcript_id, upstream_id=transcript_id, user=self.user,
+            audio_url='https://example.com/a.mp3', **fields
+        )
+
+    def test_claims_only_due_unleased_jobs(self):
+        now = timezone.now()
+        self.job('due', next_poll_at=now - timedelta(seconds=5))
+        self.job('never_polled')
+        self.job('later', next_poll_at=now + timedelta(seconds=60))
+        self.job('leased', lease_owner='other', lease_expires=now + timedelta(seconds=30))
+        self.job('lease_lapsed', lease_owner='other', lease_expires=now - timedelta(seconds=1))
+        self.job('done', status='completed')
+        claimed = jobs.claim('me', 10)
+        self.assertEqual(sorted(job.transcript_id for job in claimed), ['due', 'lease_lapsed', 'never_polled'])
+        self.assertEqual(jobs.claim('someone', 10), [])
+        self.assertFalse(jobs.release(claimed[0], 'someone', None))
+
+    def test_completed_poll_releases_the_job(self):
+        self.job('j1')
+        job = jobs.claim('me', 1)[0]
+        with mock.patch.object(assemblyai, 'fetch_transcript', return_value={'status': 'completed', 'text': 'hi'}):
+            jobs.advance(job, 'me')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_owner, job.next_poll_at), ('completed', None, None))
+
+    def test_failed_polls_back_off_then_give_up(self):
+        self.job('j2')
+        error = requests.exceptions.ConnectionError('reset')
+        with mock.patch.object(assemblyai, 'fetch_transcript', side_effect=error):
+            for attempt in (1, 2):
+                job = jobs.claim('me', 1)[0]
+                jobs.advance(job, 'me')
+                job.refresh_from_db()
+                self.assertEqual((job.status, job.attempts), ('processing', attempt))
+                delay = (job.next_poll_at - timezone.now()).total_seconds()
+                self.assertAlmostEqual(delay, jobs.retry_delay(attempt), delta=2)
+                Transcription.objects.filter(pk=job.pk).update(next_poll_at=None)
+            jobs.advance(jobs.claim('me', 1)[0], 'me')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'error')
+
+    def test_outage_is_not_counted_against_the_job(self):
+        self.job('j3')
+        job = jobs.claim('me', 1)[0]
+        with mock.patch.object(assemblyai, 'fetch_transcript', side_effect=CircuitOpenError('assemblyai', 30)):
+            jobs.advance(job, 'me')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.lease_owner), ('processing', 0, None))
+
+    def test_client_errors_are_permanent(self):
+        not_found = requests.exceptions.HTTPError(response=mock.Mock(status_code=404))
+        throttled = requests.exceptions.HTTPError(response=mock.Mock(status_code=429))
+        self.assertTrue(jobs.is_permanent(not_found))
+        self.assertFalse(jobs.is_permanent(throttled))
+        self.assertFalse(jobs.is_permanent(requests.exceptions.Timeout()))
+
+
+def wav_bytes(seconds=2):
+    """A silent 8 kHz mono WAV file"""
+    fmt = struct.pack('<HHIIHH', 1, 1, 8000, 8000, 1, 8)
+    data = b'\x80' * (8000 * seconds)
+    body = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+class UploadTestCase(TestCase):
+    """Uploads by an authenticated client, with storage in a scratch directory"""
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media, LOCAL_TRANSCRIPTION_MAX_SECONDS=0)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = User.objects.create_user('uploader', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, **headers):
+        audio = SimpleUploadedFile('a.wav', wav_bytes(), content_type='audio/wav')
+        return self.client.post('/api/transcribe/upload/', {'file': audio, 'language_code': 'en'}, **headers)
+
+
+@override_settings(ASYNC_SUBMISSION=True)
+class AsyncSubmissionTests(UploadTestCase):
+    """Uploads accepted with 202 and submitted in the background"""
+
+    def test_upload_is_accepted_and_spooled(self):
+        with mock.patch.object(admission, 'submit_soon') as submit_soon, \
+                mock.patch.object(assemblyai, '_request', side_effect=AssertionError('AssemblyAI was called')):
+            response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], admission.PENDING_SUBMIT)
+        self.assertEqual(response.data['queue_position'], 1)
+        self.assertEqual(response.data['audio_duration'], 2.0)
+        submit_soon.assert_called_once()
+        job = Transcription.objects.get(transcript_id=response.data['transcript_id'])
+        self.assertTrue(admission.default_storage.exists(job.spool_file))
+
+        status_response = self.client.get(f"/api/transcribe/{job.transcript_id}/")
+        self.assertEqual(status_response.data['status'], admission.PENDING_SUBMIT)
+
+    def test_background_submission(self):
+        with mock.patch.object(admission, 'submit_soon'):
+            job_id = self.upload().data['transcript_id']
+        spool_file = Transcription.objects.get(transcript_id=job_id).spool_file
+        with mock.patch.object(assemblyai, 'upload_file', return_value='https://cdn.example.com/a'), \
+                mock.patch.object(assemblyai, 'create_transcript', return_value={'id': 'upstream-1'}):
+            self.assertEqual(admission.dispatch_pending(), 1)
+        job = Transcription.objects.get(transcript_id=job_id)
+        self.assertEqual((job.status, job.upstream_id, job.spool_file), ('queued', 'upstream-1', None))
+        self.assertFalse(admission.default_storage.exists(spool_file))
+
+    @override_settings(AUDIO_MINUTES_PER_DAY=60)
+    def test_unprobed_upload_is_charged_its_real_length(self):
+        audio = SimpleUploadedFile('a.mp3', b'\0' * 1000, content_type='audio/mpeg')
+        with mock.patch.object(admission, 'submit_soon'):
+            response = self.client.post('/api/transcribe/upload/', {'file': audio})
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.data['audio_duration'])
+        job = Transcription.objects.get(transcript_id=response.data['transcript_id'])
+        save_result(job, {'status': 'completed', 'audio_duration': 300})
+        counter = throttling.SlidingWindowCounter(throttling.AUDIO_COUNTER, None, throttling.AUDIO_QUOTA_WINDOW)
+        self.assertEqual(counter.usage(f"user_{self.user.pk}"), 300)
+
+
+@override_settings(ASYNC_SUBMISSION=True)
+class IdempotencyTests(UploadTestCase):
+    """Retried uploads with an Idempotency-Key are answered once"""
+
+    def setUp(self):
+        super().setUp()
+        submit_soon = mock.patch.object(admission, 'submit_soon')
+        submit_soon.start()
+        self.addCleanup(submit_soon.stop)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.upload(HTTP_IDEMPOTENCY_KEY='k1')
+        retry = self.upload(HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual((retry.status_code, retry.data), (202, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transcription.objects.count(), 1)
+        self.assertEqual(self.upload(HTTP_IDEMPOTENCY_KEY='k2').status_code, 202)
+        self.assertEqual(Transcription.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.upload(HTTP_IDEMPOTENCY_KEY='k1')
+        audio = SimpleUploadedFile('a.wav', wav_bytes(3), content_type='audio/wav')
+        response = self.client.post('/api/transcribe/upload/', {'file': audio}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_failed_request_frees_the_key(self):
+        with override_settings(AUDIO_MINUTES_PER_DAY=0.01):
+            self.assertEqual(self.upload(HTTP_IDEMPOTENCY_KEY='k1').status_code, 429)
+        self.assertEqual(self.upload(HTTP_IDEMPOTENCY_KEY='k1').status_code, 202)
+
+    def test_keys_are_scoped_to_the_client(self):
+        self.upload(HTTP_IDEMPOTENCY_KEY='k1')
+        self.client.force_authenticate(User.objects.create_user('second', password='x'))
+        self.assertNotIn('Idempotent-Replayed', self.upload(HTTP_IDEMPOTENCY_KEY='k1'))
+        self.assertEqual(Transcription.objects.count(), 2)
+
+
+class CacheWarningTests(TestCase):
+    """Startup warning when workers cannot share counters"""
+
+    def warn(self, workers, backend):
+        config = django_apps.get_app_config('audio_transcribe')
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': workers}), \
+                override_settings(CACHES={'default': {'BACKEND': backend}}):
+            config.warn_about_per_process_cache()
+
+    def test_per_process_cache_with_several_workers(self):
+        with self.assertLogs('audio_transcribe.apps', 'WARNING') as logs:
+            self.warn('4', 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertIn('each of the 4 web workers', logs.output[0])
+
+    def test_shared_cache_or_single_worker(self):
+        with self.assertNoLogs('audio_transcribe.apps', 'WARNING'):
+            self.warn('1', 'django.core.cache.backends.locmem.LocMemCache')
+            self.warn('4', 'django_redis.cache.RedisCache')
+
+
+class SubmitUrlTests(TestCase):
+    """Remote audio that AssemblyAI fetches itself"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('linker', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, data):
+        return self.client.post('/api/transcribe/url/', data, format='json')
+
+    def test_rejects_urls_assemblyai_cannot_fetch(self):
+        for url in ('ftp://example.com/a.mp3', 'not a url', 'http://127.0.0.1/a.mp3', 'http://10.1.2.3/a.mp3',
+                    'http://[::1]/a.mp3', 'http://localhost/a.mp3', 'https://example.com/' + 'a' * 2048, 42):
+            self.assertEqual(self.submit({'audio_url': url}).status_code, 400, url)
+        self.assertEqual(self.submit({}).status_code, 400)
+        self.assertFalse(Transcription.objects.exists())
+
+    def test_audio_is_never_downloaded_here(self):
+        with mock.patch.object(assemblyai, 'upload_file', side_effect=AssertionError('audio was uploaded')), \
+                mock.patch.object(assemblyai, 'create_transcript', return_value={'id': 'remote-1'}) as create:
+            response = self.submit({'audio_url': 'https://example.com/talk.mp3', 'language_code': 'en'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['transcript_id'], 'remote-1')
+        self.assertEqual(create.call_args[0][0], 'https://example.com/talk.mp3')
+        self.assertEqual(Transcription.objects.get().audio_url, 'https://example.com/talk.mp3')
+
+    def test_batch_reports_each_url(self):
+        with mock.patch.object(assemblyai, 'create_transcript', side_effect=[{'id': 'remote-1'}, RuntimeError('rejected')]):
+            response = self.submit({'audio_urls': ['https://example.com/a.mp3', 'https://example.com/b.mp3']})
+        self.assertEqual(response.status_code, 200)
+        first, second = response.data['transcriptions']
+        self.assertEqual(first['transcript_id'], 'remote-1')
+        self.assertEqual(second, {'audio_url': 'https://example.com/b.mp3', 'error': 'rejected'})
+
+    def test_batch_reports_when_to_retry_an_open_circuit(self):
+        side_effect = [{'id': 'remote-1'}, CircuitOpenError('assemblyai', 30)]
+        with mock.patch.object(assemblyai, 'create_transcript', side_effect=side_effect):
+            response = self.submit({'audio_urls': ['https://example.com/a.mp3', 'https://example.com/b.mp3']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['transcriptions'][1], {
+            'audio_url': 'https://example.com/b.mp3', 'error': 'assemblyai is unavailable, retry in 30s', 'retry_after': 30
+        })
+
+    def used(self):
+        return throttling.SlidingWindowCounter(throttling.AUDIO_COUNTER, None, throttling.AUDIO_QUOTA_WINDOW).usage(
+            f"user_{self.user.pk}"
+        )
+
+    @override_settings(AUDIO_MINUTES_PER_DAY=120)
+    def test_charge_is_corrected_to_the_real_length(self):
+        with mock.patch.object(assemblyai, 'create_transcript', side_effect=[{'id': 'long'}, {'id': 'short'}]):
+            self.submit({'audio_urls': ['https://example.com/long.mp3', 'https://example.com/short.mp3']})
+        self.assertEqual(self.used(), 2 * admission.DEFAULT_JOB_SECONDS)
+
+        save_result(Transcription.objects.get(upstream_id='long'), {'status': 'completed', 'audio_duration': 7200})
+        save_result(Transcription.objects.get(upstream_id='short'), {'status': 'completed', 'audio_duration': 10})
+        self.assertEqual(self.used(), 7210)
+        # Corrected once only
+        save_result(Transcription.objects.get(upstream_id='long'), {'status': 'completed', 'audio_duration': 7200})
+        self.assertEqual(self.used(), 7210)
+        self.assertEqual(self.submit({'audio_url': 'https://example.com/next.mp3'}).status_code, 429)
+
+
+@override_settings(ASYNC_SUBMISSION=True, DIRECT_UPLOAD_MAX_BYTES=100000)
+class DirectUploadTests(UploadTestCase):
+    """Audio uploaded to storage with a signed token, then completed"""
+
+    def setUp(self):
+        super().setUp()
+        submit_soon = mock.patch.object(admission, 'submit_soon')
+        submit_soon.start()
+        self.addCleanup(submit_soon.stop)
+
+    def start(self):
+        response = self.client.post('/api/transcribe/direct/', {'filename': 'talk.wav'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['upload_token'], response.data['upload']
+
+    def put(self, target, data):
+        url = urlsplit(target['url'])
+        return self.client.generic('PUT', f"{url.path}?{url.query}", data, content_type='audio/wav')
+
+    def complete(self, token):
+        return self.client.post('/api/transcribe/direct/complete/', {'upload_token': token}, format='json')
+
+    def test_upload_and_complete(self):
+        token, target = self.start()
+        self.assertEqual(target['method'], 'PUT')
+        self.assertEqual(self.put(target, wav_bytes()).status_code, 201)
+        response = self.complete(token)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['audio_duration'], 2.0)
+        job = Transcription.objects.get(transcript_id=response.data['transcript_id'])
+        self.assertTrue(admission.default_storage.exists(job.spool_file))
+        # Completing again would transcribe the same audio twice
+        self.assertEqual(self.complete(token).status_code, 409)
+
+    @override_settings(AUDIO_MINUTES_PER_DAY=60)
+    def test_unprobed_upload_is_charged_its_real_length(self):
+        token, target = self.start()
+        self.put(target, b'\0' * 1000)
+        response = self.complete(token)
+        self.assertEqual(response.status_code, 202)
+        counter = throttling.SlidingWindowCounter(throttling.AUDIO_COUNTER, None, throttling.AUDIO_QUOTA_WINDOW)
+        self.assertEqual(counter.usage(f"user_{self.user.pk}"), admission.DEFAULT_JOB_SECONDS)
+        job = Transcription.objects.get(transcript_id=response.data['transcript_id'])
+        save_result(job, {'status': 'completed', 'audio_duration': 600})
+        self.assertEqual(counter.usage(f"user_{self.user.pk}"), 600)
+
+    def test_rejects_bad_tokens_and_other_clients(self):
+        token, target = self.start()
+        self.assertEqual(self.complete(token).status_code, 400)  # nothing uploaded yet
+        self.assertEqual(self.complete(token + 'x').status_code, 400)
+        self.assertEqual(self.put({'url': target['url'] + 'x'}, b'audio').status_code, 403)
+        self.put(target, wav_bytes())
+        self.client.force_authenticate(User.objects.create_user('intruder', password='x'))
+        self.assertEqual(self.complete(token).status_code, 403)
+
+    def test_rejects_oversized_uploads_and_formats(self):
+        _, target = self.start()
+        self.assertEqual(self.put(target, b'\0' * 100001).status_code, 413)
+        response = self.client.post('/api/transcribe/direct/', {'filename': 'notes.txt'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ArtifactTests(TestCase):
+    """List entries, text and subtitles rendered once a transcript completes"""
+
+    RESULT = {
+        'status': 'completed', 'text': 'hi there', 'audio_duration': 1,
+        'words': [
+            {'text': 'hi', 'start': 0, 'end': 300, 'confidence': 0.9, 'speaker': 'A'},
+            {'text': 'there', 'start': 300, 'end': 600, 'confidence': 0.9, 'speaker': 'A'},
+        ],
+        'utterances': [{'text': 'hi there', 'start': 0, 'end': 600, 'speaker': 'A', 'words': []}],
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('artifacts', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.job = Transcription.objects.create(
+            transcript_id='a1', user=self.user, status='processing', audio_url='https://example.com/a.mp3'
+        )
+
+    def test_rendered_on_completion(self):
+        save_result(self.job, self.RESULT)
+        kinds = set(TranscriptArtifact.objects.filter(transcription=self.job).values_list('kind', flat=True))
+        self.assertEqual(kinds, {artifacts.LIST_ENTRY, artifacts.TEXT, artifacts.SRT, artifacts.VTT})
+        with mock.patch.object(artifacts, 'render', side_effect=AssertionError('rendered on read')):
+            response = self.client.get('/api/transcribe/a1/download/', {'type': 'srt'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'1\n00:00:00,000 --> 00:00:00,600\nhi there\n\n')
+        self.assertEqual(self.client.get('/api/transcribe/a1/download/').content, b'Speaker A: hi there')
+
+    def test_stale_artifact_is_rendered_again(self):
+        save_result(self.job, self.RESULT)
+        Transcription.objects.filter(pk=self.job.pk).update(text='changed', version=F('version') + 1)
+        TranscriptTimeline.objects.filter(transcription=self.job).update(utterances=[])
+        self.job.refresh_from_db()
+        self.assertEqual(artifacts.get_artifact(self.job, artifacts.TEXT), b'changed')
+        self.assertEqual(
+            TranscriptArtifact.objects.get(transcription=self.job, kind=artifacts.TEXT).version, self.job.version
+        )
+
+    def test_subtitles_need_word_timings(self):
+        Transcription.objects.filter(pk=self.job.pk).update(status='completed', text='no timings')
+        self.assertEqual(self.client.get('/api/transcribe/a1/download/', {'type': 'vtt'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/transcribe/a1/download/').content, b'no timings')
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """Answers at once, then sends its body a byte every 0.1s for 5s"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '50')
+        self.end_headers()
+        for _ in range(50):
+            self.wfile.write(b'x')
+            self.wfile.flush()
+            time.sleep(0.1)
+
+    def log_message(self, *args):
+        pass
+
+
+class DeadlineTests(TestCase):
+    """Upstream calls held to the time a request has left"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_connect_and_read_share_what_is_left(self):
+        with budget(4):
+            (connect, read), clipped = call_timeout((5, 30))
+            self.assertTrue(clipped)
+            self.assertLessEqual(connect + read, 4)
+            (connect, read), _ = call_timeout(30)
+            self.assertLessEqual(connect + read, 4)
+        self.assertEqual(call_timeout((5, 30)), ((5, 30), False))
+
+    def test_short_timeouts_are_kept(self):
+        with budget(60):
+            self.assertEqual(call_timeout((5, 20)), ((5, 20), False))
+
+    def test_no_call_without_time_left(self):
+        with budget(0.1):
+            with self.assertRaises(DeadlineExceeded):
+                call_timeout((5, 30))
+
+    @override_settings(ASSEMBLYAI_API_KEY='')
+    def test_trickling_body_is_cut_at_the_deadline(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/"
+
+        started = time.monotonic()
+        with budget(1), self.assertRaises(DeadlineExceeded):
+            assemblyai._send('GET', url, headers={})
+        self.assertLess(time.monotonic() - started, 2)
+        # Our own deadline says nothing about AssemblyAI's health
+        self.assertEqual(assemblyai.breaker.state(), CLOSED)
+
+
+class ProfilingTests(TestCase):
+    """SQL timings collected while a request is profiled"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.request = APIRequestFactory().get('/api/transcribe/')
+
+    def profile(self, get_response):
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=self.dir):
+            profiling.profile_request(self.request, get_response)
+            return profiling.list_profiles()[0]
+
+    def test_queries_are_summarised(self):
+        def get_response(request):
+            list(Transcription.objects.all())
+            return HttpResponse()
+
+        summary = self.profile(get_response)
+        self.assertEqual(summary['trigger'], profiling.SAMPLED)
+        self.assertEqual(summary['queries'], 1)
+        self.assertEqual(summary['slowest_queries'][0]['db'], 'default')
+
+    def test_every_connection_is_watched(self):
+        replica = mock.MagicMock()
+        with mock.patch.object(profiling.connections, 'all', return_value=[profiling.connections['default'], replica]):
+            self.profile(lambda request: HttpResponse())
+        replica.execute_wrapper.assert_called_once()
+
+
+class TracingTests(TestCase):
+    """Trace context parsing, span names and the spans a traced request records"""
+
+    TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+    PARENT_ID = '00f067aa0ba902b7'
+
+    def setUp(self):
+        cache.clear()
+        # Drop spans left queued by other tests
+        tracing.exporter.flush()
+        self.path = os.path.join(tempfile.mkdtemp(), 'spans.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path), ignore_errors=True)
+
+    def test_parse(self):
+        self.assertEqual(
+            tracing.parse(f"00-{self.TRACE_ID}-{self.PARENT_ID}-01"), (self.TRACE_ID, self.PARENT_ID, True)
+        )
+        self.assertEqual(
+            tracing.parse(f" 00-{self.TRACE_ID.upper()}-{self.PARENT_ID}-00 "), (self.TRACE_ID, self.PARENT_ID, False)
+        )
+        for header in (
+            None, '', 'garbage', f"01-{self.TRACE_ID}-{self.PARENT_ID}-01", f"00-{self.TRACE_ID}-{self.PARENT_ID}",
+            f"00-{'0' * 32}-{self.PARENT_ID}-01", f"00-{self.TRACE_ID}-{'0' * 16}-01",
+        ):
+            self.assertIsNone(tracing.parse(header), header)
+
+    def test_route_template(self):
+        self.assertEqual(tracing.route_template('api/transcribe/^(?P<pk>[^/.]+)/$'), '/api/transcribe/{pk}/')
+        self.assertEqual(
+            tracing.route_template('api/transcribe/^(?P<pk>[^/.]+)/download/$'), '/api/transcribe/{pk}/download/'
+        )
+        self.assertEqual(tracing.route_template('api/auth/token/'), '/api/auth/token/')
+
+    def test_upstream_operation(self):
+        self.assertEqual(tracing.upstream_operation('POST', assemblyai.UPLOAD_URL), 'upload')
+        self.assertEqual(tracing.upstream_operation('POST', assemblyai.TRANSCRIPT_URL), 'create')
+        self.assertEqual(tracing.upstream_operation('GET', assemblyai.TRANSCRIPT_URL + '?limit=10'), 'list')
+        self.assertEqual(tracing.upstream_operation('GET', assemblyai.TRANSCRIPT_URL + '/abc'), 'poll')
+        self.assertEqual(tracing.upstream_operation('DELETE', assemblyai.TRANSCRIPT_URL + '/abc'), 'delete')
+
+    def spans(self):
+        tracing.exporter.flush()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_request_continues_the_callers_trace(self):
+        user = User.objects.create_user('tracer', password='x')
+        Transcription.objects.create(
+            transcript_id='tr1', user=user, status='completed', text='done', audio_url='https://example.com/a.mp3'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(TRACE_FILE=self.path):
+            response = client.get(
+                '/api/transcribe/tr1/', {'fields': 'status,text'},
+                HTTP_TRACEPARENT=f"00-{self.TRACE_ID}-{self.PARENT_ID}-01"
+            )
+            spans = self.spans()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response[tracing.TRACE_ID_HEADER], self.TRACE_ID)
+        self.assertEqual({span['trace_id'] for span in spans}, {self.TRACE_ID})
+        root = next(span for span in spans if span['kind'] == tracing.SERVER)
+        self.assertEqual(root['name'], 'GET /api/transcribe/{pk}/')
+        self.assertEqual(root['parent_span_id'], self.PARENT_ID)
+        action = next(span for span in spans if span['name'].endswith('.retrieve'))
+        self.assertEqual(action['parent_span_id'], root['span_id'])
+        self.assertTrue(any(span['name'] == 'db.query' for span in spans))
+
+    def test_unsampled_caller_is_not_recorded(self):
+        with override_settings(TRACE_FILE=self.path):
+            response = self.client.get('/not-found/', HTTP_TRACEPARENT=f"00-{self.TRACE_ID}-{self.PARENT_ID}-00")
+            tracing.exporter.flush()
+        self.assertNotIn(tracing.TRACE_ID_HEADER, response)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_job_span_resumes_the_stored_context(self):
+        job = Transcription(transcript_id='tr2', trace_parent=f"00-{self.TRACE_ID}-{self.PARENT_ID}-01")
+        with override_settings(TRACE_FILE=self.path):
+            with tracing.job_span(job, 'job.poll') as span:
+                self.assertEqual(tracing.current_traceparent(), span.traceparent())
+            self.assertIsNone(tracing.current_traceparent())
+            spans = self.spans()
+        self.assertEqual(
+            [(s['name'], s['trace_id'], s['parent_span_id'], s['attributes']['transcript_id']) for s in spans],
+            [('job.poll', self.TRACE_ID, self.PARENT_ID, 'tr2')]
+        )
+
+
+class UsageRollupTests(TestCase):
+    """Jobs moved between usage rollup rows as they are saved and deleted"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('usage', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job = Transcription.objects.create(
+                transcript_id='u1', user=self.user, status='queued', audio_url='https://example.com/a.mp3'
+            )
+
+    def rollups(self):
+        return {
+            (row.language, row.status): (row.jobs, row.audio_seconds)
+            for row in UsageRollup.objects.filter(jobs__gt=0)
+        }
+
+    def test_new_job_is_counted(self):
+        self.assertEqual(self.rollups(), {('auto', 'queued'): (1, 0)})
+
+    def test_status_change_moves_the_job(self):
+        job = Transcription.objects.get(pk=self.job.pk)
+        job.status = 'completed'
+        job.audio_duration = 30
+        with self.captureOnCommitCallbacks(execute=True):
+            job.save()
+        self.assertEqual(self.rollups(), {('auto', 'completed'): (1, 30)})
+
+    def test_duration_change_stays_on_its_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.audio_duration = 12
+            self.job.save(update_fields=['audio_duration'])
+            self.job.language_code = 'en'
+            self.job.save()
+        self.assertEqual(self.rollups(), {('en', 'queued'): (1, 12)})
+
+    def test_unchanged_usage_fields_skip_the_rollups(self):
+        job = Transcription.objects.get(pk=self.job.pk)
+        job.attempts += 1
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(1):
+            job.save()
+        self.assertEqual(callbacks, [])
+
+    def test_rolled_back_save_is_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.job.status = 'error'
+                self.job.save()
+                raise RuntimeError()
+        self.assertEqual(self.rollups(), {('auto', 'queued'): (1, 0)})
+
+    def test_refresh_from_db_takes_the_stored_values(self):
+        stale = Transcription.objects.get(pk=self.job.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.status = 'processing'
+            self.job.save()
+        stale.refresh_from_db()
+        stale.status = 'queued'
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.save()
+        self.assertEqual(self.rollups(), {('auto', 'queued'): (1, 0)})
+
+    def test_delete_takes_the_job_off_its_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.delete()
+        self.assertEqual(self.rollups(), {})
+
+    def test_rebuild_matches_the_kept_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Transcription.objects.create(
+                transcript_id='u2', user=self.user, status='completed', audio_duration=5, language_code='de',
+                audio_url='https://example.com/b.mp3'
+            )
+        kept = self.rollups()
+        self.assertEqual(usage.rebuild(), 2)
+        self.assertEqual(self.rollups(), kept)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(TestCase):
+    """Which database the reads of a request are routed to"""
+
+    def setUp(self):
+        cache.clear()
+        self.router = replicas.ReplicaRouter()
+        # Tests run inside a transaction, which would keep every read on the primary
+        patcher = mock.patch.object(replicas.connections['default'], 'in_atomic_block', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def routed(self, model=Transcription, allowed=True, sticky=False, wrote=False):
+        state = replicas.RoutingState(sticky)
+        state.allowed, state.wrote = allowed, wrote
+        token = replicas._state.set(state)
+        try:
+            return self.router.db_for_read(model)
+        finally:
+            replicas._state.reset(token)
+
+    def test_reads_go_to_the_replica_only_when_safe(self):
+        self.assertEqual(self.router.db_for_read(Transcription), 'default')
+        self.assertEqual(self.routed(), 'replica1')
+        self.assertEqual(self.routed(allowed=False), 'default')
+        self.assertEqual(self.routed(sticky=True), 'default')
+        self.assertEqual(self.routed(wrote=True), 'default')
+        self.assertEqual(self.router.db_for_write(Transcription), 'default')
+
+    def test_primary_block_pins_reads(self):
+        state = replicas.RoutingState(sticky=False)
+        state.allowed = True
+        token = replicas._state.set(state)
+        try:
+            with replicas.primary():
+                self.assertEqual(self.router.db_for_read(Transcription), 'default')
+            self.assertEqual(self.router.db_for_read(Transcription), 'replica1')
+        finally:
+            replicas._state.reset(token)
+
+    def test_tokens_are_read_from_the_primary(self):
+        self.assertEqual(self.routed(Token), 'default')
+
+    def test_writing_client_stays_on_the_primary(self):
+        request = APIRequestFactory().post('/api/transcribe/', HTTP_AUTHORIZATION='Token abc')
+
+        def write(request):
+            User.objects.create_user('writer', password='x')
+            return HttpResponse()
+
+        replicas.route_request(request, write)
+        seen = []
+        replicas.route_request(request, lambda request: seen.append(replicas._state.get().sticky) or HttpResponse())
+        other = APIRequestFactory().get('/api/transcribe/', HTTP_AUTHORIZATION='Token other')
+        replicas.route_request(other, lambda request: seen.append(replicas._state.get().sticky) or HttpResponse())
+        self.assertEqual(seen, [True, False])
+
+    def test_new_token_is_authenticated_on_the_primary(self):
+        user = User.objects.create_user('fresh', password='x')
+        token = Token.objects.create(user=user)
+        databases = []
+        authenticate = BearerTokenAuthentication.authenticate_credentials
+
+        def record(auth, key):
+            databases.append(replicas._state.get().read_alias())
+            return authenticate(auth, key)
+
+        with mock.patch.object(BearerTokenAuthentication, 'authenticate_credentials', record), \
+                mock.patch.object(replicas.ReplicaRouter, 'db_for_read', return_value='default'):
+            response = APIClient().get('/api/transcribe/usage/', HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(databases, ['default'])
 
-# Create your tests here.
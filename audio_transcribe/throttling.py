@@ -0,0 +1,244 @@
+import time
+import math
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle, UserRateThrottle, AnonRateThrottle
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowCounter:
+    """
+    Sliding-window counter kept in the shared cache, so every worker and
+    dyno counts against the same limit. Each key holds one integer per
+    window; the usage over the last window is estimated from the current
+    count plus the previous window's count weighted by how much of it still
+    overlaps. Increments are atomic, and a hit that would cross the limit
+    is taken back, so concurrent requests cannot overshoot it.
+    """
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _key(self, ident, bucket):
+        return f"ratelimit:{self.name}:{ident}:{bucket}"
+
+    def _position(self):
+        now = time.time()
+        return int(now // self.window), (now % self.window) / self.window
+
+    def hit(self, ident, cost=1):
+        """
+        Count cost against ident, returning (allowed, seconds until it would
+        be allowed, the window it was counted in for refunds)
+        """
+        bucket, elapsed = self._position()
+        key = self._key(ident, bucket)
+        try:
+            # The count is read as the previous window during the next one
+            cache.add(key, 0, timeout=self.window * 2)
+            current = cache.incr(key, cost)
+            previous = cache.get(self._key(ident, bucket - 1), 0)
+        except Exception as e:
+            # Without the shared store limits cannot be enforced consistently, so let requests through
+            logger.warning(f"Rate limiter {self.name} unavailable: {str(e)}")
+            return True, 0, None
+
+        if previous * (1 - elapsed) + current <= self.limit:
+            return True, 0, bucket
+        try:
+            cache.decr(key, cost)
+        except Exception as e:
+            logger.warning(f"Rate limiter {self.name} could not release {key}: {str(e)}")
+        return False, self._retry_after(previous, current - cost, elapsed, cost), None
+
+    def refund(self, ident, cost, bucket):
+        """Give back cost counted in bucket for work that did not happen"""
+        if bucket is None:
+            return
+        # The hit is taken back from the window it was counted in, which is
+        # the previous one by now if a window boundary passed in between
+        try:
+            cache.decr(self._key(ident, bucket), cost)
+        except Exception as e:
+            # The key expired, nothing left to give back
+            logger.info(f"Rate limiter {self.name} could not refund {ident}: {str(e)}")
+
+    def add(self, ident, cost):
+        """Count cost against ident whatever the limit, for use that is only found out after the fact"""
+        bucket, _ = self._position()
+        key = self._key(ident, bucket)
+        try:
+            cache.add(key, 0, timeout=self.window * 2)
+            cache.incr(key, cost)
+        except Exception as e:
+            logger.warning(f"Rate limiter {self.name} could not count {cost} for {ident}: {str(e)}")
+
+    def usage(self, ident):
+        """Estimated amount counted against ident over the last window"""
+        bucket, elapsed = self._position()
+        values = cache.get_many([self._key(ident, bucket), self._key(ident, bucket - 1)])
+        return values.get(self._key(ident, bucket - 1), 0) * (1 - elapsed) + values.get(self._key(ident, bucket), 0)
+
+    def _retry_after(self, previous, current, elapsed, cost):
+        if cost > self.limit:
+            return None
+        room = self.limit - cost
+        # Still within this window, as the previous window's weight fades
+        if current <= room and previous:
+            fraction = 1 - (room - current) / previous
+            return max(1, math.ceil((fraction - elapsed) * self.window))
+        # Only once this window has become the previous one
+        fraction = 1 - room / current if current else 0
+        return max(1, math.ceil((1 - elapsed + fraction) * self.window))
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """
+    DRF throttle with the same rates and scopes as SimpleRateThrottle, but
+    counting with a SlidingWindowCounter instead of keeping a list of
+    request timestamps per client
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.retry_after = None
+        if self.rate is not None:
+            self.counter = SlidingWindowCounter('throttle', self.num_requests, self.duration)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.retry_after, _ = self.counter.hit(self.key)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class UserSlidingWindowThrottle(SlidingWindowRateThrottle, UserRateThrottle):
+    """Limits authenticated users by id and anonymous clients by IP address"""
+
+
+class AnonSlidingWindowThrottle(SlidingWindowRateThrottle, AnonRateThrottle):
+    """Limits anonymous clients by IP address"""
+
+
+# Audio quotas count seconds of audio per client over the last day
+AUDIO_COUNTER = 'audio_seconds'
+AUDIO_QUOTA_WINDOW = 24 * 60 * 60
+
+
+def client_ident(request):
+    """Who a request is counted against: the user, or the client address for anonymous requests"""
+    if request.user.is_authenticated:
+        return f"user_{request.user.pk}"
+    # Anonymous uploads share one user, so they are told apart by client address
+    return f"anon_{BaseThrottle().get_ident(request)}"
+
+
+def audio_quota(request):
+    """The counter an upload's audio is charged to, and who it is charged for"""
+    if request.user.is_authenticated:
+        limit = settings.AUDIO_MINUTES_PER_DAY * 60
+    else:
+        limit = settings.AUDIO_MINUTES_PER_DAY_ANONYMOUS * 60
+    return SlidingWindowCounter(AUDIO_COUNTER, limit, AUDIO_QUOTA_WINDOW), client_ident(request)
+
+
+def audio_cost(seconds):
+    return max(1, math.ceil(seconds))
+
+
+def charge_audio(request, seconds):
+    """
+    Count seconds of audio against the client's daily quota, returning
+    (allowed, retry after, charge), charge being what refund_audio gives back
+    """
+    counter, ident = audio_quota(request)
+    if not counter.limit:
+        return True, 0, None
+    allowed, retry_after, bucket = counter.hit(ident, audio_cost(seconds))
+    return allowed, retry_after, (ident, bucket, audio_cost(seconds)) if allowed else None
+
+
+def refund_audio(charge, seconds=None):
+    """Give back a charge, or seconds of it, for audio that will not be transcribed"""
+    if charge is None:
+        return
+    ident, bucket, cost = charge
+    if seconds is not None:
+        cost = min(cost, audio_cost(seconds))
+    SlidingWindowCounter(AUDIO_COUNTER, None, AUDIO_QUOTA_WINDOW).refund(ident, cost, bucket)
+
+
+# A job accepted before it reached AssemblyAI keeps its charge here, so it can
+# be refunded should the submission fail in the background later on
+def _held_charge_key(job):
+    return f"audio_charge:{job.pk}"
+
+
+def hold_audio_charge(job, charge, seconds=None):
+    """Keep the charge for a job that has not been submitted yet, or seconds of it"""
+    if charge is None:
+        return
+    if seconds is not None:
+        ident, bucket, cost = charge
+        charge = (ident, bucket, min(cost, audio_cost(seconds)))
+    cache.set(_held_charge_key(job), charge, timeout=AUDIO_QUOTA_WINDOW * 2)
+
+
+def settle_audio_charge(job):
+    """The job went ahead, so its charge stands"""
+    cache.delete(_held_charge_key(job))
+
+
+def refund_job_audio(job):
+    """Give back the charge held for a job whose submission failed"""
+    cache.delete(_estimate_key(job))
+    key = _held_charge_key(job)
+    charge = cache.get(key)
+    # Only whoever removes the charge refunds it
+    if charge is not None and cache.delete(key):
+        refund_audio(charge)
+
+
+# Audio whose length is not known when it is accepted, such as remote URLs, is
+# charged an estimate, corrected once AssemblyAI reports the real length
+def _estimate_key(job):
+    return f"audio_estimate:{job.pk}"
+
+
+def estimate_audio_charge(job, charge, seconds):
+    """Note that seconds of charge were only an estimate of job's audio, see correct_audio_charge"""
+    if charge is None:
+        return
+    ident, bucket, _ = charge
+    cache.set(_estimate_key(job), (ident, bucket, audio_cost(seconds)), timeout=AUDIO_QUOTA_WINDOW * 2)
+
+
+def correct_audio_charge(job):
+    """Charge the difference between a completed job's estimated and actual audio length"""
+    if not job.audio_duration:
+        return
+    key = _estimate_key(job)
+    estimate = cache.get(key)
+    # Only whoever removes the estimate corrects it
+    if estimate is None or not cache.delete(key):
+        return
+    ident, bucket, estimated = estimate
+    counter = SlidingWindowCounter(AUDIO_COUNTER, None, AUDIO_QUOTA_WINDOW)
+    difference = audio_cost(job.audio_duration) - estimated
+    if difference > 0:
+        # Already transcribed, so counted even past the limit, holding back the client's next uploads
+        counter.add(ident, difference)
+    elif difference < 0:
+        counter.refund(ident, -difference, bucket)
+    logger.info(f"Corrected audio charge of {job.transcript_id} for {ident} by {difference}s")
@@ -0,0 +1,137 @@
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import TranscriptTimeline, TERMINAL_STATUSES, transcript_progress
+from .probe import suggested_poll_interval
+from .admission import discard_spool
+from .artifacts import store_artifacts
+from .packing import pack_words
+from .throttling import correct_audio_charge
+from .streaming import LazyArray, STREAM_CHUNK_ITEMS
+
+logger = logging.getLogger(__name__)
+
+# Parts of a completed result kept outside TranscriptTimeline.result
+STORED_SEPARATELY = ('text', 'words', 'utterances')
+
+# Key order of a completed status response
+RESULT_ORDER = (
+    'status', 'progress', 'text', 'error', 'language_code', 'audio_duration', 'punctuate', 'format_text',
+    'confidence', 'words', 'utterances', 'chapters', 'highlights', 'message',
+)
+
+
+def build_index(items):
+    """Sort timed items by start and precompute their starts and running maximum ends"""
+    items = sorted((item for item in items or [] if item.get('start') is not None), key=lambda item: item['start'])
+    starts = []
+    max_ends = []
+    running_end = 0
+    for item in items:
+        running_end = max(running_end, item.get('end') or item['start'])
+        starts.append(item['start'])
+        max_ends.append(running_end)
+    return items, starts, max_ends
+
+
+def overlapping(items, starts, max_ends, start, end):
+    """Items overlapping the window [start, end) in milliseconds"""
+    # Nothing before lo can reach start, since max_ends never decreases,
+    # and nothing from hi on begins before end
+    lo = bisect_right(max_ends, start)
+    hi = bisect_left(starts, end)
+    return [item for item in items[lo:hi] if (item.get('end') or item['start']) > start]
+
+
+def store_timeline(transcription, result):
+    """Keep the word and utterance timings of a completed AssemblyAI result"""
+    packed_words = pack_words(result.get('words'))
+    # Utterances repeat their words, which are already stored above
+    utterances, utterance_starts, utterance_max_ends = build_index([
+        {k: v for k, v in utterance.items() if k != 'words'}
+        for utterance in result.get('utterances') or []
+    ])
+
+    timeline, _ = TranscriptTimeline.objects.update_or_create(
+        transcription=transcription,
+        defaults={
+            'packed_words': packed_words,
+            'utterances': utterances,
+            'utterance_starts': utterance_starts,
+            'utterance_max_ends': utterance_max_ends,
+            'result': {k: v for k, v in result.items() if k not in STORED_SEPARATELY},
+        }
+    )
+    logger.info(f"Stored timeline for {transcription.transcript_id}: {len(packed_words)} bytes of words, {len(utterances)} utterances")
+    return timeline
+
+
+def save_result(transcription, result):
+    """Apply an AssemblyAI result to a transcription, keeping its timings once it completes"""
+    was_completed = transcription.status == 'completed'
+    transcription.update_from_result(result)
+    # Job workers poll a running transcript again when a client would be told to (see jobs.py)
+    spool_name = None
+    if transcription.status in TERMINAL_STATUSES:
+        transcription.next_poll_at = None
+        # Audio AssemblyAI fetched from storage is kept until it is done with it
+        spool_name, transcription.spool_file = transcription.spool_file, None
+    else:
+        transcription.next_poll_at = timezone.now() + timedelta(
+            seconds=suggested_poll_interval(transcription.audio_duration)
+        )
+    transcription.save()
+    if spool_name:
+        discard_spool(spool_name)
+    if transcription.status == 'completed' and not was_completed:
+        on_completed(transcription, result)
+
+
+def on_completed(transcription, result):
+    """Keep what a transcript that has just completed is read back from: its timings and rendered artifacts"""
+    correct_audio_charge(transcription)
+    timeline = None
+    if result.get('words') is not None:
+        timeline = store_timeline(transcription, result)
+    # Reads render artifacts that are missing, so failing here only costs speed
+    try:
+        store_artifacts(transcription, timeline)
+    except Exception as e:
+        logger.error(f"Failed to render artifacts of {transcription.transcript_id}: {str(e)}")
+
+
+def slice_timeline(timeline, start, end):
+    """Words and utterances of a stored timeline overlapping [start, end)"""
+    return {
+        'words': timeline.words.overlapping(start, end),
+        'utterances': overlapping(
+            timeline.utterances, timeline.utterance_starts, timeline.utterance_max_ends, start, end
+        ),
+    }
+
+
+def stored_response(transcription, timeline):
+    """Completed status response rebuilt from storage, with words and utterances streamed in chunks"""
+    words = timeline.words
+    parts = dict(timeline.result)
+    parts['progress'] = transcript_progress(transcription.status)
+    if transcription.text is not None:
+        parts['text'] = transcription.text
+    if len(words):
+        parts['words'] = LazyArray(lambda: words.chunks(STREAM_CHUNK_ITEMS))
+    if timeline.utterances:
+        parts['utterances'] = LazyArray(lambda: _utterance_chunks(timeline.utterances, words))
+    return {key: parts[key] for key in RESULT_ORDER if key in parts}
+
+
+def _utterance_chunks(utterances, words):
+    # Utterances were stored without their words, which are the words spoken within them
+    size = max(1, STREAM_CHUNK_ITEMS // 100)
+    for lo in range(0, len(utterances), size):
+        yield [
+            {**utterance, 'words': words.words(*words.between(utterance['start'], utterance.get('end') or 0))}
+            for utterance in utterances[lo:lo + size]
+        ]
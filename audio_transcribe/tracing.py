@@ -0,0 +1,304 @@
+"""
+Traces of requests and of the jobs they start.
+
+A trace is a tree of timed spans: one for each request, one for the DRF
+action under it, one for each call to AssemblyAI (upload, create, poll,
+list, delete) and one for each SQL query. Trace context follows the W3C
+traceparent format, so a request that sends a traceparent header is
+recorded as part of its caller's trace, and every traced response names
+its trace in X-Trace-Id.
+
+A job keeps the trace context of the request that created it, and the
+background submission thread, the job workers and the local engine's
+result thread record their spans under it, so one trace follows a job
+from upload to result even when a different process finishes it.
+
+Tracing is off unless TRACE_FILE or TRACE_COLLECTOR_URL is set.
+TRACE_SAMPLE_RATE is the share of new traces recorded; the choice is made
+once when a trace starts and then carried along with it. Finished spans
+are queued and a background thread exports them every
+TRACE_FLUSH_SECONDS, as JSON lines appended to TRACE_FILE and as a JSON
+array POSTed to TRACE_COLLECTOR_URL, so no request waits on the exporter.
+Spans are dropped rather than queued once TRACE_QUEUE_SIZE are waiting.
+Streamed response bodies are sent after the request's span has ended.
+"""
+import os
+import re
+import time
+import atexit
+import random
+import logging
+import threading
+from contextlib import ExitStack, nullcontext
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.db import connections
+
+from .streaming import dumps
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+
+SERVER = 'server'
+CLIENT = 'client'
+INTERNAL = 'internal'
+
+# Longest SQL statement kept on a query span
+MAX_STATEMENT = 1000
+
+NAMED_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# Only spans of sampled traces are ever current, so None means nothing is recorded
+_current = ContextVar('trace_span', default=None)
+
+
+def enabled():
+    return bool(settings.TRACE_FILE or settings.TRACE_COLLECTOR_URL)
+
+
+class Span:
+    """One timed operation in a trace, recorded while it is used as a context manager"""
+
+    __slots__ = (
+        'name', 'kind', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error', '_token', '_wrappers'
+    )
+
+    def __init__(self, name, kind, trace_id, parent_id, attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+        self._token = None
+        self._wrappers = None
+
+    def __enter__(self):
+        if _current.get() is None:
+            # The span starts tracing in this thread, so its queries need recording from here on
+            self._wrappers = ExitStack()
+            for connection in connections.all(initialized_only=False):
+                self._wrappers.enter_context(connection.execute_wrapper(query_span))
+        self._token = _current.set(self)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time_ns()
+        if exc is not None:
+            self.fail(exc)
+        _current.reset(self._token)
+        if self._wrappers is not None:
+            self._wrappers.close()
+        exporter.add(self)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def fail(self, error):
+        self.error = str(error)[:500] or type(error).__name__
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def as_dict(self, service, pid):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time_unix_nano': self.start,
+            'end_time_unix_nano': self.end,
+            'duration_ms': round((self.end - self.start) / 1e6, 3),
+            'status': 'error' if self.error else 'ok',
+            'error': self.error,
+            'attributes': self.attributes,
+            'service': service,
+            'pid': pid,
+        }
+
+
+class Exporter:
+    """Queue of finished spans, written out by a background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spans = []
+        self._thread = None
+        self.dropped = 0
+
+    def add(self, span):
+        with self._lock:
+            if len(self._spans) >= settings.TRACE_QUEUE_SIZE:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+            if self._thread is None:
+                # Started on first use, so preloading gunicorn doesn't fork a running thread
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.TRACE_FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self):
+        """Export every queued span"""
+        with self._flush_lock:
+            with self._lock:
+                spans, self._spans = self._spans, []
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                logger.warning(f"Dropped {dropped} trace spans, the export queue was full")
+            if not spans:
+                return
+            service, pid = settings.TRACE_SERVICE_NAME, os.getpid()
+            records = [span.as_dict(service, pid) for span in spans]
+            if settings.TRACE_FILE:
+                try:
+                    lines = b''.join(dumps(record) + b'\n' for record in records)
+                    # A single append, so lines from several processes don't interleave
+                    with open(settings.TRACE_FILE, 'ab') as f:
+                        f.write(lines)
+                except OSError as e:
+                    logger.warning(f"Could not write {len(records)} trace spans: {str(e)}")
+            if settings.TRACE_COLLECTOR_URL:
+                try:
+                    response = requests.post(
+                        settings.TRACE_COLLECTOR_URL, data=dumps(records),
+                        headers={'Content-Type': 'application/json'}, timeout=5
+                    )
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Could not send {len(records)} trace spans to the collector: {str(e)}")
+
+
+exporter = Exporter()
+
+
+def span(name, kind=INTERNAL, **attributes):
+    """Context manager recording the block as a child of the current span, if there is one"""
+    parent = _current.get()
+    if parent is None:
+        return nullcontext()
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes)
+
+
+def parse(traceparent):
+    """(trace id, parent span id, sampled) of a traceparent header, or None if it is not one"""
+    match = TRACEPARENT.match((traceparent or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def resume(traceparent, name, kind=INTERNAL, **attributes):
+    """Context manager recording the block under a stored trace context, such as a job's, if it is sampled"""
+    context = parse(traceparent) if enabled() else None
+    if context is None or not context[2]:
+        return nullcontext()
+    return Span(name, kind, context[0], context[1], attributes)
+
+
+def current_traceparent():
+    """Trace context to store with work that outlives the current request, or None when not tracing"""
+    current = _current.get()
+    return current.traceparent() if current is not None else None
+
+
+def job_span(job, name, **attributes):
+    """Context manager recording the block in the trace of the request that created job"""
+    return resume(job.trace_parent, name, transcript_id=job.transcript_id, **attributes)
+
+
+def trace_request(request, get_response):
+    """get_response(request), recorded as the root of a trace or as part of the caller's"""
+    if not enabled():
+        return get_response(request)
+    context = parse(request.headers.get(HEADER))
+    if context is not None:
+        trace_id, parent_id, sampled = context
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+        sampled = random.random() < settings.TRACE_SAMPLE_RATE
+    if not sampled:
+        return get_response(request)
+
+    root = Span(request.method, SERVER, trace_id, parent_id, {
+        'http.method': request.method,
+        'http.target': request.path,
+    })
+    with root:
+        response = get_response(request)
+        # Named after the URL pattern, not the path, so requests for different transcripts group together
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.route:
+            route = route_template(match.route)
+            root.name = f"{request.method} {route}"
+            root.set('http.route', route)
+        root.set('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            root.fail(f"HTTP {response.status_code}")
+        response[TRACE_ID_HEADER] = trace_id
+    return response
+
+
+def route_template(route):
+    """/api/transcribe/{pk}/ for the regex routes DRF's router adds, such as api/transcribe/^(?P<pk>[^/.]+)/$"""
+    route = NAMED_GROUP.sub(r'{\1}', route).replace('^', '').replace('$', '')
+    return '/' + route
+
+
+class TracedViewMixin:
+    """Records each DRF action as a span named after the view and action"""
+
+    def dispatch(self, request, *args, **kwargs):
+        with span('drf.action') as action_span:
+            response = super().dispatch(request, *args, **kwargs)
+            if action_span is not None:
+                # The action is only known once DRF has looked at the request
+                action = getattr(self, 'action', None) or request.method.lower()
+                action_span.name = f"{type(self).__name__}.{action}"
+                action_span.set('http.status_code', response.status_code)
+            return response
+
+
+def upstream_operation(method, url):
+    """Which AssemblyAI operation a call is: upload, create, poll, list or delete"""
+    path = urlsplit(url).path.rstrip('/')
+    if path.endswith('/upload'):
+        return 'upload'
+    if method == 'DELETE':
+        return 'delete'
+    if path.endswith('/transcript'):
+        return 'create' if method == 'POST' else 'list'
+    return 'poll'
+
+
+def query_span(execute, sql, params, many, context):
+    """Connection execute wrapper recording each query as a span of the current trace"""
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    with span('db.query', CLIENT, **{
+        'db.system': context['connection'].vendor,
+        'db.name': context['connection'].alias,
+        'db.statement': sql[:MAX_STATEMENT],
+        'db.many': many,
+    }):
+        return execute(sql, params, many, context)
+
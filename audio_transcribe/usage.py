@@ -0,0 +1,198 @@
+"""
+Usage rollups: jobs and audio seconds per user, day, language and status.
+
+Answering "how many audio minutes did each user send per day" or "which
+languages fail most" from the transcription table means scanning every
+transcript. UsageRollup keeps one row per user, day (of creation, UTC),
+requested language ('auto' for detected ones) and status instead, and
+every change to one of those, or to the audio duration, moves the job
+from its old row to its new one (see Transcription.save). Deleted jobs
+are taken off their row. Usage queries then read one row per combination
+and day, however many jobs there were.
+
+A save that leaves those fields as they were loaded doesn't touch the
+rollups at all. One that changes them reads the stored values under a row
+lock to find the job's old row, and the rows themselves are only updated
+once the save's transaction commits, so busy rows aren't held locked for
+the rest of it, and a rolled back save never counts.
+
+Rows are only kept in step through model saves and deletes; a queryset
+update() of status, language or duration bypasses them, as does a process
+dying between a commit and its rollup update. rebuild() (the rebuild_usage
+command) recomputes every row from the transcriptions.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import USAGE_COLUMNS, Transcription, UsageRollup
+
+logger = logging.getLogger(__name__)
+
+# Transcription fields a rollup row depends on
+FIELDS = USAGE_COLUMNS
+
+# What a usage query can be broken down by, and the rollup column each reads
+DIMENSIONS = {
+    'day': 'day',
+    'language': 'language',
+    'status': 'status',
+    'user': 'user__username',
+}
+
+DEFAULT_DAYS = 30
+
+
+def _language(language_code):
+    return (language_code or 'auto')[:10]
+
+
+def _key(user_id, created_at, language_code, status):
+    return {
+        'user_id': user_id,
+        'day': timezone.localdate(created_at),
+        'language': _language(language_code),
+        'status': status,
+    }
+
+
+def _bucket(values):
+    """(rollup key, audio seconds) a transcription with these field values is counted under"""
+    key = _key(values['user_id'], values['created_at'], values['language_code'], values['status'])
+    return key, values['audio_duration'] or 0
+
+
+def _add(key, jobs, seconds):
+    """Add jobs and seconds to the rollup row for key, creating it when jobs are added"""
+    updated = UsageRollup.objects.filter(**key).update(
+        jobs=F('jobs') + jobs, audio_seconds=F('audio_seconds') + seconds
+    )
+    if updated or jobs <= 0:
+        return
+    try:
+        with transaction.atomic():
+            UsageRollup.objects.create(**key, jobs=jobs, audio_seconds=seconds)
+    except IntegrityError:
+        # Created by a concurrent change in the meantime
+        UsageRollup.objects.filter(**key).update(
+            jobs=F('jobs') + jobs, audio_seconds=F('audio_seconds') + seconds
+        )
+
+
+def stored_values(transcription):
+    """The rollup fields of a transcription as they are in the database, or None for a new one"""
+    if transcription.pk is None or transcription._state.adding:
+        return None
+    return Transcription.objects.select_for_update().filter(pk=transcription.pk).values(*FIELDS).first()
+
+
+def _apply(moves):
+    for key, jobs, seconds in moves:
+        _add(key, jobs, seconds)
+
+
+def _after_commit(moves):
+    """Apply (rollup key, jobs, seconds) moves once the current transaction commits"""
+    if moves:
+        transaction.on_commit(lambda: _apply(moves), robust=True)
+
+
+def record_change(before, transcription):
+    """Move a saved transcription from the row it was counted under (before, None if new) to its current one"""
+    new_key, new_seconds = _bucket({field: getattr(transcription, field) for field in FIELDS})
+    if before is None:
+        _after_commit([(new_key, 1, new_seconds)])
+        return
+    old_key, old_seconds = _bucket(before)
+    if old_key == new_key:
+        if old_seconds != new_seconds:
+            _after_commit([(new_key, 0, new_seconds - old_seconds)])
+        return
+    _after_commit([(old_key, -1, -old_seconds), (new_key, 1, new_seconds)])
+
+
+def record_delete(sender, instance, **kwargs):
+    """post_delete receiver taking a deleted transcription off its row"""
+    key, seconds = _bucket({field: getattr(instance, field) for field in FIELDS})
+    _after_commit([(key, -1, -seconds)])
+
+
+def rebuild():
+    """Recompute every rollup row from the transcriptions, returning how many rows there are"""
+    rows = (
+        Transcription.objects.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('user_id', 'day', 'language_code', 'status')
+        .annotate(jobs=Count('id'), audio_seconds=Sum('audio_duration'))
+    )
+    rollups = {}
+    for row in rows.iterator():
+        key = (row['user_id'], row['day'], _language(row['language_code']), row['status'])
+        jobs, seconds = rollups.get(key, (0, 0))
+        rollups[key] = (jobs + row['jobs'], seconds + (row['audio_seconds'] or 0))
+
+    with transaction.atomic():
+        UsageRollup.objects.all().delete()
+        UsageRollup.objects.bulk_create([
+            UsageRollup(user_id=user_id, day=day, language=language, status=status, jobs=jobs, audio_seconds=seconds)
+            for (user_id, day, language, status), (jobs, seconds) in rollups.items()
+        ], batch_size=1000)
+    logger.info(f"Rebuilt {len(rollups)} usage rollup rows")
+    return len(rollups)
+
+
+def date_range(since=None, until=None):
+    """Days covered by a usage query, the last DEFAULT_DAYS up to today by default"""
+    until = until or timezone.localdate()
+    since = since or until - timedelta(days=DEFAULT_DAYS - 1)
+    if since > until:
+        raise ValueError('since must not be after until')
+    return since, until
+
+
+# Sums read from the rollups for each row of a usage query
+SUMS = {
+    'total_jobs': Sum('jobs'),
+    'total_audio_seconds': Sum('audio_seconds'),
+    'completed_jobs': Sum('jobs', filter=Q(status='completed')),
+    'failed_jobs': Sum('jobs', filter=Q(status='error')),
+}
+
+
+def _summary(row):
+    jobs, completed, failed = (row[name] or 0 for name in ('total_jobs', 'completed_jobs', 'failed_jobs'))
+    finished = completed + failed
+    return {
+        'jobs': jobs,
+        'completed': completed,
+        'failed': failed,
+        'in_progress': jobs - finished,
+        'audio_minutes': round((row['total_audio_seconds'] or 0) / 60, 2),
+        'failure_rate': round(failed / finished, 4) if finished else None,
+    }
+
+
+def usage(since, until, by=('day',), user=None):
+    """Totals, and rows broken down by the dimensions in by, for one user or (user=None) everyone"""
+    rollups = UsageRollup.objects.filter(day__gte=since, day__lte=until, jobs__gt=0)
+    if user is not None:
+        rollups = rollups.filter(user=user)
+    columns = [DIMENSIONS[dimension] for dimension in by]
+    rows = []
+    for row in rollups.order_by(*columns).values(*columns).annotate(**SUMS):
+        entry = {dimension: row[DIMENSIONS[dimension]] for dimension in by}
+        if 'day' in entry:
+            entry['day'] = entry['day'].isoformat()
+        rows.append({**entry, **_summary(row)})
+
+    return {
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'by': list(by),
+        'totals': _summary(rollups.aggregate(**SUMS)),
+        'rows': rows,
+    }
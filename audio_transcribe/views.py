@@ -1,47 +1,55 @@
-from django.shortcuts import render
 from rest_framework import status
-from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
-from rest_framework import generics
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
 from api_auth.authentication import BearerTokenAuthentication
-from .models import Transcription
-import requests
+from .models import Transcription, TranscriptTimeline, TERMINAL_STATUSES
+from . import assemblyai, admission, artifacts, backends, direct_upload, jobs, replicas, usage
+from .probe import probe_duration, suggested_poll_interval
+from .circuit_breaker import CircuitOpenError
+from .deadline import DeadlineExceeded, budget
+from .single_flight import SingleFlight
+from .search import search_transcriptions
+from .timeline import save_result, store_timeline, on_completed, slice_timeline, stored_response
+from .streaming import StreamingJSONResponse, RawJSON
+from .throttling import (
+    UserSlidingWindowThrottle, AnonSlidingWindowThrottle, charge_audio, refund_audio, hold_audio_charge,
+    estimate_audio_charge, client_ident
+)
+from .export import EXPORT_FORMATS, export_stream
+from . import profiling
+from .tracing import TracedViewMixin
+from .replicas import ReplicaReadsMixin
+from .idempotency import idempotent
+from .conditional import if_none_match, with_etag, not_modified, list_etag
+from .fieldsets import (
+    RETRIEVE_FIELDS, STORED_RESULT_FIELDS, LIST_FIELDS, requested_fields, project, fieldset_key,
+    list_model_fields, list_entry
+)
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.validators import URLValidator
+from django.db.models import Case, F, When
+from django.http import HttpResponse, StreamingHttpResponse
+import io
 import os
-import time
-import mimetypes
-import hashlib
 import logging
-from dotenv import load_dotenv
-from datetime import datetime
-import pytz
+import requests
+import datetime
+import ipaddress
+from urllib.parse import urlsplit
 from tempfile import NamedTemporaryFile
 from django.contrib.auth.models import User
 from django.db.utils import IntegrityError
 
-load_dotenv()
-
 logger = logging.getLogger(__name__)
 
-ASSEMBLYAI_API_KEY = os.getenv('ASSEMBLYAI_API_KEY')
-if not ASSEMBLYAI_API_KEY:
-    raise ValueError("ASSEMBLYAI_API_KEY environment variable is not set")
-
-logger.info(f"Using AssemblyAI API Key: {ASSEMBLYAI_API_KEY}")
-
-headers = {
-    "authorization": ASSEMBLYAI_API_KEY,
-    "content-type": "application/json"
-}
-
-UPLOAD_URL = "https://api.assemblyai.com/v2/upload"
-TRANSCRIPT_URL = "https://api.assemblyai.com/v2/transcript"
-
 # Supported audio formats
 SUPPORTED_FORMATS = {
     # Audio formats
@@ -63,6 +71,13 @@ SUPPORTED_FORMATS = {
 # Maximum file size (5MB)
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB in bytes
 
+# Listing waits at most this long on AssemblyAI before serving what is stored
+SYNC_DEADLINE_SECONDS = 10
+
+# Remote audio submitted by URL
+MAX_AUDIO_URL_LENGTH = 2048
+MAX_URLS_PER_REQUEST = 20
+
 # Supported languages by AssemblyAI
 SUPPORTED_LANGUAGES = {
     'en': 'English',
@@ -80,18 +95,23 @@ SUPPORTED_LANGUAGES = {
     'ta': 'Tamil'
 }
 
-class TranscriptionRateThrottle(UserRateThrottle):
+# Concurrent retrieves of one transcript share a single upstream fetch and save
+transcript_flight = SingleFlight('transcript', freshness=settings.RETRIEVE_FRESHNESS_SECONDS)
+
+class TranscriptionRateThrottle(UserSlidingWindowThrottle):
     """
     Rate limiting for authenticated users:
     - 25 requests per day
     """
+    scope = 'transcription_user'
     rate = '25/day'
 
-class AnonTranscriptionRateThrottle(AnonRateThrottle):
+class AnonTranscriptionRateThrottle(AnonSlidingWindowThrottle):
     """
     Rate limiting for anonymous users:
     - 5 requests per day
     """
+    scope = 'transcription_anon'
     rate = '5/day'
 
 class TranscriptionPagination(PageNumberPagination):
@@ -100,7 +120,10 @@ class TranscriptionPagination(PageNumberPagination):
     max_page_size = 100
 
     def get_paginated_response(self, data):
-        return Response({
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
             'count': self.page.paginator.count,
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
@@ -112,18 +135,27 @@ class TranscriptionPagination(PageNumberPagination):
                          len(data.get('transcriptions', {}).get('error', [])),
             'status_counts': data.get('status_counts', {}),
             'transcriptions': data.get('transcriptions', {})
-        })
+        }
 
-class TranscriptionViewSet(ViewSet):
+class TranscriptionViewSet(TracedViewMixin, ReplicaReadsMixin, ViewSet):
     """
     ViewSet for handling audio file transcriptions
     """
+    # Actions that only read, whose reads may go to a read replica until they write
+    replica_actions = ('list', 'retrieve', 'search', 'export', 'time_range', 'download', 'usage_stats')
+
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [AllowAny]  # Allow anonymous access
     authentication_classes = [BearerTokenAuthentication]
     throttle_classes = [TranscriptionRateThrottle, AnonTranscriptionRateThrottle]
     pagination_class = TranscriptionPagination
 
+    def initial(self, request, *args, **kwargs):
+        # Without job worker processes, web processes advance queued and running jobs themselves
+        if not settings.JOB_WORKERS:
+            jobs.run_in_process()
+        super().initial(request, *args, **kwargs)
+
     def validate_file(self, file):
         """Validate file format and size"""
         try:
@@ -165,395 +197,69 @@ class TranscriptionViewSet(ViewSet):
 
     def upload_file(self, file_path):
         """Upload file to AssemblyAI"""
-        try:
-            logger.info(f"Starting file upload: {file_path}")
-            logger.info(f"Using AssemblyAI API Key: {ASSEMBLYAI_API_KEY}")
-            
-            # Verify file exists and is readable
-            if not os.path.exists(file_path):
-                raise Exception(f"File not found: {file_path}")
-            
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                raise Exception("File is empty")
-            
-            logger.info(f"File size: {file_size} bytes")
-            
-            # Read file content
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            # Upload file directly
-            logger.info("Uploading file to AssemblyAI")
-            upload_response = requests.post(
-                UPLOAD_URL,
-                headers={"authorization": ASSEMBLYAI_API_KEY},
-                data=file_data
-            )
-            
-            logger.info(f"Upload response status: {upload_response.status_code}")
-            logger.info(f"Upload response: {upload_response.text}")
-            
-            if upload_response.status_code != 200:
-                logger.error(f"Upload failed. Status: {upload_response.status_code}")
-                logger.error(f"Response: {upload_response.text}")
-                raise Exception(f"Upload failed: {upload_response.text}")
-            
-            return upload_response.json()["upload_url"]
-                
-        except requests.exceptions.SSLError as e:
-            logger.error(f"SSL Error during upload: {str(e)}")
-            raise Exception(f"SSL Error during upload: {str(e)}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response status: {e.response.status_code}")
-                logger.error(f"Response text: {e.response.text}")
-            raise Exception(f"Upload request failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"Upload failed: {str(e)}")
-            raise Exception(f"File upload failed: {str(e)}")
-        finally:
-            # Clean up temp file if it exists
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Cleaned up temporary file: {file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temp file: {str(e)}")
+        return assemblyai.upload_file(file_path)
 
     def cleanup_stuck_transcripts(self):
         """Clean up stuck transcripts"""
-        try:
-            # Get list of transcripts
-            response = requests.get(
-                "https://api.assemblyai.com/v2/transcript",
-                headers=headers,
-                params={"limit": 10},
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            # Find stuck transcripts (processing for more than 10 minutes)
-            for transcript in data.get('transcripts', []):
-                if transcript['status'] == 'processing':
-                    created_time = datetime.fromisoformat(transcript['created'].replace('Z', '+00:00'))
-                    if (datetime.now(pytz.utc) - created_time).total_seconds() > 600:  # 10 minutes
-                        # Delete stuck transcript
-                        logger.info(f"Deleting stuck transcript {transcript['id']}")
-                        requests.delete(
-                            f"https://api.assemblyai.com/v2/transcript/{transcript['id']}",
-                            headers=headers
-                        )
-        except Exception as e:
-            logger.error(f"Error cleaning up transcripts: {str(e)}")
+        assemblyai.cleanup_stuck_transcripts()
 
     def create_transcript(self, audio_url, language_code=None, auto_detect=False):
         """Create transcription request with optional language detection"""
-        try:
-            # Clean up stuck transcripts first
-            self.cleanup_stuck_transcripts()
-            
-            # Map of supported languages - Updated to match AssemblyAI's supported languages
-            LANGUAGE_CODES = {
-                'en': 'en',      # English (Global)
-                'en_us': 'en',   # English (US)
-                'en_uk': 'en',   # English (UK)
-                'en_au': 'en',   # English (Australia)
-                'fr': 'fr',      # French
-                'de': 'de',      # German
-                'it': 'it',      # Italian
-                'pt': 'pt',      # Portuguese
-                'nl': 'nl',      # Dutch
-                'hi': 'hi',      # Hindi
-                'ja': 'ja',      # Japanese
-                'es': 'es',      # Spanish
-                'ko': 'ko',      # Korean
-                'pl': 'pl',      # Polish
-                'id': 'id',      # Indonesian
-                'ta': 'ta',      # Tamil
-                'te': 'te',      # Telugu
-                'tr': 'tr',      # Turkish
-                'ru': 'ru',      # Russian
-                'vi': 'vi',      # Vietnamese
-                'zh': 'zh',      # Chinese (Simplified)
-                'zh_tw': 'zh',   # Chinese (Traditional)
-                'da': 'da',      # Danish
-                'fil': 'fil',    # Filipino
-                'fi': 'fi',      # Finnish
-                'el': 'el',      # Greek
-                'hu': 'hu',      # Hungarian
-                'ml': 'ml',      # Malayalam
-                'no': 'no',      # Norwegian
-                'sv': 'sv',      # Swedish
-                'th': 'th',      # Thai
-                'uk': 'uk',      # Ukrainian
-                'bn': 'bn',      # Bengali
-                'ro': 'ro',      # Romanian
-                'si': 'si',      # Sinhala
-                'mr': 'mr',      # Marathi
-                'gu': 'gu',      # Gujarati
-                'kn': 'kn',      # Kannada
-                'ar': 'ar',      # Arabic
-                'fa': 'fa',      # Persian
-                'ur': 'ur',      # Urdu
-                'hr': 'hr',      # Croatian
-                'bg': 'bg',      # Bulgarian
-                'sr': 'sr',      # Serbian
-                'sk': 'sk',      # Slovak
-                'sl': 'sl',      # Slovenian
-                'ca': 'ca',      # Catalan
-                'he': 'he',      # Hebrew
-                'lv': 'lv',      # Latvian
-                'lt': 'lt',      # Lithuanian
-                'ne': 'ne',      # Nepali
-                'et': 'et',      # Estonian
-                'ms': 'ms',      # Malay
-                'tl': 'tl',      # Tagalog
-                'pa': 'pa',      # Punjabi
-                'sw': 'sw',      # Swahili
-                'az': 'az',      # Azerbaijani
-                'hy': 'hy',      # Armenian
-                'bs': 'bs',      # Bosnian
-                'my': 'my',      # Burmese
-                'af': 'af',      # Afrikaans
-                'ka': 'ka',      # Georgian
-                'is': 'is',      # Icelandic
-                'km': 'km',      # Khmer
-                'lo': 'lo',      # Lao
-                'mk': 'mk',      # Macedonian
-                'mn': 'mn',      # Mongolian
-                'gl': 'gl',      # Galician
-                'kk': 'kk',      # Kazakh
-            }
-            
-            # Basic request with required fields
-            transcript_request = {
-                "audio_url": audio_url,
-            }
-
-            # Handle language detection and language code
-            if auto_detect:
-                logger.info("Using automatic language detection")
-                transcript_request["language_detection"] = True
-            elif language_code:
-                # Convert to lowercase and remove any region specifier
-                base_lang = language_code.lower().split('_')[0]
-                # Get the simplified language code
-                normalized_lang = LANGUAGE_CODES.get(base_lang) or LANGUAGE_CODES.get(language_code.lower())
-                if not normalized_lang:
-                    logger.warning(f"Unsupported language code: {language_code}, defaulting to English")
-                    normalized_lang = 'en'
-                logger.info(f"Using language code: {normalized_lang}")
-                transcript_request["language_code"] = normalized_lang
-            else:
-                # Default to automatic language detection if no language specified
-                logger.info("No language specified, using automatic language detection")
-                transcript_request["language_detection"] = True
-            
-            # Optional parameters based on language support
-            if not language_code or language_code.startswith('en'):
-                # Full features for English or auto-detected language
-                transcript_request.update({
-                    "punctuate": True,
-                    "format_text": True,
-                    "auto_highlights": True,
-                    "speaker_labels": True,
-                    "auto_chapters": True,
-                    "entity_detection": True,
-                    "iab_categories": True
-                })
-            else:
-                # Basic features for non-English
-                transcript_request.update({
-                    "punctuate": True,
-                    "format_text": True
-                })
-            
-            logger.info(f"Creating transcript request for URL: {audio_url}")
-            logger.info(f"Request payload: {transcript_request}")
-            logger.info(f"Using headers: {headers}")
-            
-            # Create transcription request without verifying SSL for AssemblyAI CDN
-            transcript_response = requests.post(
-                TRANSCRIPT_URL,
-                json=transcript_request,
-                headers=headers,
-                timeout=30,
-                verify=False  # Disable SSL verification for AssemblyAI CDN
-            )
-            
-            # Log response details
-            logger.info(f"Transcript request response status: {transcript_response.status_code}")
-            logger.info(f"Transcript request content: {transcript_response.text}")
-            
-            if transcript_response.status_code != 200:
-                error_detail = transcript_response.json() if transcript_response.text else "No error details provided"
-                logger.error(f"AssemblyAI API error: {error_detail}")
-                raise Exception(f"AssemblyAI API error: {error_detail}")
-            
-            response_data = transcript_response.json()
-            
-            if 'id' in response_data:
-                logger.info(f"Transcript request created. ID: {response_data['id']}")
-                return response_data
-            else:
-                logger.error(f"Transcript ID not found in response: {response_data}")
-                raise Exception("No transcript ID in response")
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response status: {e.response.status_code}")
-                logger.error(f"Response text: {e.response.text}")
-                try:
-                    error_json = e.response.json()
-                    logger.error(f"Error details: {error_json}")
-                    raise Exception(f"AssemblyAI API error: {error_json}")
-                except ValueError:
-                    logger.error(f"Raw error text: {e.response.text}")
-                    raise Exception(f"AssemblyAI API error: {e.response.text}")
-            raise Exception(f"Request failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"Transcription request failed: {str(e)}")
-            raise
+        return assemblyai.create_transcript(audio_url, language_code, auto_detect)
 
     def get_transcript_result(self, transcript_id):
         """Get transcription result with progress updates"""
-        polling_endpoint = f"https://api.assemblyai.com/v2/transcript/{transcript_id}"
-        max_retries = 600  # Increased to 15 minutes total (1.5s * 600)
-        retry_count = 0
-        last_status = None
-        last_progress = None
-
-        while retry_count < max_retries:
-            try:
-                polling_response = requests.get(
-                    polling_endpoint,
-                    headers=headers,
-                    timeout=30
-                )
-                polling_response.raise_for_status()
-                result = polling_response.json()
-                
-                logger.info(f"Polling response for {transcript_id}: {result}")
-                
-                current_status = result.get('status')
-                current_progress = result.get('percentage', 0)
-                
-                # Return any status change immediately
-                if current_status != last_status or current_progress != last_progress:
-                    logger.info(f"Transcript {transcript_id} - Status: {current_status}, Progress: {current_progress}%")
-                    last_status = current_status
-                    last_progress = current_progress
-                    
-                    # Build response based on status
-                    response = {
-                        'status': current_status,
-                        'progress': current_progress,
-                        'text': result.get('text'),  
-                        'error': result.get('error'),
-                        'language_code': result.get('language_code'),
-                        'audio_duration': result.get('audio_duration'),
-                        'punctuate': result.get('punctuate', True),
-                        'format_text': result.get('format_text', True),
-                        'confidence': result.get('confidence'),
-                        'words': result.get('words'),
-                        'utterances': result.get('utterances'),
-                        'chapters': result.get('chapters'),
-                        'highlights': result.get('auto_highlights_result')
-                    }
-                    
-                    # Add status message for clarity
-                    if current_status == 'queued':
-                        response['message'] = 'Your audio is queued for processing'
-                    elif current_status == 'processing':
-                        response['message'] = f'Processing your audio: {current_progress}% complete'
-                    elif current_status == 'completed':
-                        if not response['text']:
-                            response['message'] = 'Warning: Transcription completed but no text was generated'
-                            logger.warning(f"Completed transcription {transcript_id} has no text: {result}")
-                        else:
-                            response['message'] = 'Transcription completed successfully'
-                    elif current_status == 'error':
-                        response['message'] = f'Error during transcription: {result.get("error")}'
-                    
-                    # Remove None values
-                    response = {k: v for k, v in response.items() if v is not None}
-                    
-                    return response
-                
-                if current_status == 'completed':
-                    break
-                
-                time.sleep(1.5)
-                retry_count += 1
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error polling transcript {transcript_id}: {str(e)}")
-                if hasattr(e, 'response') and e.response is not None:
-                    logger.error(f"API Response: {e.response.text}")
-                return {
-                    'status': 'error',
-                    'error': str(e),
-                    'progress': 0,
-                    'message': f'Error checking transcription status: {str(e)}'
-                }
-
-        logger.error(f"Transcription timed out after {max_retries} attempts")
-        return {
-            'status': 'error',
-            'error': 'Transcription timed out',
-            'progress': last_progress or 0,
-            'message': 'Transcription timed out after 15 minutes'
-        }
+        return assemblyai.get_transcript_result(transcript_id)
 
     def sync_with_assemblyai(self):
         """Sync transcription data with AssemblyAI"""
         try:
             # Get list of transcripts from AssemblyAI
-            response = requests.get(
-                TRANSCRIPT_URL,
-                headers=headers,
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
+            transcripts = assemblyai.list_transcripts()
 
-            logger.info(f"Found {len(data.get('transcripts', []))} transcripts from AssemblyAI")
+            logger.info(f"Found {len(transcripts)} transcripts from AssemblyAI")
 
             # Process each transcript
-            for transcript in data.get('transcripts', []):
+            for transcript in transcripts:
                 transcript_id = transcript.get('id')
                 if not transcript_id:
                     continue
 
-                # Get detailed transcript data
-                result = self.get_transcript_result(transcript_id)
+                # Get detailed transcript data, leaving the record alone when it can't be fetched
+                try:
+                    result = self.get_transcript_result(transcript_id)
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Skipping sync of transcript {transcript_id}: {str(e)}")
+                    continue
                 status = result.get('status', 'unknown')
                 
-                # Get or create transcription record
-                transcription, created = Transcription.objects.get_or_create(
-                    transcript_id=transcript_id,
-                    defaults={
-                        'user': self.request.user,
-                        'status': status,
-                        'audio_url': transcript.get('audio_url', ''),
-                        'language_code': transcript.get('language', 'en')
-                    }
-                )
+                # Get or create transcription record, matching jobs that were
+                # queued locally by the upstream id they were submitted under.
+                # Read from the primary, as the whole row is saved back
+                with replicas.primary():
+                    transcription = Transcription.objects.filter(upstream_id=transcript_id).first()
+                    created = False
+                    if transcription is None:
+                        transcription, created = Transcription.objects.get_or_create(
+                            transcript_id=transcript_id,
+                            defaults={
+                                'user': self.request.user,
+                                'status': status,
+                                'audio_url': transcript.get('audio_url', ''),
+                                'language_code': transcript.get('language', 'en')
+                            }
+                        )
 
-                # Update record
-                transcription.status = status
-                transcription.text = result.get('text')
-                if status == 'completed':
-                    transcription.completed_at = datetime.now(pytz.utc)
+                # Update record, leaving unchanged ones alone so listing doesn't write every time
+                was_completed = transcription.status == 'completed'
+                before = (transcription.status, transcription.version)
+                transcription.update_from_result(result)
                 if result.get('error'):
-                    transcription.error = result.get('error')
-                    transcription.status = 'error'
-                transcription.save()
+                    transcription.set_status('error')
+                if created or (transcription.status, transcription.version) != before:
+                    transcription.save()
+                if transcription.status == 'completed' and not was_completed:
+                    on_completed(transcription, result)
 
                 if created:
                     logger.info(f"Created new transcription record for {transcript_id}")
@@ -565,7 +271,7 @@ class TranscriptionViewSet(ViewSet):
             logger.error(f"Error syncing with AssemblyAI: {str(e)}")
             return False
 
-    def get_paginated_transcriptions(self, transcriptions):
+    def get_paginated_transcriptions(self, transcriptions, fields=None):
         """Helper method to paginate and group transcriptions"""
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(transcriptions, self.request)
@@ -580,18 +286,16 @@ class TranscriptionViewSet(ViewSet):
 
         # Group paginated transcriptions by status
         for trans in page:
-            trans_data = {
-                'id': trans.transcript_id,
-                'text': trans.text,
-                'audio_url': trans.audio_url,
-                'language_code': trans.language_code,
-                'created_at': trans.created_at.isoformat() if trans.created_at else None,
-                'completed_at': trans.completed_at.isoformat() if trans.completed_at else None,
-                'error': trans.error,
-                'status': trans.status
-            }
+            # Completed entries were rendered when they completed and are copied as they are
+            stored = getattr(trans, 'artifact', None)
+            if stored is not None:
+                trans_data = RawJSON(bytes(stored))
+            else:
+                if hasattr(trans, 'unrendered_text'):
+                    trans.text = trans.unrendered_text
+                trans_data = list_entry(trans, fields)
 
-            if trans.status == 'queued':
+            if trans.status in ('queued', admission.PENDING_SUBMIT, admission.SUBMITTING):
                 grouped_transcriptions['queued'].append(trans_data)
             elif trans.status == 'processing':
                 grouped_transcriptions['processing'].append(trans_data)
@@ -615,7 +319,7 @@ class TranscriptionViewSet(ViewSet):
             'transcriptions': grouped_transcriptions
         }
 
-        return paginator.get_paginated_response(response_data)
+        return StreamingJSONResponse(paginator.get_paginated_data(response_data))
 
     def get_or_create_anonymous_user(self):
         """Get or create the default anonymous user"""
@@ -644,7 +348,8 @@ class TranscriptionViewSet(ViewSet):
         """List transcriptions for the user, grouped by status"""
         try:
             # Sync with AssemblyAI first
-            sync_success = self.sync_with_assemblyai()
+            with budget(SYNC_DEADLINE_SECONDS):
+                sync_success = self.sync_with_assemblyai()
             if not sync_success:
                 logger.warning("Failed to sync with AssemblyAI, returning local data only")
             
@@ -655,18 +360,36 @@ class TranscriptionViewSet(ViewSet):
                     'error': 'Unable to process request. Please try again later.'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+            try:
+                fields = requested_fields(request, tuple(LIST_FIELDS))
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            transcriptions = Transcription.objects.filter(user=user)
+            if fields is not None:
+                transcriptions = transcriptions.only(*list_model_fields(fields))
+            else:
+                # A stored entry already holds the text, so it is only read for rows without one
+                transcriptions = transcriptions.with_artifact(artifacts.LIST_ENTRY).defer('text').annotate(
+                    unrendered_text=Case(When(artifact__isnull=True, then=F('text')))
+                )
+
             # Get transcriptions based on user type
             if request.user.is_authenticated:
-                transcriptions = Transcription.objects.filter(user=user).order_by('-created_at')
+                transcriptions = transcriptions.order_by('-created_at')
             else:
                 # For anonymous users, only show 5 most recent transcriptions
-                transcriptions = Transcription.objects.filter(user=user).order_by('-created_at')[:5]
+                transcriptions = transcriptions.order_by('-created_at')[:5]
                 logger.info(f"Limiting anonymous user to 5 most recent transcriptions")
             
-            logger.info(f"Found {len(transcriptions)} transcriptions for user {user.username}")
-            
+            logger.info(f"Found {transcriptions.count()} transcriptions for user {user.username}")
+
+            # Skip building the page when the client's copy is still current
+            etag = list_etag(Transcription.objects.filter(user=user), user.pk, request.GET.urlencode())
+            if if_none_match(request, etag):
+                return not_modified(etag)
+
             # Return paginated response
-            return self.get_paginated_transcriptions(transcriptions)
+            return with_etag(self.get_paginated_transcriptions(transcriptions, fields), etag)
 
         except Exception as e:
             logger.error(f"Error listing transcriptions: {str(e)}")
@@ -678,6 +401,11 @@ class TranscriptionViewSet(ViewSet):
     @action(detail=False, methods=['post'])
     def upload(self, request):
         """Upload audio file and start transcription"""
+        # A retried upload with the same Idempotency-Key gets the first one's response
+        return idempotent(request, lambda: self.start_upload(request))
+
+    def start_upload(self, request):
+        """Store, validate and submit an uploaded audio file"""
         temp_file = None
         try:
             if 'file' not in request.FILES:
@@ -709,33 +437,50 @@ class TranscriptionViewSet(ViewSet):
             if not is_valid:
                 return Response({'error': error_message}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Upload to AssemblyAI
-            upload_url = self.upload_file(temp_file.name)
-            if not upload_url:
-                return Response({
-                    'error': 'Failed to upload file to AssemblyAI'
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Probe the duration from the headers before the temp file is handed off
+            audio_duration = probe_duration(temp_file.name)
 
-            # Start transcription
-            transcript_id = self.create_transcript(upload_url, language_code if language_code else None, auto_detect)
-            if not transcript_id:
+            # Charge the audio to the client's daily quota, assuming a typical
+            # length when the duration could not be probed until it is reported
+            charged_seconds = audio_duration or admission.DEFAULT_JOB_SECONDS
+            allowed, retry_after, charge = charge_audio(request, charged_seconds)
+            if not allowed:
+                headers = {'Retry-After': str(retry_after)} if retry_after else {}
                 return Response({
-                    'error': 'Failed to start transcription'
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                    'error': 'Daily audio quota exceeded',
+                    'details': f"This file has {charged_seconds:.0f}s of audio, more than is left of your daily quota"
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
 
-            # Create transcription record
-            transcription = Transcription.objects.create(
-                transcript_id=transcript_id['id'],
-                user=user,
-                status='queued',
-                audio_url=upload_url,
-                language_code=language_code if language_code else 'auto'
-            )
+            # Short clips may be transcribed locally, everything else goes to AssemblyAI,
+            # which takes an upstream slot if one is free and queues the job otherwise
+            backend = backends.route(audio_duration)
+            try:
+                job = backend.start(
+                    user, temp_file.name, file.name, audio_duration, language_code or 'auto', auto_detect
+                )
+            except CircuitOpenError as e:
+                refund_audio(charge)
+                return Response({
+                    'error': 'Transcription service is temporarily unavailable',
+                    'details': str(e)
+                }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+            except DeadlineExceeded as e:
+                refund_audio(charge)
+                return Response({
+                    'error': 'Transcription service did not respond in time',
+                    'details': str(e)
+                }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+            except Exception:
+                refund_audio(charge)
+                raise
+            if audio_duration is None:
+                estimate_audio_charge(job, charge, charged_seconds)
+            # Audio that has not reached AssemblyAI yet is refunded should its submission fail later
+            if job.upstream_id is None:
+                hold_audio_charge(job, charge)
 
-            return Response({
-                'transcript_id': transcript_id['id'],
-                'status': 'queued'
-            })
+            data, code = self.submission_response(job, audio_duration)
+            return Response(data, status=code)
 
         except Exception as e:
             logger.error(f"Error in upload: {str(e)}")
@@ -751,6 +496,290 @@ class TranscriptionViewSet(ViewSet):
                 except Exception as e:
                     logger.error(f"Error removing temp file: {str(e)}")
 
+    def submission_response(self, job, audio_duration):
+        """Response body and status for a newly started job"""
+        if job.status in (admission.PENDING_SUBMIT, admission.SUBMITTING):
+            if settings.ASYNC_SUBMISSION:
+                message = 'Your audio has been accepted and is being submitted for transcription'
+            else:
+                message = 'Transcription capacity is busy, your audio is queued for submission'
+            return {
+                'transcript_id': job.transcript_id,
+                'status': job.status,
+                'queue_position': admission.queue_position(job),
+                'audio_duration': audio_duration,
+                'poll_interval': suggested_poll_interval(audio_duration),
+                'message': message
+            }, status.HTTP_202_ACCEPTED
+
+        return {
+            'transcript_id': job.transcript_id,
+            'status': 'queued',
+            'audio_duration': audio_duration,
+            'poll_interval': suggested_poll_interval(audio_duration)
+        }, status.HTTP_200_OK
+
+    def validate_audio_url(self, audio_url):
+        """Check that a remote audio URL is one AssemblyAI could fetch"""
+        if not isinstance(audio_url, str) or len(audio_url) > MAX_AUDIO_URL_LENGTH:
+            return False, f"Audio URLs must be strings of at most {MAX_AUDIO_URL_LENGTH} characters"
+        try:
+            URLValidator(schemes=['http', 'https'])(audio_url)
+        except ValidationError:
+            return False, "Not a valid http or https URL"
+
+        host = urlsplit(audio_url).hostname or ''
+        try:
+            private = not ipaddress.ip_address(host).is_global
+        except ValueError:
+            private = host == 'localhost' or host.endswith('.localhost')
+        if private:
+            return False, "Audio must be reachable from the internet"
+        return True, None
+
+    @action(detail=False, methods=['post'], url_path='url', parser_classes=(JSONParser, MultiPartParser, FormParser))
+    def submit_url(self, request):
+        """Transcribe audio that AssemblyAI fetches from a URL, without uploading it here"""
+        return idempotent(request, lambda: self.start_url_submission(request))
+
+    def start_url_submission(self, request):
+        """Validate one audio_url, or a list of audio_urls, and submit them"""
+        # Parsed outside the try, so a malformed body is answered with DRF's 400 or 415
+        data = request.data
+        try:
+            batch = 'audio_urls' in data
+            if batch:
+                # Form submissions list several URLs by repeating the field
+                audio_urls = data.getlist('audio_urls') if hasattr(data, 'getlist') else data.get('audio_urls')
+            else:
+                audio_urls = [data.get('audio_url')]
+            if not isinstance(audio_urls, list) or not audio_urls or audio_urls == [None]:
+                return Response({
+                    'error': 'Provide audio_url, or a list of audio_urls'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if len(audio_urls) > MAX_URLS_PER_REQUEST:
+                return Response({
+                    'error': f"At most {MAX_URLS_PER_REQUEST} audio_urls can be submitted at once"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            invalid = {}
+            for audio_url in audio_urls:
+                is_valid, error_message = self.validate_audio_url(audio_url)
+                if not is_valid:
+                    invalid[str(audio_url)] = error_message
+            if invalid:
+                return Response({'error': 'Invalid audio URL', 'details': invalid}, status=status.HTTP_400_BAD_REQUEST)
+
+            language_code = data.get('language_code') or 'auto'
+            auto_detect = str(data.get('auto_detect', 'true')).lower() == 'true'
+
+            user = self.get_request_user(request)
+            if not user:
+                return Response({
+                    'error': 'Unable to process request. Please try again later.'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            # The length of remote audio is not known until AssemblyAI has fetched it,
+            # so each URL is charged and scheduled as typical length audio, and the
+            # charge corrected once the transcript completes
+            charged_seconds = admission.DEFAULT_JOB_SECONDS * len(audio_urls)
+            allowed, retry_after, charge = charge_audio(request, charged_seconds)
+            if not allowed:
+                headers = {'Retry-After': str(retry_after)} if retry_after else {}
+                return Response({
+                    'error': 'Daily audio quota exceeded',
+                    'details': f"{len(audio_urls)} audio URLs count as {charged_seconds:.0f}s of audio, more than is left of your daily quota"
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
+            results = []
+            for audio_url in audio_urls:
+                try:
+                    job = backends.assemblyai_backend.start(
+                        user, None, None, None, language_code, auto_detect, audio_url=audio_url
+                    )
+                except Exception as e:
+                    refund_audio(charge, admission.DEFAULT_JOB_SECONDS)
+                    if not batch:
+                        raise
+                    logger.error(f"Failed to submit {audio_url}: {str(e)}")
+                    item = {'audio_url': audio_url, 'error': str(e)}
+                    if isinstance(e, CircuitOpenError):
+                        item['retry_after'] = e.retry_after
+                        code = status.HTTP_503_SERVICE_UNAVAILABLE
+                    elif isinstance(e, DeadlineExceeded):
+                        code = status.HTTP_504_GATEWAY_TIMEOUT
+                    else:
+                        code = status.HTTP_500_INTERNAL_SERVER_ERROR
+                    results.append((item, code))
+                    continue
+                estimate_audio_charge(job, charge, admission.DEFAULT_JOB_SECONDS)
+                if job.upstream_id is None:
+                    hold_audio_charge(job, charge, admission.DEFAULT_JOB_SECONDS)
+                data, code = self.submission_response(job, None)
+                results.append(({'audio_url': audio_url, **data}, code))
+
+            if not batch:
+                data, code = results[0]
+                return Response(data, status=code)
+            accepted = any(code == status.HTTP_202_ACCEPTED for _, code in results)
+            return Response(
+                {'transcriptions': [data for data, _ in results]},
+                status=status.HTTP_202_ACCEPTED if accepted else status.HTTP_200_OK
+            )
+
+        except CircuitOpenError as e:
+            return Response({
+                'error': 'Transcription service is temporarily unavailable',
+                'details': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+        except DeadlineExceeded as e:
+            return Response({
+                'error': 'Transcription service did not respond in time',
+                'details': str(e)
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error submitting audio URL: {str(e)}")
+            return Response({
+                'error': 'Failed to submit audio URL',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['post'], url_path='direct', parser_classes=(JSONParser, FormParser))
+    def direct_upload(self, request):
+        """Issue a target the client uploads audio to directly, bypassing this service where storage allows"""
+        filename = request.data.get('filename') or ''
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in SUPPORTED_FORMATS:
+            return Response({
+                'error': 'Unsupported file format',
+                'details': f"Supported formats: {', '.join(sorted(SUPPORTED_FORMATS))}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = request.data.get('content_type') or SUPPORTED_FORMATS[ext]
+        token = direct_upload.new_token(filename, content_type, client_ident(request))
+        try:
+            target = direct_upload.upload_target(request, token)
+        except Exception as e:
+            logger.error(f"Error creating upload target: {str(e)}")
+            return Response({
+                'error': 'Failed to create upload target',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            'upload_token': token,
+            'upload': target,
+            'max_bytes': settings.DIRECT_UPLOAD_MAX_BYTES,
+            'expires_in': settings.DIRECT_UPLOAD_EXPIRES
+        })
+
+    @action(detail=False, methods=['put'], url_path='direct/upload', throttle_classes=[])
+    def direct_upload_put(self, request):
+        """Receive a direct upload when storage is local, standing in for the object store"""
+        if direct_upload.is_remote():
+            return Response({'error': 'Upload to the URL returned by direct/'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = direct_upload.read_token(request.query_params.get('token', ''))
+        except signing.BadSignature:
+            return Response({'error': 'Upload token is invalid or has expired'}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            _, size = direct_upload.save_local(upload['name'], request.stream or io.BytesIO())
+        except direct_upload.UploadTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except Exception as e:
+            logger.error(f"Error storing direct upload: {str(e)}")
+            return Response({
+                'error': 'Failed to store upload',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({'size': size}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='direct/complete', parser_classes=(JSONParser, FormParser),
+            throttle_classes=[])
+    def complete_direct_upload(self, request):
+        """Start transcribing audio the client has uploaded directly to storage"""
+        return idempotent(request, lambda: self.start_direct_upload(request))
+
+    def start_direct_upload(self, request):
+        """Check a completed direct upload and queue it like any other"""
+        try:
+            try:
+                upload = direct_upload.read_token(request.data.get('upload_token') or '')
+            except signing.BadSignature:
+                return Response({'error': 'Upload token is invalid or has expired'}, status=status.HTTP_400_BAD_REQUEST)
+            if upload['owner'] != client_ident(request):
+                return Response({'error': 'This upload belongs to another client'}, status=status.HTTP_403_FORBIDDEN)
+
+            name = upload['name']
+            # Each upload is transcribed once; retries are answered by the Idempotency-Key instead
+            completion_key = f"direct_upload:{name}"
+            if cache.get(completion_key):
+                return Response({'error': 'This upload has already been completed'}, status=status.HTTP_409_CONFLICT)
+
+            size = direct_upload.stored_size(name)
+            if not size:
+                return Response({
+                    'error': 'Nothing has been uploaded for this token yet'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if size > settings.DIRECT_UPLOAD_MAX_BYTES:
+                admission.discard_spool(name)
+                return Response({
+                    'error': f"Uploads are limited to {settings.DIRECT_UPLOAD_MAX_BYTES} bytes"
+                }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            if not cache.add(completion_key, True, timeout=settings.DIRECT_UPLOAD_EXPIRES * 2):
+                return Response({'error': 'This upload has already been completed'}, status=status.HTTP_409_CONFLICT)
+
+            user = self.get_request_user(request)
+            language_code = request.data.get('language_code') or 'auto'
+            auto_detect = str(request.data.get('auto_detect', 'true')).lower() == 'true'
+
+            # Only audio kept locally can be probed without downloading it
+            audio_duration = None if direct_upload.is_remote() else probe_duration(default_storage.path(name))
+            charged_seconds = audio_duration or admission.DEFAULT_JOB_SECONDS
+            allowed, retry_after, charge = charge_audio(request, charged_seconds)
+            if not allowed:
+                cache.delete(completion_key)
+                headers = {'Retry-After': str(retry_after)} if retry_after else {}
+                return Response({
+                    'error': 'Daily audio quota exceeded',
+                    'details': f"This file has {charged_seconds:.0f}s of audio, more than is left of your daily quota"
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+
+            try:
+                job = backends.assemblyai_backend.start(
+                    user, None, name, audio_duration, language_code, auto_detect, spool_name=name
+                )
+            except Exception:
+                refund_audio(charge)
+                cache.delete(completion_key)
+                raise
+            if audio_duration is None:
+                estimate_audio_charge(job, charge, charged_seconds)
+            if job.upstream_id is None:
+                hold_audio_charge(job, charge)
+
+            data, code = self.submission_response(job, audio_duration)
+            return Response(data, status=code)
+
+        except CircuitOpenError as e:
+            return Response({
+                'error': 'Transcription service is temporarily unavailable',
+                'details': str(e)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+        except DeadlineExceeded as e:
+            return Response({
+                'error': 'Transcription service did not respond in time',
+                'details': str(e)
+            }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Error completing direct upload: {str(e)}")
+            return Response({
+                'error': 'Failed to complete upload',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     def retrieve(self, request, pk=None):
         """Get transcription status or result"""
         try:
@@ -759,23 +788,98 @@ class TranscriptionViewSet(ViewSet):
                     "error": "Transcript ID is required"
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Get result from AssemblyAI
-            result = self.get_transcript_result(pk)
-            
-            # Update transcription in database
             try:
-                transcription = Transcription.objects.get(transcript_id=pk)
-                transcription.status = result.get('status', 'unknown')
-                transcription.text = result.get('text')
-                if result.get('status') == 'completed':
-                    transcription.completed_at = datetime.now(pytz.utc)
-                if result.get('error'):
-                    transcription.error = result.get('error')
-                transcription.save()
-            except Transcription.DoesNotExist:
-                logger.warning(f"Transcription {pk} not found in database")
+                fields = requested_fields(request, RETRIEVE_FIELDS)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            variant = fieldset_key(fields)
+
+            transcription = Transcription.objects.filter(transcript_id=pk).first()
+            # Unfinished jobs are polled and saved below, so they are read again from
+            # the primary, which a replica may not have caught up with
+            if transcription is None or transcription.status not in TERMINAL_STATUSES:
+                with replicas.primary():
+                    transcription = Transcription.objects.filter(transcript_id=pk).first()
+
+            # Jobs still waiting for an upstream slot are answered locally
+            if transcription and transcription.status in (admission.PENDING_SUBMIT, admission.SUBMITTING):
+                return Response(project(admission.pending_result(transcription), fields))
+
+            # As are jobs being transcribed by the local engine, which saves their result when done
+            if transcription and transcription.backend == backends.LOCAL and transcription.status not in TERMINAL_STATUSES:
+                result = backends.for_job(transcription).result(transcription)
+                result['poll_interval'] = suggested_poll_interval(transcription.audio_duration)
+                return Response(project(result, fields))
+
+            # Finished transcripts only change with their version, so a client that
+            # already holds the current one is answered without asking AssemblyAI
+            if transcription and transcription.status in TERMINAL_STATUSES:
+                etag = transcription.etag(variant=variant)
+                if if_none_match(request, etag):
+                    return not_modified(etag)
+                # Nor is the full result fetched when every requested field is stored here
+                if fields is not None and fields <= STORED_RESULT_FIELDS:
+                    return with_etag(Response(project(transcription.stored_result(), fields)), etag)
+                # Completed results are kept in full, so they are streamed from storage
+                # instead of being fetched, held in memory and encoded in one go
+                timeline = None
+                if transcription.status == 'completed':
+                    timeline = TranscriptTimeline.objects.filter(transcription=transcription).first()
+                if timeline and timeline.result:
+                    return with_etag(
+                        StreamingJSONResponse(project(stored_response(transcription, timeline), fields)), etag
+                    )
+
+            upstream_id = transcription.upstream_transcript_id if transcription else pk
+
+            def fetch_and_update():
+                result = self.get_transcript_result(upstream_id)
+                if transcription:
+                    save_result(transcription, result)
+                else:
+                    logger.warning(f"Transcription {pk} not found in database")
+                return result
+
+            # Get result from AssemblyAI, falling back to stored data during an outage
+            try:
+                result = dict(transcript_flight.do(upstream_id, fetch_and_update))
+            except CircuitOpenError as e:
+                if transcription is None:
+                    return Response({
+                        'error': 'Transcription service is temporarily unavailable',
+                        'details': str(e)
+                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+                return Response(project(transcription.local_result(), fields))
+            except DeadlineExceeded as e:
+                if transcription is None:
+                    return Response({
+                        'error': 'Transcription service did not respond in time',
+                        'details': str(e)
+                    }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+                return Response(project(transcription.local_result(), fields))
+            except requests.exceptions.RequestException as e:
+                # Nothing was learned about the transcript, so the record is left as it is
+                return Response({
+                    'error': 'Failed to reach the transcription service',
+                    'details': str(e)
+                }, status=status.HTTP_502_BAD_GATEWAY)
+
+            etag = None
+            if transcription:
+                # Another request may have led the fetch and saved the update
+                with replicas.primary():
+                    transcription.refresh_from_db(fields=['status', 'version'])
+                etag = transcription.etag(result.get('progress'), variant)
+                if if_none_match(request, etag):
+                    return not_modified(etag)
+
+            audio_duration = result.get('audio_duration') or (transcription and transcription.audio_duration)
+
+            # Tell clients still waiting how long to back off between polls
+            if result.get('status') in ('queued', 'processing'):
+                result['poll_interval'] = suggested_poll_interval(audio_duration)
             
-            return Response(result)
+            return with_etag(Response(project(result, fields)), etag)
 
         except Exception as e:
             logger.error(f"Error getting transcript {pk}: {str(e)}")
@@ -783,3 +887,268 @@ class TranscriptionViewSet(ViewSet):
                 "error": "Failed to get transcript",
                 "details": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over the user's transcript text"""
+        try:
+            query = request.query_params.get('q', '').strip()
+            if not query:
+                return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+            user = self.get_request_user(request)
+            if not user:
+                return Response({
+                    'error': 'Unable to process request. Please try again later.'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            try:
+                page = max(1, int(request.query_params.get('page', 1)))
+                page_size = min(
+                    TranscriptionPagination.max_page_size,
+                    max(1, int(request.query_params.get('page_size', TranscriptionPagination.page_size)))
+                )
+            except ValueError:
+                return Response({'error': 'Invalid page or page_size'}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Fetch one extra row to know whether there is another page without counting matches
+            matches = search_transcriptions(user, query, limit=page_size + 1, offset=(page - 1) * page_size)
+
+            results = [{
+                'id': trans.transcript_id,
+                'status': trans.status,
+                'rank': round(rank, 4),
+                'snippet': snippet,
+                'language_code': trans.language_code,
+                'audio_duration': trans.audio_duration,
+                'created_at': trans.created_at.isoformat() if trans.created_at else None,
+                'completed_at': trans.completed_at.isoformat() if trans.completed_at else None
+            } for trans, rank, snippet in matches[:page_size]]
+
+            return Response({
+                'query': query,
+                'current_page': page,
+                'page_size': page_size,
+                'has_next': len(matches) > page_size,
+                'results': results
+            })
+
+        except Exception as e:
+            logger.error(f"Error searching transcriptions: {str(e)}")
+            return Response({
+                'error': 'Failed to search transcriptions',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """Stream all of the user's transcripts as NDJSON, or subtitles of the completed ones"""
+        try:
+            export_format = request.query_params.get('type', 'ndjson').lower()
+            if export_format not in EXPORT_FORMATS:
+                return Response({
+                    'error': f"Unsupported export type. Supported types: {', '.join(EXPORT_FORMATS)}"
+                }, status=status.HTTP_400_BAD_REQUEST)
+            zipped = request.query_params.get('zip', '').lower() in ('1', 'true', 'yes')
+
+            # Rows are read in chunks while the response is being sent
+            transcriptions = Transcription.objects.filter(user=request.user).order_by('created_at', 'id')
+            stream, content_type, filename = export_stream(transcriptions, export_format, zipped)
+
+            logger.info(f"Exporting transcriptions of {request.user.username} as {export_format}")
+            response = StreamingHttpResponse(stream, content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        except Exception as e:
+            logger.error(f"Error exporting transcriptions: {str(e)}")
+            return Response({
+                'error': 'Failed to export transcriptions',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['get'], url_path='range')
+    def time_range(self, request, pk=None):
+        """Words and utterances overlapping a time window, in milliseconds"""
+        try:
+            try:
+                start = int(request.query_params['start'])
+                end = int(request.query_params['end'])
+            except (KeyError, ValueError):
+                return Response({
+                    'error': 'start and end are required, in milliseconds'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if start < 0 or end <= start:
+                return Response({
+                    'error': 'end must be greater than start, and start cannot be negative'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            transcription = Transcription.objects.filter(transcript_id=pk).first()
+            if transcription is None:
+                return Response({'error': 'Transcript not found'}, status=status.HTTP_404_NOT_FOUND)
+            if transcription.status != 'completed':
+                return Response({
+                    'error': 'Transcript is not completed yet',
+                    'status': transcription.status
+                }, status=status.HTTP_409_CONFLICT)
+
+            # The rest of the result is not needed for a window, and can be far larger than it
+            timeline = TranscriptTimeline.objects.filter(transcription=transcription).defer('result').first()
+            if timeline is None:
+                # Completed before timings were kept locally, fetch them once
+                try:
+                    result = self.get_transcript_result(transcription.upstream_transcript_id)
+                except CircuitOpenError as e:
+                    return Response({
+                        'error': 'Transcription service is temporarily unavailable',
+                        'details': str(e)
+                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(e.retry_after)})
+                except DeadlineExceeded as e:
+                    return Response({
+                        'error': 'Transcription service did not respond in time',
+                        'details': str(e)
+                    }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+                except requests.exceptions.RequestException as e:
+                    return Response({
+                        'error': 'Failed to reach the transcription service',
+                        'details': str(e)
+                    }, status=status.HTTP_502_BAD_GATEWAY)
+                if result.get('status') != 'completed':
+                    return Response({
+                        'error': 'Failed to load transcript timings',
+                        'details': result.get('error')
+                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                timeline = store_timeline(transcription, result)
+
+            return Response({
+                'id': transcription.transcript_id,
+                'start': start,
+                'end': end,
+                **slice_timeline(timeline, start, end)
+            })
+
+        except Exception as e:
+            logger.error(f"Error getting range of transcript {pk}: {str(e)}")
+            return Response({
+                'error': 'Failed to get transcript range',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """A completed transcript as plain text with speaker labels, or as SRT or VTT subtitles"""
+        try:
+            kind = request.query_params.get('type', artifacts.TEXT).lower()
+            if kind not in artifacts.DOWNLOAD_TYPES:
+                return Response({
+                    'error': f"Unsupported download type. Supported types: {', '.join(artifacts.DOWNLOAD_TYPES)}"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            transcription = Transcription.objects.filter(transcript_id=pk).first()
+            if transcription is None:
+                return Response({'error': 'Transcript not found'}, status=status.HTTP_404_NOT_FOUND)
+            if transcription.status != 'completed':
+                return Response({
+                    'error': 'Transcript is not completed yet',
+                    'status': transcription.status
+                }, status=status.HTTP_409_CONFLICT)
+
+            etag = transcription.etag(variant=kind)
+            if if_none_match(request, etag):
+                return not_modified(etag)
+
+            # Rendered when the transcript completed, so this only copies bytes out
+            content = artifacts.get_artifact(transcription, kind)
+            if content is None:
+                return Response({
+                    'error': 'Word timings are not available for this transcript'
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            response = HttpResponse(content, content_type=artifacts.DOWNLOAD_TYPES[kind])
+            response['Content-Disposition'] = f'attachment; filename="{transcription.transcript_id}.{kind}"'
+            return with_etag(response, etag)
+
+        except Exception as e:
+            logger.error(f"Error downloading transcript {pk}: {str(e)}")
+            return Response({
+                'error': 'Failed to download transcript',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'], url_path='usage', permission_classes=[IsAuthenticated])
+    def usage_stats(self, request):
+        """Jobs, audio minutes and failure rates over a range of days, read from the usage rollups"""
+        try:
+            params = request.query_params
+            try:
+                since, until = usage.date_range(
+                    datetime.date.fromisoformat(params['since']) if params.get('since') else None,
+                    datetime.date.fromisoformat(params['until']) if params.get('until') else None,
+                )
+            except ValueError as e:
+                return Response({'error': f"Invalid date range: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            by = [name.strip() for name in params.get('by', 'day').split(',') if name.strip()]
+            unknown = [name for name in by if name not in usage.DIMENSIONS]
+            if unknown or len(set(by)) != len(by):
+                return Response({
+                    'error': f"by must list distinct values of: {', '.join(usage.DIMENSIONS)}"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            # Admins can see another user's usage, or everyone's with user=all; everyone else only their own
+            user = request.user
+            username = params.get('user')
+            if username and username != request.user.username:
+                if not request.user.is_staff:
+                    return Response({'error': 'Only admins can see other users\' usage'}, status=status.HTTP_403_FORBIDDEN)
+                if username == 'all':
+                    user = None
+                else:
+                    user = User.objects.filter(username=username).first()
+                    if user is None:
+                        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            return Response(usage.usage(since, until, by, user))
+
+        except Exception as e:
+            logger.error(f"Error reading usage: {str(e)}")
+            return Response({
+                'error': 'Failed to read usage',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], throttle_classes=[])
+    def metrics(self, request):
+        """Upstream health and capacity, for monitoring"""
+        return Response({
+            'circuit_breaker': assemblyai.breaker.snapshot(),
+            'admission': admission.snapshot(),
+            'retrieve_coalescing': transcript_flight.snapshot()
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], throttle_classes=[])
+    def profiles(self, request):
+        """Recent request profiles, or one of them as a flame graph, collapsed stacks or summary"""
+        profile_id = request.query_params.get('id')
+        if not profile_id:
+            return Response({'profiles': profiling.list_profiles()})
+
+        profile = profiling.load_profile(profile_id)
+        if profile is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        summary, collapsed = profile
+
+        output = request.query_params.get('output', 'svg')
+        if output == 'json':
+            return Response(summary)
+        if output == 'collapsed':
+            response = HttpResponse(collapsed, content_type='text/plain; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{profile_id}.collapsed"'
+            return response
+        if output != 'svg':
+            return Response({'error': 'output must be svg, collapsed or json'}, status=status.HTTP_400_BAD_REQUEST)
+        title = (
+            f"{summary['method']} {summary['path']} ({summary['trigger']}): {summary['duration_ms']}ms, "
+            f"{summary['queries']} queries in {summary['query_ms']}ms"
+        )
+        return HttpResponse(profiling.flame_svg(collapsed, title), content_type='image/svg+xml')
@@ -0,0 +1,82 @@
+"""
+Reads of completed transcripts served from pre-rendered artifacts.
+
+Completes --transcripts transcripts of --minutes each the way job workers
+do, which renders their list entries, text and subtitles, then times a page
+of the list, a text download and an SRT download. The "rendered on read"
+cases have no artifacts to read and render nothing ahead, which is how
+every read was served before: each list entry and download built from the
+stored result.
+"""
+from benchmarks.harness import parser, setup_django, measure, report
+from benchmarks.bench_conditional import canned_result
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--transcripts', type=int, default=100, help='Completed transcripts listed on a page')
+    arg_parser.add_argument('--minutes', type=float, default=30, help='Length of each transcript')
+    args = arg_parser.parse_args()
+    setup_django(args.database_url)
+
+    import random
+    from unittest import mock
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from rest_framework.authtoken.models import Token
+    from audio_transcribe import artifacts
+    from audio_transcribe.models import Transcription, TranscriptArtifact, TranscriptTimeline
+    from audio_transcribe.timeline import save_result
+    from audio_transcribe.views import TranscriptionViewSet
+
+    TranscriptionViewSet.throttle_classes = []
+
+    user, _ = User.objects.get_or_create(username='bench_artifacts')
+    token, _ = Token.objects.get_or_create(user=user)
+    Transcription.objects.filter(user=user).delete()
+    result = canned_result(args.minutes, random.Random(42))
+    for i in range(args.transcripts):
+        transcription = Transcription.objects.create(
+            transcript_id=f"bench_artifacts_{i}", user=user, status='processing', audio_url=''
+        )
+        save_result(transcription, result)
+
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+    urls = {
+        'list': f"/api/transcribe/?page_size={args.transcripts}",
+        'txt': '/api/transcribe/bench_artifacts_0/download/?type=txt',
+        'srt': '/api/transcribe/bench_artifacts_0/download/?type=srt',
+    }
+
+    def get(url):
+        response = client.get(url, secure=True)
+        assert response.status_code == 200, response.status_code
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def render_without_keeping(transcription, kind):
+        timeline = TranscriptTimeline.objects.filter(transcription=transcription).first()
+        return artifacts.render(transcription, timeline, kind)
+
+    rows = []
+    # The list is not synced with AssemblyAI here, only served from the database
+    with mock.patch.object(TranscriptionViewSet, 'sync_with_assemblyai', return_value=True):
+        for name, url in urls.items():
+            stats = measure(lambda: get(url), iterations=args.iterations)
+            stats['bytes'] = len(get(url))
+            rows.append((f"{name}, pre-rendered", stats))
+
+        TranscriptArtifact.objects.filter(transcription__user=user).delete()
+        with mock.patch('audio_transcribe.artifacts.get_artifact', side_effect=render_without_keeping):
+            for name, url in urls.items():
+                stats = measure(lambda: get(url), iterations=args.iterations)
+                stats['bytes'] = len(get(url))
+                rows.append((f"{name}, rendered on read", stats))
+
+    report(
+        f"Reads of {args.transcripts} completed {args.minutes:g} minute transcripts ({len(result['words'])} words each)",
+        rows, columns=('bytes', 'p50', 'p95', 'p99')
+    )
+
+
+if __name__ == '__main__':
+    main()
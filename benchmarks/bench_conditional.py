@@ -0,0 +1,108 @@
+"""
+Bandwidth and server time of polling retrieve() for a completed transcript.
+
+Serves a completed --minutes long transcript (words, utterances and text as
+AssemblyAI returns them) through the API and compares a plain response,
+gzip and brotli encoded responses, and a conditional request answered with
+304 Not Modified. AssemblyAI is replaced with a canned result returned
+instantly, so the times shown leave out the upstream round trip that a 304
+also saves.
+"""
+import time
+import random
+from unittest import mock
+
+from benchmarks.harness import parser, setup_django, measure, report
+
+
+def canned_result(minutes, rng):
+    words = []
+    clock = 0
+    for i in range(int(minutes * 60 * 2.5)):
+        clock += rng.randint(100, 500)
+        words.append({
+            'text': rng.choice(['the', 'and', 'transcript', 'audio', 'meeting', 'quarterly', 'revenue']),
+            'start': clock,
+            'end': clock + rng.randint(80, 400),
+            'confidence': round(rng.uniform(0.5, 1.0), 5),
+            'speaker': 'A' if (i // 200) % 2 == 0 else 'B',
+        })
+    utterances = [
+        {'speaker': chunk[0]['speaker'], 'start': chunk[0]['start'], 'end': chunk[-1]['end'],
+         'confidence': 0.9, 'text': ' '.join(w['text'] for w in chunk), 'words': chunk}
+        for chunk in (words[i:i + 200] for i in range(0, len(words), 200))
+    ]
+    return {
+        'status': 'completed',
+        'progress': 100,
+        'text': ' '.join(w['text'] for w in words),
+        'language_code': 'en',
+        'audio_duration': minutes * 60,
+        'words': words,
+        'utterances': utterances,
+        'message': 'Transcription completed successfully',
+    }
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--minutes', type=float, default=60, help='Length of the transcript served')
+    args = arg_parser.parse_args()
+
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from rest_framework.authtoken.models import Token
+    from audio_transcribe.models import Transcription
+    from audio_transcribe.views import TranscriptionViewSet
+    from speech_to_text_api import middleware
+
+    # Daily request limits would stop the benchmark long before it finishes
+    TranscriptionViewSet.throttle_classes = []
+
+    user, _ = User.objects.get_or_create(username='bench_conditional')
+    token, _ = Token.objects.get_or_create(user=user)
+    transcription, _ = Transcription.objects.get_or_create(
+        transcript_id='bench_conditional', defaults={'user': user, 'status': 'completed', 'audio_url': ''}
+    )
+    result = canned_result(args.minutes, random.Random(42))
+
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+    url = f"/api/transcribe/{transcription.transcript_id}/"
+
+    with mock.patch('audio_transcribe.assemblyai.get_transcript_result', return_value=result):
+        etag = client.get(url, secure=True)['ETag']
+        cases = [
+            ('plain JSON', {}),
+            ('gzip', {'HTTP_ACCEPT_ENCODING': 'gzip'}),
+            ('If-None-Match (304)', {'HTTP_IF_NONE_MATCH': etag}),
+        ]
+        if middleware.brotli is not None:
+            cases.insert(2, ('brotli', {'HTTP_ACCEPT_ENCODING': 'br'}))
+        else:
+            print("brotli is not installed, skipping it")
+
+        rows = []
+        for name, headers in cases:
+            response = client.get(url, secure=True, **headers)
+            stats = measure(lambda: client.get(url, secure=True, **headers), iterations=args.iterations)
+
+            cpu_started = time.process_time()
+            for _ in range(args.iterations):
+                client.get(url, secure=True, **headers)
+            stats['cpu'] = (time.process_time() - cpu_started) * 1000 / args.iterations
+
+            stats['status'] = response.status_code
+            stats['bytes'] = len(response.content)
+            rows.append((name, stats))
+
+    report(
+        f"GET {url} for a {args.minutes:g} minute transcript ({len(result['words'])} words)",
+        rows,
+        columns=('status', 'bytes', 'p50', 'p95', 'cpu')
+    )
+
+
+if __name__ == '__main__':
+    main()
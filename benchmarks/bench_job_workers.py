@@ -0,0 +1,115 @@
+"""
+Throughput of job workers polling AssemblyAI, by number of worker processes.
+
+Queues --jobs running transcripts, then starts 1, 2, 4, ... worker processes
+that claim and advance them the way process_submissions does until none are
+due. Polling AssemblyAI is replaced by a --latency-ms sleep that reports
+the transcript as completed. Reports jobs advanced per second, timed once
+every worker has booted, and any job polled more than once, which leases
+should make impossible.
+
+    python -m benchmarks.bench_job_workers --database-url sqlite:////tmp/bench.sqlite3
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from unittest import mock
+
+from benchmarks.harness import parser, setup_django, report
+
+
+def run_worker(args):
+    """Advance due jobs in this process until there are none, printing the polled ids as JSON"""
+    setup_django(args.database_url)
+
+    from audio_transcribe import jobs
+
+    polled = []
+
+    def fetch_transcript(transcript_id):
+        time.sleep(args.latency_ms / 1000)
+        polled.append(transcript_id)
+        return {'status': 'completed', 'text': 'benchmark', 'audio_duration': 30.0}
+
+    owner = jobs.worker_id()
+    # Wait until every worker has booted, so only polling is timed
+    print('ready', flush=True)
+    sys.stdin.readline()
+    with mock.patch('audio_transcribe.assemblyai.fetch_transcript', side_effect=fetch_transcript):
+        while jobs.advance_due(owner, args.batch):
+            pass
+    print(json.dumps(polled))
+
+
+def seed(count):
+    from django.contrib.auth.models import User
+    from audio_transcribe.models import Transcription
+
+    user, _ = User.objects.get_or_create(username='bench_job_workers')
+    Transcription.objects.filter(user=user).delete()
+    Transcription.objects.bulk_create([
+        Transcription(
+            transcript_id=f"bench_job_{i}", upstream_id=f"bench_job_{i}", user=user,
+            status='processing', audio_url='', audio_duration=30.0
+        )
+        for i in range(count)
+    ])
+
+
+def run(args, workers):
+    seed(args.jobs)
+    command = [
+        sys.executable, '-m', 'benchmarks.bench_job_workers', '--database-url', args.database_url,
+        '--latency-ms', str(args.latency_ms), '--batch', str(args.batch), '--worker',
+    ]
+    processes = [
+        subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.stdout.readline()
+    started = time.perf_counter()
+    for process in processes:
+        process.stdin.write('\n')
+        process.stdin.flush()
+    polled = []
+    for process in processes:
+        output = process.stdout.read()
+        process.wait()
+        if process.returncode:
+            raise RuntimeError('worker failed')
+        polled.extend(json.loads(output.strip().splitlines()[-1]))
+    elapsed = time.perf_counter() - started
+    return {
+        'jobs_per_s': f"{len(set(polled)) / elapsed:.1f}",
+        'polled': len(set(polled)),
+        'duplicates': len(polled) - len(set(polled)),
+        'wall': elapsed * 1000,
+    }
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--jobs', type=int, default=400)
+    arg_parser.add_argument('--workers', default='1,2,4,8', help='Comma-separated worker counts to compare')
+    arg_parser.add_argument('--latency-ms', type=float, default=50, help='Simulated AssemblyAI response time')
+    arg_parser.add_argument('--batch', type=int, default=10, help='Jobs each worker claims at a time')
+    arg_parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    setup_django(args.database_url)
+    rows = [(f"{workers} workers", run(args, int(workers))) for workers in args.workers.split(',')]
+    report(
+        f"{args.jobs} running jobs polled with {args.latency_ms:g}ms simulated latency, batches of {args.batch}",
+        rows, columns=('jobs_per_s', 'polled', 'duplicates', 'wall')
+    )
+
+
+if __name__ == '__main__':
+    main()
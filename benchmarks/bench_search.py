@@ -0,0 +1,114 @@
+"""
+Full-text search latency over a large synthetic transcript table.
+
+Seeds --rows transcripts (Zipf-distributed vocabulary, spread over --users
+owners) into the scratch database if it holds fewer, then times per-user
+searches for terms of decreasing frequency through search_transcriptions().
+"""
+import random
+import itertools
+from datetime import datetime, timezone
+
+from benchmarks.harness import parser, setup_django, measure, report
+
+VOCABULARY_SIZE = 20000
+BATCH_SIZE = 10000
+
+
+def make_vocabulary(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def seed(rows, users, words_per_transcript, vocabulary, rng):
+    from django.db import connection, transaction
+    from django.contrib.auth.models import User
+    from audio_transcribe.models import Transcription
+
+    existing = Transcription.objects.count()
+    if existing >= rows:
+        print(f"Database already holds {existing} transcripts, skipping seeding")
+        return
+
+    if User.objects.filter(username__startswith='bench_').count() < users:
+        User.objects.bulk_create(
+            [User(username=f"bench_{i}") for i in range(users)], ignore_conflicts=True
+        )
+    user_ids = list(User.objects.filter(username__startswith='bench_').values_list('id', flat=True))
+
+    cumulative = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+    now = datetime.now(timezone.utc)
+    sql = (
+        "INSERT INTO audio_transcribe_transcription "
+        "(transcript_id, user_id, status, text, audio_url, language_code, created_at, auto_detect) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+    )
+
+    print(f"Seeding {rows - existing} transcripts...")
+    for start in range(existing, rows, BATCH_SIZE):
+        batch = []
+        for i in range(start, min(rows, start + BATCH_SIZE)):
+            text = ' '.join(rng.choices(vocabulary, cum_weights=cumulative, k=words_per_transcript))
+            batch.append((f"bench_{i}", rng.choice(user_ids), 'completed', text, '', 'en', now, True))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        if (start // BATCH_SIZE) % 10 == 0:
+            print(f"  {min(rows, start + BATCH_SIZE)} rows")
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO audio_transcribe_transcription_fts(audio_transcribe_transcription_fts) "
+                "VALUES ('optimize')"
+            )
+            cursor.execute("ANALYZE")
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE audio_transcribe_transcription")
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--rows', type=int, default=1000000)
+    arg_parser.add_argument('--users', type=int, default=1000)
+    arg_parser.add_argument('--words', type=int, default=50, help='Words per synthetic transcript')
+    args = arg_parser.parse_args()
+
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from audio_transcribe.search import search_transcriptions
+
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(rng)
+    seed(args.rows, args.users, args.words, vocabulary, rng)
+
+    user = User.objects.filter(username__startswith='bench_').order_by('id').first()
+    cases = [
+        ("very common term (rank 10)", vocabulary[9]),
+        ("common term (rank 100)", vocabulary[99]),
+        ("uncommon term (rank 1000)", vocabulary[999]),
+        ("rare term (rank 10000)", vocabulary[9999]),
+        ("two terms (rank 100 + 1000)", f"{vocabulary[99]} {vocabulary[999]}"),
+        ("no match", 'zzzzzzzzzz'),
+    ]
+
+    rows = []
+    for name, query in cases:
+        stats = measure(lambda: search_transcriptions(user, query, limit=11), iterations=args.iterations)
+        stats['hits'] = len(search_transcriptions(user, query, limit=11))
+        rows.append((name, stats))
+
+    report(
+        f"search_transcriptions() on {connection.vendor}, {args.rows} transcripts, {args.users} users",
+        rows,
+        columns=('p50', 'p95', 'p99', 'max', 'hits')
+    )
+
+
+if __name__ == '__main__':
+    main()
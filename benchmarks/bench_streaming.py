@@ -0,0 +1,146 @@
+"""
+Time to first byte and peak memory of retrieve() for a long completed transcript.
+
+Compares the two ways a completed --hours long transcript is served:
+"buffered" builds the whole response dict from an AssemblyAI result (parsed
+from JSON on every request, as it is when fetched) and encodes it in one go,
+"streamed" rebuilds it from the stored timeline and encodes words and
+utterances chunk by chunk while the response is sent. Each case runs in a
+fresh process so its peak RSS is not inflated by the other.
+"""
+import sys
+import json
+import argparse
+import time
+import random
+import resource
+import subprocess
+from unittest import mock
+
+from benchmarks.harness import parser, setup_django, report
+
+CASES = ('buffered', 'streamed')
+
+
+def make_result(hours, rng):
+    words = []
+    clock = 0
+    vocabulary = ['the', 'and', 'transcript', 'audio', 'meeting', 'quarterly', 'revenue', 'customer', 'growth']
+    for i in range(int(hours * 3600 * 2.5)):
+        clock += rng.randint(100, 500)
+        words.append({
+            'text': rng.choice(vocabulary),
+            'start': clock,
+            'end': clock + rng.randint(80, 400),
+            'confidence': round(rng.uniform(0.5, 1.0), 3),
+            'speaker': 'A' if (i // 300) % 2 == 0 else 'B',
+        })
+    utterances = [
+        {'confidence': 0.9, 'end': chunk[-1]['end'], 'speaker': chunk[0]['speaker'], 'start': chunk[0]['start'],
+         'text': ' '.join(w['text'] for w in chunk), 'words': chunk}
+        for chunk in (words[i:i + 300] for i in range(0, len(words), 300))
+    ]
+    return {
+        'status': 'completed',
+        'progress': 100,
+        'text': ' '.join(w['text'] for w in words),
+        'language_code': 'en',
+        'audio_duration': hours * 3600,
+        'words': words,
+        'utterances': utterances,
+        'message': 'Transcription completed successfully',
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(args):
+    """Serve the transcript once in this process and print the measurements as JSON"""
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from rest_framework.authtoken.models import Token
+    from audio_transcribe.models import Transcription, TranscriptTimeline
+    from audio_transcribe.timeline import store_timeline
+    from audio_transcribe.views import TranscriptionViewSet
+
+    TranscriptionViewSet.throttle_classes = []
+
+    user, _ = User.objects.get_or_create(username='bench_streaming')
+    token, _ = Token.objects.get_or_create(user=user)
+    result = make_result(args.hours, random.Random(42))
+    upstream_body = json.dumps(result)
+    transcription, _ = Transcription.objects.update_or_create(
+        transcript_id='bench_streaming',
+        defaults={'user': user, 'status': 'completed', 'audio_url': '', 'text': result['text']}
+    )
+    if args.case == 'streamed':
+        store_timeline(transcription, result)
+    else:
+        TranscriptTimeline.objects.filter(transcription=transcription).delete()
+    del result
+
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+    url = f"/api/transcribe/{transcription.transcript_id}/"
+    baseline = peak_rss_mb()
+
+    with mock.patch(
+        'audio_transcribe.assemblyai.get_transcript_result', side_effect=lambda _: json.loads(upstream_body)
+    ):
+        started = time.perf_counter()
+        response = client.get(url, secure=True)
+        chunks = iter(response.streaming_content) if response.streaming else iter([response.content])
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - started
+        for chunk in chunks:
+            size += len(chunk)
+        total = time.perf_counter() - started
+
+    print(json.dumps({
+        'status': response.status_code,
+        'bytes': size,
+        'ttfb': first_byte * 1000,
+        'total': total * 1000,
+        'peak_rss_mb': peak_rss_mb() - baseline,
+    }))
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--hours', type=float, default=3, help='Length of the transcript served')
+    arg_parser.add_argument('--case', choices=CASES, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.case:
+        run_case(args)
+        return
+
+    rows = []
+    for case in CASES:
+        samples = []
+        for _ in range(args.iterations):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_streaming', '--database-url', args.database_url,
+                 '--hours', str(args.hours), '--case', case],
+                check=True, capture_output=True, text=True
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        samples.sort(key=lambda sample: sample['ttfb'])
+        median = samples[len(samples) // 2]
+        median['peak_rss_mb'] = f"{max(sample['peak_rss_mb'] for sample in samples):.1f}"
+        rows.append((case, median))
+
+    report(
+        f"GET of a completed {args.hours:g} hour transcript (median of {args.iterations} runs, worst peak RSS)",
+        rows,
+        columns=('status', 'bytes', 'ttfb', 'total', 'peak_rss_mb')
+    )
+
+
+if __name__ == '__main__':
+    main()
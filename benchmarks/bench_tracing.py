@@ -0,0 +1,107 @@
+"""
+Request latency with tracing off and with every request traced.
+
+Completes --transcripts short transcripts, then times a page of the list,
+a text download and a status check that polls AssemblyAI (replaced by a
+sleep of --poll-ms), first with tracing off and then with every request
+traced to a JSON lines file, which records a span for the request, the
+DRF action, each query and the upstream call. The exporter thread writes
+the spans out while the traced cases run, so its cost is included. Each
+case is run --rounds times, alternating, and its best round is reported.
+"""
+import os
+import json
+import time
+import random
+import tempfile
+from unittest import mock
+
+import requests
+
+from benchmarks.harness import parser, setup_django, measure, report
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--transcripts', type=int, default=20, help='Completed transcripts listed on a page')
+    arg_parser.add_argument('--rounds', type=int, default=3, help='Times each case is run, keeping the best')
+    arg_parser.add_argument('--poll-ms', type=float, default=20, help='Simulated AssemblyAI status check time')
+    args = arg_parser.parse_args()
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.test import Client, override_settings
+    from rest_framework.authtoken.models import Token
+    from audio_transcribe import tracing
+    from audio_transcribe.models import Transcription
+    from audio_transcribe.timeline import save_result
+    from audio_transcribe.views import TranscriptionViewSet, transcript_flight
+    from benchmarks.bench_conditional import canned_result
+
+    TranscriptionViewSet.throttle_classes = []
+    # Every status check goes upstream rather than reusing the last one
+    transcript_flight.freshness = 0
+
+    user, _ = User.objects.get_or_create(username='bench_tracing')
+    token, _ = Token.objects.get_or_create(user=user)
+    Transcription.objects.filter(user=user).delete()
+    result = canned_result(2, random.Random(42))
+    for i in range(args.transcripts):
+        transcription = Transcription.objects.create(
+            transcript_id=f"bench_tracing_{i}", user=user, status='processing', audio_url=''
+        )
+        save_result(transcription, result)
+    Transcription.objects.create(
+        transcript_id='bench_tracing_running', user=user, status='processing', audio_url=''
+    )
+
+    def send(method, url, **kwargs):
+        time.sleep(args.poll_ms / 1000)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'id': url.rsplit('/', 1)[1], 'status': 'processing'}).encode('utf-8')
+        return response
+
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+    urls = {
+        'list': f"/api/transcribe/?page_size={args.transcripts}",
+        'txt': '/api/transcribe/bench_tracing_0/download/?type=txt',
+        'status': '/api/transcribe/bench_tracing_running/',
+    }
+
+    def get(url):
+        response = client.get(url, secure=True)
+        assert response.status_code == 200, response.status_code
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    trace_file = os.path.join(tempfile.mkdtemp(), 'trace.jsonl')
+    cases = (('off', ''), ('traced', trace_file))
+    rows = []
+    p50 = {}
+    with mock.patch('audio_transcribe.assemblyai._send', side_effect=send), \
+            override_settings(TRACE_SAMPLE_RATE=1.0, TRACE_FLUSH_SECONDS=0.5):
+        for name, url in urls.items():
+            best = {}
+            # Alternated, and the best round kept, so drift on a busy machine doesn't favour either case
+            for _ in range(args.rounds):
+                for case, path in cases:
+                    with override_settings(TRACE_FILE=path):
+                        stats = measure(lambda: get(url), iterations=args.iterations)
+                    if case not in best or stats['p50'] < best[case]['p50']:
+                        best[case] = stats
+            for case, _ in cases:
+                rows.append((f"{name}, {case}", best[case]))
+                p50[name, case] = best[case]['p50']
+    tracing.exporter.flush()
+
+    report('Requests with tracing off and on', rows)
+    with open(trace_file) as f:
+        spans = sum(1 for _ in f)
+    print(f"\n{spans} spans exported")
+    for name in urls:
+        overhead = (p50[name, 'traced'] - p50[name, 'off']) / p50[name, 'off'] * 100
+        print(f"{name}: {overhead:+.1f}% at p50")
+
+
+if __name__ == '__main__':
+    main()
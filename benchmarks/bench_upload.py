@@ -0,0 +1,90 @@
+"""
+Upload latency with submission to AssemblyAI inline and in the background.
+
+Posts a short WAV file to the upload endpoint with AssemblyAI's upload and
+transcript creation replaced by sleeps of --upload-ms and --create-ms.
+"inline" is the default mode, where the request waits for both; "async"
+sets ASYNC_SUBMISSION, where the request only spools the audio and the
+submission happens in a background thread.
+"""
+import io
+import time
+import wave
+from unittest import mock
+
+from benchmarks.harness import parser, setup_django, measure, report
+
+
+def make_wav(seconds=5, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b'\x00\x00' * rate * seconds)
+    return buffer.getvalue()
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--upload-ms', type=float, default=400, help='Simulated AssemblyAI upload time')
+    arg_parser.add_argument('--create-ms', type=float, default=150, help='Simulated transcript creation time')
+    args = arg_parser.parse_args()
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client, override_settings
+    from rest_framework.authtoken.models import Token
+    from audio_transcribe import admission
+    from audio_transcribe.models import Transcription
+    from audio_transcribe.views import TranscriptionViewSet
+
+    TranscriptionViewSet.throttle_classes = []
+
+    user, _ = User.objects.get_or_create(username='bench_upload')
+    token, _ = Token.objects.get_or_create(user=user)
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {token.key}")
+    audio = make_wav()
+    created = []
+
+    def upload_file(file_path):
+        time.sleep(args.upload_ms / 1000)
+        return 'https://cdn.example.com/bench'
+
+    def create_transcript(audio_url, language_code=None, auto_detect=False):
+        time.sleep(args.create_ms / 1000)
+        created.append(audio_url)
+        return {'id': f"bench_upload_{len(created)}", 'status': 'queued'}
+
+    def upload():
+        response = client.post(
+            '/api/transcribe/upload/',
+            {'file': SimpleUploadedFile('bench.wav', audio, content_type='audio/wav')},
+            secure=True
+        )
+        assert response.status_code in (200, 202), response.content
+
+    rows = []
+    with mock.patch('audio_transcribe.assemblyai.upload_file', side_effect=upload_file), \
+            mock.patch('audio_transcribe.assemblyai.create_transcript', side_effect=create_transcript):
+        for case, asynchronous in (('inline', False), ('async', True)):
+            with override_settings(
+                ASYNC_SUBMISSION=asynchronous, MAX_UPSTREAM_JOBS=10 ** 6, AUDIO_MINUTES_PER_DAY=0,
+                LOCAL_TRANSCRIPTION_MAX_SECONDS=0
+            ):
+                rows.append((case, measure(upload, iterations=args.iterations)))
+                # Let background submissions finish before the next case
+                while Transcription.objects.filter(
+                    user=user, status__in=(admission.PENDING_SUBMIT, admission.SUBMITTING)
+                ).exists():
+                    time.sleep(0.05)
+
+    report(
+        f"POST /api/transcribe/upload/ with {args.upload_ms:g}ms upload and {args.create_ms:g}ms create upstream",
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Usage statistics from the rollups against aggregating the transcriptions.
+
+Creates --transcripts transcriptions spread over --users users, --days days
+and a few languages and statuses, then times the usage endpoint's query
+(jobs, audio minutes and failures per day and language over the last 30
+days), read from the rollups and computed from the transcription table.
+Also times a status change, which now moves the job between rollup rows
+in the same transaction, with and without that bookkeeping.
+"""
+import random
+from datetime import timedelta
+from unittest import mock
+
+from benchmarks.harness import parser, setup_django, measure, report
+
+LANGUAGES = ('en', 'es', 'fr', 'de', 'auto')
+STATUSES = ('completed',) * 8 + ('error', 'processing')
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--transcripts', type=int, default=100000, help='Transcriptions to aggregate')
+    arg_parser.add_argument('--users', type=int, default=50, help='Users the transcriptions belong to')
+    arg_parser.add_argument('--days', type=int, default=365, help='Days the transcriptions are spread over')
+    args = arg_parser.parse_args()
+    setup_django(args.database_url)
+
+    from django.contrib.auth.models import User
+    from django.db.models import Count, Q, Sum
+    from django.db.models.functions import TruncDate
+    from django.utils import timezone
+    from audio_transcribe import usage
+    from audio_transcribe.models import Transcription
+
+    users = [User.objects.get_or_create(username=f"bench_usage_{i}")[0] for i in range(args.users)]
+    Transcription.objects.filter(user__in=users).delete()
+    rng = random.Random(42)
+    now = timezone.now()
+    # bulk_create skips Transcription.save, so the rollups are rebuilt afterwards
+    Transcription.objects.bulk_create([
+        Transcription(
+            transcript_id=f"bench_usage_{i}", user=rng.choice(users), status=rng.choice(STATUSES), audio_url='',
+            language_code=rng.choice(LANGUAGES), audio_duration=rng.uniform(10, 1800)
+        )
+        for i in range(args.transcripts)
+    ], batch_size=5000)
+    # created_at is set on insert, so the rows are spread over the days afterwards
+    first = Transcription.objects.filter(user__in=users).order_by('pk').values_list('pk', flat=True).first()
+    per_day = -(-args.transcripts // args.days)
+    for day in range(args.days):
+        Transcription.objects.filter(
+            pk__gte=first + day * per_day, pk__lt=first + (day + 1) * per_day
+        ).update(created_at=now - timedelta(days=day))
+    rows = usage.rebuild()
+    print(f"{args.transcripts} transcriptions in {rows} rollup rows")
+
+    since, until = usage.date_range()
+
+    def from_rollups():
+        return usage.usage(since, until, ('day', 'language'))
+
+    def from_transcriptions():
+        return list(
+            Transcription.objects.filter(created_at__date__gte=since, created_at__date__lte=until)
+            .annotate(day=TruncDate('created_at')).values('day', 'language_code').order_by('day', 'language_code')
+            .annotate(
+                jobs=Count('id'), audio_seconds=Sum('audio_duration'),
+                completed=Count('id', filter=Q(status='completed')), failed=Count('id', filter=Q(status='error'))
+            )
+        )
+
+    job = Transcription.objects.filter(user__in=users).first()
+    statuses = iter(STATUSES * 10 ** 6)
+
+    def change_status():
+        job.status = next(statuses)
+        job.save(update_fields=['status'])
+
+    results = [
+        ('per day and language, rollups', measure(from_rollups, iterations=args.iterations)),
+        ('per day and language, scan', measure(from_transcriptions, iterations=args.iterations)),
+        ('status change', measure(change_status, iterations=args.iterations)),
+    ]
+    with mock.patch('audio_transcribe.usage.stored_values'), mock.patch('audio_transcribe.usage.record_change'):
+        results.append(('status change, no rollups', measure(change_status, iterations=args.iterations)))
+
+    report(f"Usage over 30 days of {args.transcripts} transcriptions", results)
+
+
+if __name__ == '__main__':
+    main()
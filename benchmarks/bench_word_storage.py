@@ -0,0 +1,103 @@
+"""
+Storage size and decode time of word timings, packed columns vs plain JSON.
+
+Generates --transcripts synthetic word arrays for --minutes of speech each
+(about 2.5 words per second, Zipf-distributed vocabulary, a few speakers),
+then compares the JSON AssemblyAI returns with the packed format in
+audio_transcribe/packing.py: bytes stored, decoding every word, and reading
+a 30 second window.
+"""
+import sys
+import json
+import zlib
+import random
+import itertools
+
+from benchmarks.harness import PROJECT_ROOT, parser, measure, report
+
+VOCABULARY_SIZE = 20000
+WORDS_PER_SECOND = 2.5
+WINDOW_MS = 30000
+
+
+def make_words(minutes, rng, vocabulary, cumulative):
+    words = []
+    clock = 0
+    speaker = 'A'
+    for token in rng.choices(vocabulary, cum_weights=cumulative, k=int(minutes * 60 * WORDS_PER_SECOND)):
+        clock += rng.randint(20, 200)
+        duration = rng.randint(80, 500)
+        if rng.random() < 0.02:
+            speaker = rng.choice('ABCD')
+        words.append({
+            'text': token,
+            'start': clock,
+            'end': clock + duration,
+            'confidence': round(rng.uniform(0.5, 1.0), 5),
+            'speaker': speaker,
+        })
+        clock += duration
+    return words
+
+
+def main():
+    arg_parser = parser(__doc__, database=False)
+    arg_parser.add_argument('--minutes', type=float, default=60, help='Length of each synthetic transcript')
+    arg_parser.add_argument('--transcripts', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    sys.path.insert(0, PROJECT_ROOT)
+    from audio_transcribe.packing import pack_words, PackedWords
+
+    rng = random.Random(42)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = list({''.join(rng.choice(letters) for _ in range(rng.randint(2, 9))) for _ in range(VOCABULARY_SIZE)})
+    cumulative = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocabulary) + 1)))
+
+    transcripts = [make_words(args.minutes, rng, vocabulary, cumulative) for _ in range(args.transcripts)]
+    as_json = [json.dumps(words).encode('utf-8') for words in transcripts]
+    packed = [pack_words(words) for words in transcripts]
+    word_count = sum(len(words) for words in transcripts)
+
+    sizes = []
+    for name, blobs in (
+        ('JSON', as_json),
+        ('JSON + zlib', [zlib.compress(blob, 6) for blob in as_json]),
+        ('packed columns', packed),
+    ):
+        total = sum(len(blob) for blob in blobs)
+        sizes.append((name, {
+            'bytes': total // len(blobs),
+            'bytes/word': f"{total / word_count:.1f}",
+            'ratio': f"{total / sum(len(blob) for blob in as_json):.3f}",
+        }))
+    report(
+        f"Storage per {args.minutes:g} minute transcript ({word_count // len(transcripts)} words)",
+        sizes,
+        columns=('bytes', 'bytes/word', 'ratio')
+    )
+
+    cycle = itertools.cycle(range(len(transcripts)))
+    duration_ms = int(args.minutes * 60 * 1000)
+
+    def json_window():
+        i = next(cycle)
+        start = rng.randint(0, duration_ms - WINDOW_MS)
+        return [w for w in json.loads(as_json[i]) if w['start'] < start + WINDOW_MS and w['end'] > start]
+
+    def packed_window():
+        i = next(cycle)
+        start = rng.randint(0, duration_ms - WINDOW_MS)
+        return PackedWords(packed[i]).overlapping(start, start + WINDOW_MS)
+
+    rows = [
+        ('JSON, all words', measure(lambda: json.loads(as_json[next(cycle)]), iterations=args.iterations)),
+        ('packed, all words', measure(lambda: PackedWords(packed[next(cycle)]).words(), iterations=args.iterations)),
+        ('JSON, 30s window', measure(json_window, iterations=args.iterations)),
+        ('packed, 30s window', measure(packed_window, iterations=args.iterations)),
+    ]
+    report(f"Decode time per {args.minutes:g} minute transcript", rows)
+
+
+if __name__ == '__main__':
+    main()
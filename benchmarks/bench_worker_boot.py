@@ -0,0 +1,148 @@
+"""
+Worker boot time and memory under gunicorn, with and without --preload.
+
+Starts gunicorn the way the Procfile does and measures:
+- ready: seconds from launch until every worker answers
+- pss_mb: proportional set size of the master and workers together, which
+  counts pages shared between forked processes once (Linux only)
+- recycle stall: the slowest request while a single worker is recycled
+  every --max-requests requests, which is the boot cost clients see
+
+Requires gunicorn. Run from the project root:
+
+    python -m benchmarks.bench_worker_boot --database-url sqlite:////tmp/bench.sqlite3
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+import urllib.error
+import urllib.request
+
+from benchmarks.harness import PROJECT_ROOT, parser, setup_django, report
+
+# Served entirely by the project's stack without touching AssemblyAI
+PROBE_PATH = '/api/'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(url):
+    started = time.perf_counter()
+    try:
+        urllib.request.urlopen(url, timeout=30).read()
+    except urllib.error.HTTPError:
+        pass  # Any answer from Django will do
+    return time.perf_counter() - started
+
+
+def start(database_url, port, workers, preload, max_requests=0):
+    command = [
+        sys.executable, '-m', 'gunicorn', 'speech_to_text_api.wsgi:application',
+        '--bind', f"127.0.0.1:{port}", '--workers', str(workers), '--threads', '2',
+        '--max-requests', str(max_requests), '--log-level', 'warning',
+    ]
+    if preload:
+        command.append('--preload')
+    # DEBUG avoids the HTTPS redirect, which would answer before the application runs
+    env = dict(os.environ, DATABASE_URL=database_url, DJANGO_DEBUG='True')
+    return subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stderr=subprocess.DEVNULL)
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def pss_mb(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def wait_ready(url, master, workers, timeout=60):
+    """Wait until the expected number of workers exist and a request succeeds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if len(children(master.pid)) >= workers:
+                get(url)
+                return
+        except (OSError, FileNotFoundError):
+            pass
+        time.sleep(0.01)
+    raise RuntimeError('gunicorn did not start')
+
+
+def stop(master):
+    master.send_signal(signal.SIGTERM)
+    master.wait(timeout=30)
+
+
+def boot(args, preload):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{PROBE_PATH}"
+    started = time.perf_counter()
+    master = start(args.database_url, port, args.workers, preload)
+    try:
+        wait_ready(url, master, args.workers)
+        ready = time.perf_counter() - started
+        # Touch every worker so each has run the application at least once
+        for _ in range(args.workers * 20):
+            get(url)
+        memory = pss_mb(master.pid) + sum(pss_mb(worker) for worker in children(master.pid))
+    finally:
+        stop(master)
+    return ready, memory
+
+
+def recycle_stall(args, preload):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{PROBE_PATH}"
+    master = start(args.database_url, port, 1, preload, max_requests=args.max_requests)
+    try:
+        wait_ready(url, master, 1)
+        latencies = sorted(get(url) for _ in range(args.max_requests * args.recycles))
+    finally:
+        stop(master)
+    return latencies[-1], latencies[len(latencies) // 2]
+
+
+def main():
+    arg_parser = parser(__doc__)
+    arg_parser.add_argument('--workers', type=int, default=4)
+    arg_parser.add_argument('--max-requests', type=int, default=50, help='Requests per worker before it is recycled')
+    arg_parser.add_argument('--recycles', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    # Creates the schema once, so workers only boot
+    setup_django(args.database_url)
+
+    rows = []
+    for preload in (False, True):
+        ready, memory = boot(args, preload)
+        stall, median = recycle_stall(args, preload)
+        rows.append(('--preload' if preload else 'no preload', {
+            'ready': ready * 1000,
+            'pss_mb': f"{memory:.1f}",
+            'stall': stall * 1000,
+            'p50': median * 1000,
+        }))
+
+    report(
+        f"gunicorn with {args.workers} workers; stall = slowest request with a worker recycled every "
+        f"{args.max_requests} requests",
+        rows, columns=('ready', 'pss_mb', 'stall', 'p50')
+    )
+
+
+if __name__ == '__main__':
+    main()
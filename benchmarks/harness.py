@@ -0,0 +1,75 @@
+"""
+Shared helpers for the benchmark scripts in this directory.
+
+Benchmarks that need a database run against a scratch one given with
+--database-url, never the one configured in .env. All are run from the
+project root, e.g.:
+
+    python -m benchmarks.bench_search --database-url sqlite:////tmp/bench.sqlite3
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parser(description, database=True):
+    """Argument parser with the options every benchmark takes"""
+    arg_parser = argparse.ArgumentParser(description=description)
+    if database:
+        arg_parser.add_argument(
+            '--database-url', required=True,
+            help='Scratch database to run against, e.g. sqlite:////tmp/bench.sqlite3'
+        )
+    arg_parser.add_argument('--iterations', type=int, default=50, help='Timed runs per case')
+    return arg_parser
+
+
+def setup_django(database_url):
+    """Point Django at the scratch database and bring its schema up to date"""
+    sys.path.insert(0, PROJECT_ROOT)
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'speech_to_text_api.settings')
+    os.environ.setdefault('ASSEMBLYAI_API_KEY', 'benchmark')
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0, skip_checks=True)
+
+
+def measure(fn, iterations=50, warmup=3):
+    """Run fn repeatedly and return latency statistics in milliseconds"""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'max': timings[-1],
+    }
+
+
+def report(title, rows, columns=('p50', 'p95', 'p99', 'max'), unit='ms'):
+    """Print one line per case with the given statistics"""
+    print(f"\n{title}")
+    width = max(len(name) for name, _ in rows) + 2
+    print(' ' * width + ''.join(f"{column:>12}" for column in columns))
+    for name, stats in rows:
+        cells = ''.join(
+            f"{stats[column]:>10.2f}{unit}" if isinstance(stats[column], float) else f"{stats[column]:>12}"
+            for column in columns
+        )
+        print(f"{name:<{width}}{cells}")
@@ -0,0 +1,154 @@
+"""
+Import-time budget for worker boot.
+
+Boots the WSGI application the way a gunicorn worker does, under
+python -X importtime, and reports how long the project's own modules take
+to import together with everything they are first to import. Exits with
+status 1 when the median over --runs boots exceeds --budget-ms, listing
+the heaviest imports so a regression can be traced to the line that
+added it. Also reports total boot time and resident memory after boot.
+
+    python -m benchmarks.import_budget --budget-ms 40
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.harness import PROJECT_ROOT
+
+PROJECT_PACKAGES = ('audio_transcribe', 'api_auth', 'speech_to_text_api')
+
+# Entry points only call into the framework, and the framework costs the same
+# whatever the project does, so neither is counted against the budget
+ENTRY_POINTS = ('speech_to_text_api.wsgi',)
+FRAMEWORK_PACKAGES = ('django', 'rest_framework')
+
+# -X importtime only logs import statements, so Django's import_module calls
+# (settings, apps, models, URLconfs) are routed through __import__ to show up
+BOOT = """
+import importlib, importlib.util, json, resource, sys, time
+
+def import_module(name, package=None):
+    if name.startswith('.'):
+        name = importlib.util.resolve_name(name, package)
+    __import__(name)
+    return sys.modules[name]
+
+importlib.import_module = import_module
+started = time.perf_counter()
+import speech_to_text_api.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({
+    'boot_ms': (time.perf_counter() - started) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+}))
+"""
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+
+class Node:
+    def __init__(self, name, self_us, cumulative_us, depth):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+        self.children = []
+
+
+def parse_importtime(output):
+    """Import tree from -X importtime output, which lists each module after its children"""
+    stack = []
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        node = Node(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+        while stack and stack[-1].depth > node.depth:
+            node.children.insert(0, stack.pop())
+        stack.append(node)
+    return stack
+
+
+def is_project(name):
+    return name.split('.')[0] in PROJECT_PACKAGES and name not in ENTRY_POINTS
+
+
+def is_framework(name):
+    return name.split('.')[0] in FRAMEWORK_PACKAGES
+
+
+def own_cost(node):
+    """Import time of a module and everything it was first to import, leaving out the framework"""
+    return node.self_us + sum(own_cost(child) for child in node.children if not is_framework(child.name))
+
+
+def project_imports(roots):
+    """Outermost project modules, and the third-party or stdlib modules they were first to import"""
+    modules, dependencies = [], []
+
+    def walk(node, in_project):
+        if is_project(node.name):
+            if not in_project:
+                modules.append(node)
+            in_project = True
+        elif in_project:
+            if not is_framework(node.name):
+                dependencies.append(node)
+            return
+        for child in node.children:
+            walk(child, in_project)
+
+    for root in roots:
+        walk(root, False)
+    return modules, dependencies
+
+
+def boot_once():
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT, DJANGO_SETTINGS_MODULE='speech_to_text_api.settings')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    stats = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules, dependencies = project_imports(parse_importtime(completed.stderr))
+    stats['project_ms'] = sum(own_cost(node) for node in modules) / 1000
+    return stats, modules, dependencies
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--runs', type=int, default=5, help='Boots to take the median of')
+    arg_parser.add_argument('--budget-ms', type=float, default=40, help='Allowed import time of project modules and their non-framework imports')
+    arg_parser.add_argument('--top', type=int, default=10, help='Heaviest imports to list')
+    args = arg_parser.parse_args()
+
+    runs = [boot_once() for _ in range(args.runs)]
+    runs.sort(key=lambda run: run[0]['project_ms'])
+    stats, modules, dependencies = runs[len(runs) // 2]
+
+    print(f"Worker boot (median of {args.runs}): {statistics.median(run[0]['boot_ms'] for run in runs):.0f}ms, "
+          f"{statistics.median(run[0]['rss_mb'] for run in runs):.1f}MB RSS, {stats['modules']} modules")
+    print(f"Project imports: {stats['project_ms']:.1f}ms (budget {args.budget_ms:g}ms)")
+
+    print("\nHeaviest imports first made by project modules:")
+    for node in sorted(dependencies, key=own_cost, reverse=True)[:args.top]:
+        print(f"  {own_cost(node) / 1000:8.1f}ms  {node.name}")
+    print("\nProject modules, including what they import:")
+    for node in sorted(modules, key=own_cost, reverse=True)[:args.top]:
+        print(f"  {own_cost(node) / 1000:8.1f}ms  {node.name}")
+
+    if stats['project_ms'] > args.budget_ms:
+        print(f"\nOver budget by {stats['project_ms'] - args.budget_ms:.1f}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
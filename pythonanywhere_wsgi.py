@@ -11,6 +11,11 @@ from dotenv import load_dotenv
 project_folder = os.path.expanduser(path)
 load_dotenv(os.path.join(project_folder, '.env'))
 
+# Web apps here run no job worker beside them, so unless an Always-on task
+# runs process_submissions (and sets JOB_WORKERS=True), the web app advances
+# queued and running jobs itself from a background thread
+os.environ.setdefault('JOB_WORKERS', 'False')
+
 # Set environment variable for Django settings module
 os.environ['DJANGO_SETTINGS_MODULE'] = 'speech_to_text_api.settings'
 
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from audio_transcribe import profiling, replicas, tracing
+from audio_transcribe.deadline import budget
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses fall back to gzip
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+# Already compressed formats gain nothing from another pass
+SKIP_CONTENT_TYPES = ('application/zip', 'audio/', 'video/', 'image/')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses with brotli when the client accepts it and the brotli
+    package is installed, and with Django's gzip otherwise. Bodies smaller
+    than COMPRESSION_MIN_BYTES are sent as they are.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if response.get('Content-Type', '').startswith(SKIP_CONTENT_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or response.streaming or not re_accepts_brotli.search(accept_encoding):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(response.content))
+        # The encoded body differs byte for byte, so the tag can only be weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class DeadlineMiddleware:
+    """
+    Give each request REQUEST_DEADLINE_SECONDS for its calls to AssemblyAI
+    (see audio_transcribe/deadline.py), so it is answered before gunicorn's
+    --timeout kills the worker. 0 turns the deadline off.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REQUEST_DEADLINE_SECONDS:
+            return self.get_response(request)
+        with budget(settings.REQUEST_DEADLINE_SECONDS):
+            return self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """
+    Profile sampled requests, requests from admins sending X-Profile, and
+    requests slower than PROFILE_SLOW_MS (see audio_transcribe/profiling.py).
+    Everything but the admin header is off unless configured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return profiling.profile_request(request, self.get_response)
+
+
+class TracingMiddleware:
+    """
+    Record each request as a trace, or as part of the caller's when it sends
+    a traceparent header (see audio_transcribe/tracing.py). Off unless
+    TRACE_FILE or TRACE_COLLECTOR_URL is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return tracing.trace_request(request, self.get_response)
+
+
+class ReplicaMiddleware:
+    """
+    Route the reads of read-only API actions to a read replica, keeping
+    writes, reads after them and clients that wrote recently on the primary
+    (see audio_transcribe/replicas.py). Off unless DATABASE_REPLICA_URLS is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return replicas.route_request(request, self.get_response)
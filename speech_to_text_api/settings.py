@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 import dj_database_url
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -33,7 +34,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'speech_to_text_api.middleware.TracingMiddleware',
+    'speech_to_text_api.middleware.DeadlineMiddleware',
+    'speech_to_text_api.middleware.ReplicaMiddleware',
+    'speech_to_text_api.middleware.ProfilingMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  
+    'speech_to_text_api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +77,20 @@ DATABASES = {
     )
 }
 
+# Read replicas of the default database, as comma separated database URLs.
+# Read-only API actions read from one of them, and everything else from the
+# primary; clients stay on the primary for REPLICA_STICKY_SECONDS after they
+# write, so replication lag doesn't hide their own changes from them
+DATABASE_REPLICAS = []
+for index, url in enumerate(u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()):
+    alias = f"replica{index + 1}"
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    # Tests read the replicas' rows from the test default database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['audio_transcribe.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -106,8 +126,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'audio_transcribe.throttling.AnonSlidingWindowThrottle',
+        'audio_transcribe.throttling.UserSlidingWindowThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/hour',  
@@ -131,9 +151,139 @@ CSRF_COOKIE_HTTPONLY = False
 
 CORS_ALLOW_ALL_ORIGINS = True if DEBUG else False
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', '').split(',') if not DEBUG else []
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'Retry-After']
 
 ASSEMBLYAI_API_KEY = os.getenv('ASSEMBLYAI_API_KEY')
 
+# Shared cache for state that must be consistent across workers and dynos
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                # Heroku Redis uses self-signed certificates on rediss:// URLs
+                'CONNECTION_POOL_KWARGS': {'ssl_cert_reqs': None} if REDIS_URL.startswith('rediss://') else {},
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Circuit breaker around AssemblyAI
+CIRCUIT_BREAKER_WINDOW = int(os.getenv('CIRCUIT_BREAKER_WINDOW', '30'))  # seconds per counting bucket
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv('CIRCUIT_BREAKER_MIN_CALLS', '10'))
+CIRCUIT_BREAKER_FAILURE_RATIO = float(os.getenv('CIRCUIT_BREAKER_FAILURE_RATIO', '0.5'))
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_BREAKER_SLOW_CALL_SECONDS', '10'))
+CIRCUIT_BREAKER_RESET_TIMEOUT = int(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', '30'))
+
+# Seconds a request may spend on calls to AssemblyAI before it is answered without
+# them (0 for no limit). Keep it below gunicorn's --timeout (60 in the Procfile),
+# so requests are answered before the worker is killed
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '50'))
+
+# Request profiling: the share of requests profiled (e.g. 0.001), and requests
+# running longer than PROFILE_SLOW_MS (0 for none) are profiled from then on.
+# Stacks are sampled every PROFILE_INTERVAL_MS and the newest PROFILE_KEEP
+# profiles are kept in PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+
+# Tracing of requests, upstream calls, queries and jobs, off unless spans are
+# exported to TRACE_FILE (JSON lines) and/or POSTed to TRACE_COLLECTOR_URL.
+# TRACE_SAMPLE_RATE is the share of new traces recorded, and queued spans are
+# exported every TRACE_FLUSH_SECONDS, dropping any beyond TRACE_QUEUE_SIZE
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL', '')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+TRACE_FLUSH_SECONDS = float(os.getenv('TRACE_FLUSH_SECONDS', '2'))
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '10000'))
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'speech-to-text-api')
+
+# Seconds a fetched transcript status is shared between concurrent retrieves
+RETRIEVE_FRESHNESS_SECONDS = float(os.getenv('RETRIEVE_FRESHNESS_SECONDS', '2'))
+
+# Minutes of audio a client can have transcribed per day (0 for no limit)
+AUDIO_MINUTES_PER_DAY = int(os.getenv('AUDIO_MINUTES_PER_DAY', '120'))
+AUDIO_MINUTES_PER_DAY_ANONYMOUS = int(os.getenv('AUDIO_MINUTES_PER_DAY_ANONYMOUS', '15'))
+
+# Response compression: bodies below this size are sent uncompressed, and brotli
+# (when installed) uses a quality suited to compressing on every request
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+
+# Local storage for audio waiting to be submitted upstream
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# With AWS_STORAGE_BUCKET_NAME set, audio is stored in that S3 bucket (or an
+# S3-compatible store at AWS_S3_ENDPOINT_URL) instead of MEDIA_ROOT. Clients
+# then upload to it directly and AssemblyAI fetches from it with presigned URLs.
+# Credentials are read from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY.
+AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
+if AWS_STORAGE_BUCKET_NAME:
+    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL')
+    AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
+    AWS_DEFAULT_ACL = None
+    AWS_QUERYSTRING_AUTH = True
+    AWS_QUERYSTRING_EXPIRE = int(os.getenv('AWS_QUERYSTRING_EXPIRE', '3600'))  # seconds AssemblyAI has to fetch audio
+
+# Direct uploads: how long an upload token is valid and the largest file it accepts
+DIRECT_UPLOAD_EXPIRES = int(os.getenv('DIRECT_UPLOAD_EXPIRES', '900'))
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Upstream admission control shared by every worker and dyno
+MAX_UPSTREAM_JOBS = int(os.getenv('MAX_UPSTREAM_JOBS', '8'))
+UPSTREAM_SLOT_TTL = int(os.getenv('UPSTREAM_SLOT_TTL', '1800'))  # seconds before an unfinished job stops holding a slot
+ADMISSION_AUTHENTICATED_WEIGHT = float(os.getenv('ADMISSION_AUTHENTICATED_WEIGHT', '4'))
+ADMISSION_ANONYMOUS_WEIGHT = float(os.getenv('ADMISSION_ANONYMOUS_WEIGHT', '1'))
+
+# Responses to requests sent with an Idempotency-Key are replayed to retries for
+# IDEMPOTENCY_KEY_TTL seconds; a retry arriving while the original is still
+# running waits up to IDEMPOTENCY_WAIT_SECONDS for its response
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+
+# With ASYNC_SUBMISSION, uploads are spooled and answered with 202 straight away,
+# and each web worker submits them to AssemblyAI from ASYNC_SUBMISSION_THREADS
+# background threads instead of holding the request open
+ASYNC_SUBMISSION = os.getenv('ASYNC_SUBMISSION', 'False').lower() == 'true'
+ASYNC_SUBMISSION_THREADS = int(os.getenv('ASYNC_SUBMISSION_THREADS', '4'))
+
+# Job workers (process_submissions) lease JOB_BATCH_SIZE due jobs at a time for
+# JOB_LEASE_SECONDS, which should cover polling the whole batch, and fail a job
+# after JOB_MAX_ATTEMPTS polls in a row could not reach it
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '10'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '8'))
+# Jobs still submitting after SUBMIT_LEASE_SECONDS are taken to have been
+# interrupted, and are queued again (or failed, when their audio is gone)
+SUBMIT_LEASE_SECONDS = int(os.getenv('SUBMIT_LEASE_SECONDS', '600'))
+# Whether job workers are deployed (the worker process in the Procfile,
+# heroku.yml and render.yaml). Without them, each web process advances jobs
+# from a background thread, or queued uploads would never be submitted
+JOB_WORKERS = os.getenv('JOB_WORKERS', 'True').lower() == 'true'
+
+# Offline transcription of short clips with faster-whisper, when it is installed.
+# Clips up to LOCAL_TRANSCRIPTION_MAX_SECONDS long (0 sends everything upstream)
+# are transcribed in a pool of LOCAL_TRANSCRIPTION_WORKERS processes per web
+# worker; jobs not finished within LOCAL_TRANSCRIPTION_TIMEOUT seconds go to AssemblyAI
+LOCAL_TRANSCRIPTION_MAX_SECONDS = float(os.getenv('LOCAL_TRANSCRIPTION_MAX_SECONDS', '60'))
+LOCAL_TRANSCRIPTION_WORKERS = int(os.getenv('LOCAL_TRANSCRIPTION_WORKERS', '1'))
+LOCAL_TRANSCRIPTION_MODEL = os.getenv('LOCAL_TRANSCRIPTION_MODEL', 'base')
+LOCAL_TRANSCRIPTION_COMPUTE_TYPE = os.getenv('LOCAL_TRANSCRIPTION_COMPUTE_TYPE', 'int8')
+LOCAL_TRANSCRIPTION_TIMEOUT = int(os.getenv('LOCAL_TRANSCRIPTION_TIMEOUT', '600'))
+
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
     SESSION_COOKIE_SECURE = True